@@ -1,19 +1,42 @@
 import os
 import sys
 import copy
-import json
 import logging
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from requests import ConnectionError
 from requests import Response
+from requests.exceptions import Timeout
+from requests.adapters import HTTPAdapter
 from requests.sessions import Session
 from ssl import SSLError
+try:
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from urlparse import urlparse, parse_qsl
+from avi_lbaasv2.avi_api.avi_retry import (
+    RetryPolicy, RETRY_CONNECTION, RETRY_SESSION, RETRY_SERVER,
+    RETRY_THROTTLED)
+from avi_lbaasv2.avi_api.avi_breaker import ControllerUnavailable  # noqa
+from avi_lbaasv2.avi_api.avi_metrics import api_metrics, object_type
+from avi_lbaasv2.avi_api import avi_codec, avi_metrics, avi_trace
+from avi_lbaasv2.avi_api.avi_log import LazyData, sampled
+from avi_lbaasv2.avi_api.avi_sync import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 global sessionDict
-sessionDict = {}
+# sessions ordered by last use, least recently used first
+sessionDict = OrderedDict()
+# Optional JSON decoder for the response bodies; see set_json_decoder
+_json_decoder = None
+# sessionLock guards compound read-modify-write of sessionDict across
+# threads and greenthreads. loginFlight makes sure only one login per
+# session key is in progress; concurrent callers wait for its result.
+sessionLock = threading.RLock()
+loginFlight = SingleFlight()
 
 
 def avi_timedelta(td):
@@ -53,10 +76,24 @@ def avi_sdk_syslog_logger(logger_name='avi.sdk'):
     return log
 
 
+def set_json_decoder(decoder):
+    '''
+    Sets the JSON decoder used by ApiResponse.json. decoder is a callable
+    taking the response body bytes and returning the decoded object e.g.
+    a faster JSON library's loads. None restores the avi_codec decoder.
+    '''
+    global _json_decoder
+    _json_decoder = decoder
+
+
 class ObjectNotFound(Exception):
     pass
 
 
+def _query(params):
+    return dict((k, str(v)) for k, v in params.items())
+
+
 class APIError(Exception):
     def __init__(self, arg, rsp=None):
         self.args = [arg, rsp]
@@ -74,27 +111,75 @@ class APINotImplemented(Exception):
 
 class ApiResponse(Response):
     """
-    Returns copy of the requests.Response object provides additional helper
-    routines
+    Wraps the requests.Response object without copying it and provides
+    additional helper routines
         1. obj: returns dictionary of Avi Object
+    Attribute access is delegated to the wrapped response and the response
+    body is JSON decoded at most once.
     """
+    _WRAPPER_ATTRS = ('_rsp', '_obj', '_decoded')
+
     def __init__(self, rsp):
-        super(ApiResponse, self).__init__()
-        for k, v in list(rsp.__dict__.items()):
-            setattr(self, k, v)
+        # Response.__init__ is intentionally not called; all the response
+        # attributes are looked up on the wrapped response.
+        self._rsp = rsp
+        self._obj = None
+        self._decoded = False
+
+    def __getattr__(self, name):
+        rsp = self.__dict__.get('_rsp')
+        if rsp is None:
+            raise AttributeError(name)
+        return getattr(rsp, name)
+
+    def __setattr__(self, name, value):
+        if name in self._WRAPPER_ATTRS:
+            self.__dict__[name] = value
+        else:
+            setattr(self._rsp, name, value)
+
+    def __getstate__(self):
+        return {'_rsp': self._rsp}
+
+    def __setstate__(self, state):
+        self.__init__(state['_rsp'])
+
+    @property
+    def content(self):
+        return self._rsp.content
+
+    @property
+    def text(self):
+        return self._rsp.text
+
+    @property
+    def response(self):
+        """returns the wrapped requests.Response object"""
+        return self._rsp
+
+    def _decode(self):
+        if not self._decoded:
+            if _json_decoder is not None:
+                self._obj = _json_decoder(self._rsp.content)
+            else:
+                self._obj = avi_codec.loads(self._rsp.content)
+            self._decoded = True
+        return self._obj
 
     def json(self):
         """
         Extends the session default json interface to handle special errors
         and raise Exceptions
         returns the Avi object as a dictionary from rsp.text
+        The decoded object is memoized; callers should copy it before
+        modifying it if the response is used again.
         """
         if self.status_code in (200, 201):
-            if not self.text:
+            if not self.content:
                 # In cases like status_code == 201 the response text could be
                 # empty string.
                 return None
-            return super(ApiResponse, self).json()
+            return self._decode()
         elif self.status_code == 204:
             # No response needed; e.g., delete operation
             return None
@@ -126,6 +211,65 @@ class ApiResponse(Response):
         return resp
 
 
+class AviHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that sizes the connection pool to the Avi Controller, drops
+    connections that were idle longer than the keep-alive timeout and keeps
+    track of pool hits (reused connections) and misses (new connections).
+    """
+    def __init__(self, pool_maxsize=10, pool_block=False,
+                 keepalive_timeout=None, **kwargs):
+        self.keepalive_timeout = keepalive_timeout
+        self.last_used = time.time()
+        self._retired_requests = 0
+        self._retired_connections = 0
+        super(AviHTTPAdapter, self).__init__(
+            pool_maxsize=pool_maxsize, pool_block=pool_block, **kwargs)
+
+    def send(self, request, **kwargs):
+        now = time.time()
+        if (self.keepalive_timeout and
+                now - self.last_used > self.keepalive_timeout):
+            # Controller has most likely closed the idle connections; drop
+            # them instead of failing on the first request after idling.
+            logger.debug('connections idle for %d secs, clearing pool',
+                         now - self.last_used)
+            self.clear_pools()
+        self.last_used = now
+        return super(AviHTTPAdapter, self).send(request, **kwargs)
+
+    def _pools(self):
+        pools = self.poolmanager.pools
+        return [pools[k] for k in pools.keys() if k in pools]
+
+    def clear_pools(self):
+        """closes all pooled connections but keeps the counters"""
+        for pool in self._pools():
+            self._retired_requests += pool.num_requests
+            self._retired_connections += pool.num_connections
+        self.poolmanager.clear()
+
+    def close(self):
+        self.clear_pools()
+        super(AviHTTPAdapter, self).close()
+
+    def pool_stats(self):
+        """
+        returns dictionary with number of requests served over a pooled
+        connection (hits) and over a newly opened connection (misses)
+        """
+        requests = self._retired_requests
+        connections = self._retired_connections
+        for pool in self._pools():
+            requests += pool.num_requests
+            connections += pool.num_connections
+        return {
+            'requests': requests,
+            'hits': max(requests - connections, 0),
+            'misses': connections,
+        }
+
+
 class AviCredentials(object):
     controller = ''
     username = ''
@@ -189,13 +333,27 @@ class ApiSession(Session):
     SESSION_CACHE_EXPIRY = 20*60
     SHARED_USER_HDRS = ['X-CSRFToken', 'Session-Id', 'Referer', 'Content-Type']
     MAX_API_RETRIES = 3
+    RETRY_BACKOFF = 0.5
+    RETRY_BACKOFF_MAX = 10.0
+    # 412 is retried by the callers after refetching the object
+    API_RETRY_CLASSES = (RETRY_CONNECTION, RETRY_SESSION, RETRY_SERVER,
+                         RETRY_THROTTLED)
+    POOL_MAXSIZE = 10
+    MAX_HDR_TEMPLATES = 1024
+    PAGE_SIZE = 200
+    KEEPALIVE_TIMEOUT = 60
+    # cheap authenticated API used to keep idle sessions alive
+    SESSION_KEEPALIVE_PATH = 'cluster'
 
     def __init__(self, controller_ip=None, username=None, password=None,
                  token=None, tenant=None, tenant_uuid=None, verify=False,
                  port=None, timeout=60, api_version=None,
                  retry_conxn_errors=True, data_log=False,
                  avi_credentials=None, session_id=None, csrftoken=None,
-                 lazy_authentication=False, max_api_retries=None):
+                 lazy_authentication=False, max_api_retries=None,
+                 pool_maxsize=None, pool_block=False, keepalive_timeout=None,
+                 retry_policy=None, limiter=None, breaker=None,
+                 session_store=None, metrics=None):
         """
          ApiSession takes ownership of avi_credentials and may update the
          information inside it.
@@ -213,8 +371,28 @@ class ApiSession(Session):
             port in the prefix. The prefix would be 'http://ip'. If port is
             a non-default value, then we concatenate http://ip:port in
             the prefix.
+        03. pool_maxsize is the number of connections kept open to the
+            controller, pool_block makes the callers wait for a free
+            connection instead of opening extra ones and keepalive_timeout
+            is the idle time in seconds after which pooled connections are
+            dropped.
+        04. breaker is the avi_breaker.CircuitBreaker of the controller;
+            while it is open the API calls raise ControllerUnavailable
+            without calling the controller.
+        05. session_store is an avi_session_store.FileSessionStore shared
+            by the processes of the host; they reuse the controller session
+            stored in it and login only when it is rejected.
+        06. metrics is the avi_metrics.ApiMetrics the API calls are
+            accounted in; the process wide api_metrics by default.
         """
         super(ApiSession, self).__init__()
+        self.pool_maxsize = (self.POOL_MAXSIZE if pool_maxsize is None
+                             else int(pool_maxsize))
+        self.pool_block = pool_block
+        self.keepalive_timeout = (
+            self.KEEPALIVE_TIMEOUT if keepalive_timeout is None
+            else int(keepalive_timeout))
+        self._mount_adapters()
         if not avi_credentials:
             tenant = tenant if tenant else "admin"
             self.avi_credentials = AviCredentials(
@@ -225,17 +403,28 @@ class ApiSession(Session):
         else:
             self.avi_credentials = avi_credentials
         self.headers = {}
+        self._hdr_templates = {}
         self.verify = verify
         self.retry_conxn_errors = retry_conxn_errors
         self.remote_api_version = {}
         self.session_cookie_name = ''
         self.user_hdrs = {}
         self.data_log = data_log
-        self.num_session_retries = 0
-        self.retry_wait_time = 0
         self.max_session_retries = (
             self.MAX_API_RETRIES if max_api_retries is None
             else int(max_api_retries))
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_retries=self.max_session_retries,
+            backoff_base=self.RETRY_BACKOFF,
+            backoff_max=self.RETRY_BACKOFF_MAX)
+        # avi_limiter.ControllerLimiter throttling the API calls
+        self.limiter = limiter
+        # Refer Notes 04
+        self.breaker = breaker
+        # Refer Notes 05
+        self.session_store = session_store
+        # Refer Notes 06
+        self.metrics = metrics if metrics is not None else api_metrics
         # Refer Notes 01 and 02
         k_port = port if port else 443
         if self.avi_credentials.controller.startswith('http'):
@@ -260,24 +449,54 @@ class ApiSession(Session):
                                  self.avi_credentials.username, k_port)
         # Added api token and session id to sessionDict for handle single
         # session
+        self.session_keepalive = 0
+        self._keepalive_thread = None
+        self._keepalive_stop = threading.Event()
         if self.avi_credentials.csrftoken:
-            sessionDict[self.key] = {
+            ApiSession._store_session(self.key, {
                 'api': self,
                 "csrftoken": self.avi_credentials.csrftoken,
                 "session_id":self.avi_credentials.session_id,
-                "last_used": datetime.utcnow()
-            }
+            })
         elif lazy_authentication:
-            sessionDict.get(self.key, {}).update(
-                {'api': self, "last_used": datetime.utcnow()})
+            with sessionLock:
+                session = sessionDict.get(self.key)
+                if session is not None:
+                    session['api'] = self
+                    ApiSession._store_session(self.key, session)
         else:
             self.authenticate_session()
 
-        self.num_session_retries = 0
         self.pid = os.getpid()
         ApiSession._clean_inactive_sessions()
         return
 
+    def _mount_adapters(self):
+        for scheme in ('https://', 'http://'):
+            self.mount(scheme, AviHTTPAdapter(
+                pool_maxsize=self.pool_maxsize, pool_block=self.pool_block,
+                keepalive_timeout=self.keepalive_timeout))
+
+    def pool_stats(self):
+        """
+        returns connection pool hit/miss counters across the mounted
+        adapters
+        """
+        stats = {'requests': 0, 'hits': 0, 'misses': 0}
+        for adapter in self.adapters.values():
+            if isinstance(adapter, AviHTTPAdapter):
+                for k, v in adapter.pool_stats().items():
+                    stats[k] += v
+        return stats
+
+    def limiter_stats(self):
+        """returns current rate and concurrency limits of the session"""
+        return self.limiter.stats() if self.limiter else {}
+
+    def breaker_stats(self):
+        """returns circuit breaker state and counters of the session"""
+        return self.breaker.stats() if self.breaker else {}
+
     @property
     def controller_ip(self):
         return self.avi_credentials.controller
@@ -312,7 +531,8 @@ class ApiSession(Session):
 
     @keystone_token.setter
     def keystone_token(self, token):
-        sessionDict[self.key]['csrftoken'] = token
+        with sessionLock:
+            sessionDict[self.key]['csrftoken'] = token
 
     @property
     def tenant_uuid(self):
@@ -354,15 +574,20 @@ class ApiSession(Session):
         return sessionDict[self.key]['session_id']
 
     def get_context(self):
+        session = sessionDict[self.key]
         return {
-            'session_id':sessionDict[self.key]['session_id'],
-            'csrftoken': sessionDict[self.key]['csrftoken']
+            'session_id': session['session_id'],
+            'csrftoken': session['csrftoken']
         }
 
     @staticmethod
     def clear_cached_sessions():
         global sessionDict
-        sessionDict = {}
+        with sessionLock:
+            for session in sessionDict.values():
+                if 'api' in session:
+                    session['api'].stop_keepalive()
+            sessionDict = OrderedDict()
 
 
 
@@ -372,7 +597,10 @@ class ApiSession(Session):
             tenant_uuid=None, verify=False, port=None, timeout=60,
             retry_conxn_errors=True, api_version=None, data_log=False,
             avi_credentials=None, session_id=None, csrftoken=None,
-            lazy_authentication=False, max_api_retries=None):
+            lazy_authentication=False, max_api_retries=None,
+            pool_maxsize=None, pool_block=False, keepalive_timeout=None,
+            retry_policy=None, limiter=None, breaker=None,
+            session_store=None, metrics=None):
         """
         returns the session object for same user and tenant
         calls init if session dose not exist and adds it to session cache
@@ -386,6 +614,19 @@ class ApiSession(Session):
         :param timeout: timeout for API calls; Default value is 60 seconds
         :param retry_conxn_errors: retry on connection errors
         :param api_version: Controller API version
+        :param pool_maxsize: number of connections kept open to controller
+        :param pool_block: wait for a free pooled connection
+        :param keepalive_timeout: idle seconds before pooled connections
+            are dropped
+        :param retry_policy: avi_retry.RetryPolicy used for retrying failed
+            API calls
+        :param limiter: avi_limiter.ControllerLimiter for rate and
+            concurrency limiting of the API calls
+        :param breaker: avi_breaker.CircuitBreaker failing the API calls
+            fast while the controller is unavailable
+        :param session_store: avi_session_store.FileSessionStore sharing
+            the controller session across processes
+        :param metrics: avi_metrics.ApiMetrics accounting the API calls
         """
         if not avi_credentials:
             tenant = tenant if tenant else "admin"
@@ -414,28 +655,91 @@ class ApiSession(Session):
                 api_version=api_version, data_log=data_log,
                 avi_credentials=avi_credentials,
                 lazy_authentication=lazy_authentication,
-                max_api_retries=max_api_retries)
+                max_api_retries=max_api_retries, pool_maxsize=pool_maxsize,
+                pool_block=pool_block, keepalive_timeout=keepalive_timeout,
+                retry_policy=retry_policy, limiter=limiter, breaker=breaker,
+                session_store=session_store, metrics=metrics)
             ApiSession._clean_inactive_sessions()
         return user_session
 
-    def reset_session(self):
+    def reset_session(self, csrftoken=None):
         """
         resets and re-authenticates the current session.
+        :param csrftoken: csrftoken of the request that was rejected. If the
+            session was already re-authenticated with a different token by
+            another caller then it is reused instead of logging in again.
         """
-        sessionDict[self.key]['connected'] = False
+        loginFlight.do(self.key, self._reset_and_login, csrftoken)
+
+    def _reset_and_login(self, csrftoken=None):
+        with sessionLock:
+            session = sessionDict.get(self.key, {})
+            if csrftoken and session.get('csrftoken') not in (None,
+                                                                csrftoken):
+                logger.debug('session for %s already reset', self.key)
+                return
+            session['connected'] = False
         logger.info('resetting session for %s', self.key)
+        self._hdr_templates = {}
         self.user_hdrs = {}
-        for k, v in self.headers.items():
+        for k, v in list(self.headers.items()):
             if k not in self.SHARED_USER_HDRS:
                 self.user_hdrs[k] = v
         self.headers = {}
-        self.authenticate_session()
+        self._do_login(csrftoken)
 
     def authenticate_session(self):
         """
         Performs session authentication with Avi controller and stores
         session cookies and sets header options like tenant.
+        If a login for the same session key is already in progress, waits
+        for it and uses its result.
+        """
+        return loginFlight.do(self.key, self._do_login)
+
+    def _login_if_needed(self):
+        if 'csrftoken' in sessionDict.get(self.key, {}):
+            # authenticated by another caller meanwhile
+            return
+        self._do_login()
+
+    def _do_login(self, csrftoken=None):
+        if self.session_store is None:
+            return self._login()
+        return self._login_shared(csrftoken)
+
+    def _login_shared(self, csrftoken=None):
         """
+        authenticates through the shared session store: the session stored
+        by another process is reused unless it is the one rejected with
+        csrftoken, otherwise logs in and stores the new session.
+        """
+        with self.session_store.lock():
+            shared = self.session_store.load(self.key)
+            if shared and shared.get('csrftoken') != csrftoken:
+                logger.debug('using shared session for %s', self.key)
+                self.remote_api_version = shared.get('version', {})
+                self.session_cookie_name = shared['session_cookie_name']
+                self.headers.update(self.user_hdrs)
+                ApiSession._store_session(self.key, {
+                    'csrftoken': shared['csrftoken'],
+                    'session_id': shared['session_id'],
+                    'session_cookie_name': self.session_cookie_name,
+                    'api': self,
+                    'connected': True
+                })
+                return
+            self._login()
+            session = sessionDict.get(self.key, {})
+            if 'csrftoken' in session:
+                self.session_store.save(self.key, {
+                    'csrftoken': session['csrftoken'],
+                    'session_id': session['session_id'],
+                    'session_cookie_name': session['session_cookie_name'],
+                    'version': self.remote_api_version
+                })
+
+    def _login(self):
         body = {"username": self.avi_credentials.username}
         if self.avi_credentials.password:
             body["password"] = self.avi_credentials.password
@@ -445,95 +749,123 @@ class ApiSession(Session):
             raise APIError("Neither user password or token provided")
         logger.debug('authenticating user %s prefix %s',
                      self.avi_credentials.username, self.prefix)
-        self.cookies.clear()
-        err = None
-        try:
-            rsp = super(ApiSession, self).post(self.prefix+"/login", body,
-                                               timeout=self.timeout, verify=self.verify)
-
-            if rsp.status_code == 200:
-                self.num_session_retries = 0
-                self.remote_api_version = rsp.json().get('version', {})
-                self.session_cookie_name = rsp.json().get('session_cookie_name', 'sessionid')
-                self.headers.update(self.user_hdrs)
-                if rsp.cookies and 'csrftoken' in rsp.cookies:
-                    csrftoken = rsp.cookies['csrftoken']
-                    sessionDict[self.key] = {
-                        'csrftoken': csrftoken,
-                        'session_id': rsp.cookies[self.session_cookie_name],
-                        'last_used': datetime.utcnow(),
-                        'api': self,
-                        'connected': True
-                    }
-                logger.debug("authentication success for user %s",
-                             self.avi_credentials.username)
-                return
-            # Check for bad request and invalid credentials response code
-            elif rsp.status_code in [401, 403]:
-                logger.error('Status Code %s msg %s' % (
-                    rsp.status_code, rsp.text))
-                err = APIError('Status Code %s msg %s' % (
-                    rsp.status_code, rsp.text), rsp)
+        attempt = 0
+        while True:
+            self.cookies.clear()
+            err = None
+            retry_class = RETRY_SERVER
+            self.retry_policy.record_request()
+            probe = self.breaker.before_call() if self.breaker else None
+            try:
+                try:
+                    rsp = super(ApiSession, self).post(
+                        self.prefix+"/login", body, timeout=self.timeout,
+                        verify=self.verify)
+                except Exception as e:
+                    if self.breaker:
+                        self.breaker.record(error=e, probe=probe)
+                    raise
+                if self.breaker:
+                    self.breaker.record(resp=rsp, probe=probe)
+
+                if rsp.status_code == 200:
+                    login_rsp = rsp.json()
+                    self.remote_api_version = login_rsp.get('version', {})
+                    self.session_cookie_name = login_rsp.get('session_cookie_name', 'sessionid')
+                    self.headers.update(self.user_hdrs)
+                    if rsp.cookies and 'csrftoken' in rsp.cookies:
+                        csrftoken = rsp.cookies['csrftoken']
+                        ApiSession._store_session(self.key, {
+                            'csrftoken': csrftoken,
+                            'session_id': rsp.cookies[
+                                self.session_cookie_name],
+                            'session_cookie_name': self.session_cookie_name,
+                            'api': self,
+                            'connected': True
+                        })
+                    logger.debug("authentication success for user %s",
+                                 self.avi_credentials.username)
+                    return
+                # Check for bad request and invalid credentials response code
+                elif rsp.status_code in [401, 403]:
+                    logger.error('Status Code %s msg %s' % (
+                        rsp.status_code, rsp.text))
+                    err = APIError('Status Code %s msg %s' % (
+                        rsp.status_code, rsp.text), rsp)
+                    raise err
+                else:
+                    logger.error("Error status code %s msg %s", rsp.status_code,
+                                 rsp.text)
+                    err = APIError('Status Code %s msg %s' % (
+                        rsp.status_code, rsp.text), rsp)
+                    if rsp.status_code == 429:
+                        retry_class = RETRY_THROTTLED
+            except (ConnectionError, SSLError) as e:
+                if not self.retry_conxn_errors:
+                    raise
+                logger.warning('Connection error retrying %s', e)
+                err = e
+                rsp = None
+                retry_class = RETRY_CONNECTION
+            # comes here only if there was either exception or login was not
+            # successful
+            attempt += 1
+            if not self.retry_policy.allow_retry(retry_class, attempt):
+                logger.error("giving up after %d retries connection failure %s" % (
+                    attempt - 1, retry_class == RETRY_CONNECTION))
                 raise err
-            else:
-                logger.error("Error status code %s msg %s", rsp.status_code,
-                             rsp.text)
-                err = APIError('Status Code %s msg %s' % (
-                    rsp.status_code, rsp.text), rsp)
-        except (ConnectionError, SSLError) as e:
-            if not self.retry_conxn_errors:
-                raise
-            logger.warning('Connection error retrying %s', e)
-            err = e
-        # comes here only if there was either exception or login was not
-        # successful
-        if self.retry_wait_time:
-            time.sleep(self.retry_wait_time)
-        self.num_session_retries += 1
-        if self.num_session_retries > self.max_session_retries:
-            self.num_session_retries = 0
-            logger.error("giving up after %d retries connection failure %s" % (
-                self.max_session_retries, True))
-            raise err
-        self.authenticate_session()
-        return
+            self.retry_policy.wait(retry_class, attempt, resp=rsp)
 
     def _get_api_headers(self, tenant, tenant_uuid, timeout, headers,
                          api_version):
         """
         returns the headers that are passed to the requests.Session api calls.
+        Headers other than the ones passed to the api call are built once per
+        (tenant, tenant_uuid, api_version, timeout) and reused until the
+        csrftoken rotates, session headers change or the session is reset.
         """
+        session = sessionDict.get(self.key)
+        if not (session and 'csrftoken' in session):
+            loginFlight.do(self.key, self._login_if_needed)
+            session = sessionDict.get(self.key)
+        csrftoken = session['csrftoken']
+        if tenant:
+            tenant_uuid = None
+        elif tenant_uuid:
+            tenant = None
+        else:
+            tenant = self.avi_credentials.tenant
+            tenant_uuid = self.avi_credentials.tenant_uuid
+        api_version = api_version or self.avi_credentials.api_version
+        hdr_key = (tenant, tenant_uuid, api_version, timeout)
+        cached = self._hdr_templates.get(hdr_key)
+        if (cached is None or cached[0] != csrftoken or
+                cached[1] != self.headers or cached[2] != self.user_hdrs):
+            template = self._build_api_headers(tenant, tenant_uuid, timeout,
+                                               api_version, csrftoken)
+            if len(self._hdr_templates) >= self.MAX_HDR_TEMPLATES:
+                self._hdr_templates.clear()
+            self._hdr_templates[hdr_key] = (
+                csrftoken, dict(self.headers), dict(self.user_hdrs), template)
+        else:
+            template = cached[3]
+        api_hdrs = dict(template)
+        if headers:
+            # overwrite the headers passed via the API calls.
+            api_hdrs.update(headers)
+        return api_hdrs
+
+    def _build_api_headers(self, tenant, tenant_uuid, timeout, api_version,
+                           csrftoken):
         api_hdrs = copy.deepcopy(self.headers)
         api_hdrs.update({
             "Referer": self.prefix,
             "Content-Type": "application/json"
         })
         api_hdrs['timeout'] = str(timeout)
-        if self.key in sessionDict and 'csrftoken' in sessionDict.get(self.key):
-            api_hdrs['X-CSRFToken'] = sessionDict.get(self.key)['csrftoken']
-            # Added Cookie to handle single session
-            #api_hdrs['Cookie'] = "[<Cookie csrftoken=%s " \
-            #                     "for %s/>, " \
-            #                     "<Cookie %s=%s " \
-            #                     "for %s/>]" %(sessionDict[self.key]['csrftoken'],
-            #                                   self.avi_credentials.controller,
-            #                                   self.session_cookie_name,
-            #                                   sessionDict[self.key]['session_id'],
-            #                                   self.avi_credentials.controller)
-        else:
-            self.authenticate_session()
-            api_hdrs['X-CSRFToken'] = sessionDict.get(self.key)['csrftoken']
+        api_hdrs['X-CSRFToken'] = csrftoken
         if api_version:
             api_hdrs['X-Avi-Version'] = api_version
-        elif self.avi_credentials.api_version:
-            api_hdrs['X-Avi-Version'] = self.avi_credentials.api_version
-        if tenant:
-            tenant_uuid = None
-        elif tenant_uuid:
-            tenant = None
-        else:
-            tenant = self.avi_credentials.tenant
-            tenant_uuid = self.avi_credentials.tenant_uuid
         if tenant_uuid:
             api_hdrs.update({"X-Avi-Tenant-UUID": "%s" % tenant_uuid})
             api_hdrs.pop("X-Avi-Tenant", None)
@@ -544,14 +876,31 @@ class ApiSession(Session):
         # when the user had updated the user_hdrs
         if self.user_hdrs:
             api_hdrs.update(self.user_hdrs)
-        if headers:
-            # overwrite the headers passed via the API calls.
-            api_hdrs.update(headers)
         return api_hdrs
 
     def _api(self, api_name, path, tenant, tenant_uuid, data=None,
              headers=None, timeout=None, api_version=None, **kwargs):
         """
+        Makes the API call in a trace span when tracing is enabled; see
+        _api_call.
+        """
+        if not avi_trace.enabled():
+            return self._api_call(api_name, path, tenant, tenant_uuid,
+                                  data=data, headers=headers,
+                                  timeout=timeout, api_version=api_version,
+                                  **kwargs)
+        with avi_trace.span('%s %s' % (api_name.upper(), object_type(path)),
+                            path=path) as span:
+            resp = self._api_call(api_name, path, tenant, tenant_uuid,
+                                  data=data, headers=headers,
+                                  timeout=timeout, api_version=api_version,
+                                  **kwargs)
+            span.set(status=resp.status_code)
+            return resp
+
+    def _api_call(self, api_name, path, tenant, tenant_uuid, data=None,
+                  headers=None, timeout=None, api_version=None, **kwargs):
+        """
         It calls the requests.Session APIs and handles session expiry
         and other situations where session needs to be reset.
         returns ApiResponse object
@@ -568,76 +917,115 @@ class ApiSession(Session):
                         self.pid, os.getpid())
             self.close()
             self.pid = os.getpid()
+            if self.session_keepalive:
+                # threads are not inherited by the child process
+                self._keepalive_thread = None
+                self.start_keepalive(self.session_keepalive)
+        avi_metrics.ensure_exporters()
         if timeout is None:
             timeout = self.timeout
         fullpath = self._get_api_path(path)
         fn = getattr(super(ApiSession, self), api_name)
-        api_hdrs = self._get_api_headers(tenant, tenant_uuid, timeout, headers,
-                                         api_version)
-        connection_error = False
-        err = None
-        cookies = {
-            'csrftoken': api_hdrs['X-CSRFToken'],
-        }
-        try:
-            if self.session_cookie_name:
-                cookies[self.session_cookie_name] = sessionDict[self.key]['session_id']
-        except KeyError:
-            pass
-        try:
-            if (data is not None) and (type(data) == dict):
-                resp = fn(fullpath, data=json.dumps(data), headers=api_hdrs,
-                          timeout=timeout, cookies=cookies, **kwargs)
-            else:
+        if (data is not None) and (type(data) == dict):
+            data = avi_codec.dumps(data)
+        labels = (api_name.upper(), object_type(path),
+                  tenant or tenant_uuid or self.avi_credentials.tenant_uuid or
+                  self.avi_credentials.tenant)
+        call_start = time.time()
+        trace_id = avi_trace.current_trace_id()
+        # retries are counted per call; the session is shared by concurrent
+        # callers
+        attempt = 0
+        while True:
+            api_hdrs = self._get_api_headers(tenant, tenant_uuid, timeout,
+                                             headers, api_version)
+            if trace_id:
+                api_hdrs[avi_trace.CORRELATION_HEADER] = trace_id
+            err = None
+            resp = None
+            cookies = {
+                'csrftoken': api_hdrs['X-CSRFToken'],
+            }
+            session = sessionDict.get(self.key, {})
+            cookie_name = session.get('session_cookie_name',
+                                      self.session_cookie_name)
+            if cookie_name and 'session_id' in session:
+                cookies[cookie_name] = session['session_id']
+            self.retry_policy.record_request()
+            # raises ControllerUnavailable while the breaker is open
+            probe = self.breaker.before_call() if self.breaker else None
+            start = self.limiter.acquire() if self.limiter else None
+            req_start = time.time()
+            try:
                 resp = fn(fullpath, data=data, headers=api_hdrs,
                           timeout=timeout, cookies=cookies, **kwargs)
-        except (ConnectionError, SSLError) as e:
-            logger.warning('Connection error retrying %s', e)
-            if not self.retry_conxn_errors:
+            except (ConnectionError, SSLError) as e:
+                logger.warning('Connection error retrying %s', e)
+                err = e
+                if not self.retry_conxn_errors:
+                    raise
+            except Exception as e:
+                logger.error('Error in Requests library %s', e)
+                if isinstance(e, Timeout):
+                    err = e
                 raise
-            connection_error = True
-            err = e
-        except Exception as e:
-            logger.error('Error in Requests library %s', e)
-            raise
-        if not connection_error:
-            logger.debug('path: %s http_method: %s hdrs: %s params: '
-                         '%s data: %s rsp: %s', fullpath, api_name.upper(),
-                         api_hdrs, kwargs, data,
-                         (resp.text if self.data_log else 'None'))
-        if connection_error or resp.status_code in (401, 419):
-            if connection_error:
-                try:
-                    self.close()
-                except:
-                    # ignoring exception in cleanup path
-                    pass
-                logger.warning('Connection failed, retrying.')
-                # Adding sleep before retrying
-                if self.retry_wait_time:
-                    time.sleep(self.retry_wait_time)
-            else:
-                logger.info('received error %d %s so resetting connection',
-                            resp.status_code, resp.text)
-            ApiSession.reset_session(self)
-            self.num_session_retries += 1
-            if self.num_session_retries > self.max_session_retries:
-                # Added this such that any code which re-tries can succeed
-                # eventually.
-                self.num_session_retries = 0
-                if not connection_error:
+            finally:
+                if start is not None:
+                    self.limiter.release(start, resp=resp, error=err)
+                if self.breaker:
+                    self.breaker.record(resp=resp, error=err, probe=probe)
+                if resp is not None or err is not None:
+                    self.metrics.observe_request(
+                        labels, time.time() - req_start,
+                        resp.status_code if resp is not None else 'error',
+                        bytes_out=(len(data) if hasattr(data, '__len__')
+                                   else 0),
+                        bytes_in=len(resp.content) if resp is not None else 0)
+            if (err is None and logger.isEnabledFor(logging.DEBUG) and
+                    sampled(labels[1])):
+                logger.debug(
+                    'path: %s http_method: %s hdrs: %s params: %s data: %s '
+                    'rsp: %s', fullpath, labels[0], LazyData(api_hdrs),
+                    LazyData(kwargs), LazyData(data, labels[1]),
+                    (LazyData(lambda rsp=resp: rsp.text, labels[1])
+                     if self.data_log else 'None'),
+                    extra={'avi_method': labels[0],
+                           'avi_object_type': labels[1],
+                           'avi_tenant': labels[2],
+                           'avi_status': resp.status_code})
+            retry_class = self.retry_policy.classify(api_name, resp, err)
+            if retry_class not in self.API_RETRY_CLASSES:
+                break
+            attempt += 1
+            if not self.retry_policy.allow_retry(retry_class, attempt):
+                if err is None and retry_class == RETRY_SESSION:
                     err = APIError('Status Code %s msg %s' % (
                         resp.status_code, resp.text), resp)
+                attempt -= 1
                 logger.error(
                     "giving up after %d retries conn failure %s err %s" % (
-                        self.max_session_retries, connection_error, err))
-                raise err
-            # should restore the updated_hdrs to one passed down
-            resp = self._api(api_name, path, tenant, tenant_uuid, data,
-                             headers=headers, api_version=api_version,
-                             timeout=timeout, **kwargs)
-            self.num_session_retries = 0
-
+                        attempt, err is not None and resp is None, err))
+                if err is not None:
+                    self.metrics.observe_call(
+                        labels, time.time() - call_start, retries=attempt)
+                    raise err
+                # server errors are returned to the caller, ApiResponse.json
+                # raises the AviServerError
+                break
+            if retry_class == RETRY_SESSION:
+                logger.info('received error %d %s so resetting connection',
+                            resp.status_code, resp.text)
+                ApiSession.reset_session(self,
+                                         csrftoken=api_hdrs['X-CSRFToken'])
+            else:
+                # urllib3 discards the connection that failed, the rest of
+                # the pooled connections stay usable; so no need to close
+                # the whole session or to login again here.
+                logger.warning('%s failure, retrying.', retry_class)
+            self.retry_policy.wait(retry_class, attempt, resp=resp)
+
+        self.metrics.observe_call(labels, time.time() - call_start,
+                                  retries=attempt)
         if resp.cookies and 'csrftoken' in resp.cookies:
             csrftoken = resp.cookies['csrftoken']
             self.headers.update({"X-CSRFToken": csrftoken})
@@ -712,11 +1100,12 @@ class ApiSession(Session):
         elif resp.status_code > 299:
             return obj
         try:
-            if 'results' in resp.json():
-                obj = resp.json()['results'][0]
+            rsp_obj = resp.json()
+            if 'results' in rsp_obj:
+                obj = rsp_obj['results'][0]
             else:
                 # For apis returning single object eg. api/cluster
-                obj = resp.json()
+                obj = rsp_obj
         except IndexError:
             logger.warning('Warning: Object Not found for %s named %s' %
                            (path, name))
@@ -724,6 +1113,63 @@ class ApiSession(Session):
         self._update_session_last_used()
         return obj
 
+    def get_objects_iter(self, path, tenant='', tenant_uuid='', timeout=None,
+                         params=None, page_size=None, fields=None,
+                         api_version=None, **kwargs):
+        """
+        Generator over all the objects of a collection API. Pages are
+        fetched one at a time by following the next links of the responses,
+        so at most one page of objects is held in memory.
+        :param path: relative path to the collection e.g. pool
+        :param tenant: overrides the tenant used during session creation
+        :param tenant_uuid: overrides the tenant or tenant_uuid during session
+            creation
+        :param timeout: timeout for API calls; Default value is 60 seconds
+        :param params: dictionary of filters sent as query parameters
+        :param page_size: number of objects per page; Default is 200
+        :param fields: list of fields to return for each object
+        :param api_version: overrides x-avi-header in request header during
+            session creation
+        yields the objects as dictionaries; raises APIError on failures
+        """
+        params = dict(params or {})
+        params['page_size'] = page_size or self.PAGE_SIZE
+        if fields:
+            params['fields'] = ','.join(fields)
+        while True:
+            page = self.get(path, tenant=tenant, tenant_uuid=tenant_uuid,
+                            timeout=timeout, params=params,
+                            api_version=api_version, **kwargs).json() or {}
+            results = page.get('results', [])
+            next_page = page.get('next')
+            page = None
+            for obj in results:
+                yield obj
+            if not (next_page and results):
+                return
+            next_path, next_params = self._parse_next_page(next_page, params)
+            if (next_path == path.strip('/') and
+                    _query(next_params) == _query(params)):
+                raise APIError('next page link %s of %s links the same page'
+                               % (next_page, path))
+            path, params = next_path, next_params
+
+    def _parse_next_page(self, next_page, params):
+        """
+        returns the relative path and query params of a next link; params
+        of the previous page not present in the link are carried over.
+        Raises APIError if the link is not of an API collection.
+        """
+        url = urlparse(next_page)
+        if '/api/' not in url.path:
+            raise APIError('malformed next page link %s' % next_page)
+        path = url.path.split('/api/', 1)[-1].strip('/')
+        if not path:
+            raise APIError('malformed next page link %s' % next_page)
+        params = dict(params)
+        params.update(parse_qsl(url.query))
+        return path, params
+
     def post(self, path, data=None, tenant='', tenant_uuid='', timeout=None,
              force_uuid=None, params=None, api_version=None, **kwargs):
         """
@@ -882,7 +1328,7 @@ class ApiSession(Session):
         if not obj:
             return None
         if isinstance(obj, Response):
-            obj = json.loads(obj.text)
+            obj = avi_codec.loads(obj.content)
         if obj.get(0, None):
             return obj[0]['url']
         elif obj.get('url', None):
@@ -897,7 +1343,7 @@ class ApiSession(Session):
         if not obj:
             raise ObjectNotFound('Object %s Not found' % (obj))
         if isinstance(obj, Response):
-            obj = json.loads(obj.text)
+            obj = avi_codec.loads(obj.content)
         if obj.get(0, None):
             return obj[0]['uuid']
         elif obj.get('uuid', None):
@@ -927,29 +1373,88 @@ class ApiSession(Session):
             raise ObjectNotFound("%s/%s" % (path, name))
         return self.get_obj_uuid(resp)
 
+    @staticmethod
+    def _store_session(key, session):
+        """
+        stores the session as the most recently used one; sessionDict is
+        kept in last_used order so that the expired sessions are at its head
+        """
+        with sessionLock:
+            session["last_used"] = datetime.utcnow()
+            sessionDict.pop(key, None)
+            sessionDict[key] = session
+
     def _update_session_last_used(self):
-        if self.key in sessionDict:
-            sessionDict[self.key]["last_used"] = datetime.utcnow()
+        with sessionLock:
+            session = sessionDict.get(self.key)
+            if session is not None:
+                ApiSession._store_session(self.key, session)
 
     @staticmethod
     def _clean_inactive_sessions():
         """Removes sessions which are inactive more than 20 min"""
-        session_cache = sessionDict
-        logger.debug("cleaning inactive sessions in pid %d num elem %d",
-                     os.getpid(), len(session_cache))
-        keys_to_delete = []
-        for key, session in list(session_cache.items()):
-            tdiff = avi_timedelta(datetime.utcnow() - session["last_used"])
-            if tdiff < ApiSession.SESSION_CACHE_EXPIRY:
+        now = datetime.utcnow()
+        with sessionLock:
+            logger.debug("cleaning inactive sessions in pid %d num elem %d",
+                         os.getpid(), len(sessionDict))
+            # sessions are in last_used order; stop at the first active one
+            while sessionDict:
+                key = next(iter(sessionDict))
+                tdiff = avi_timedelta(now - sessionDict[key]["last_used"])
+                if tdiff < ApiSession.SESSION_CACHE_EXPIRY:
+                    break
+                del sessionDict[key]
+                logger.debug("Removed session for : %s", key)
+
+    def start_keepalive(self, interval):
+        """
+        starts a background thread calling the controller whenever the
+        session has been idle for interval seconds, so that the controller
+        session and the cached session do not expire and the next API call
+        does not pay for a re-login. Expired sessions are re-authenticated
+        by the keep-alive call itself.
+        """
+        self.session_keepalive = interval
+        if interval <= 0:
+            return
+        if self._keepalive_thread and self._keepalive_thread.is_alive():
+            return
+        self._keepalive_stop.clear()
+        self._keepalive_thread = threading.Thread(
+            target=self._keepalive_loop, name='avi-keepalive-%s' % self.key)
+        self._keepalive_thread.daemon = True
+        self._keepalive_thread.start()
+
+    def stop_keepalive(self):
+        self.session_keepalive = 0
+        self._keepalive_stop.set()
+
+    def _keepalive_loop(self):
+        interval = self.session_keepalive
+        while not self._keepalive_stop.wait(interval / 2.0):
+            session = sessionDict.get(self.key)
+            if not session or 'csrftoken' not in session:
+                # not authenticated yet or cleaned up; nothing to keep alive
+                continue
+            if session.get('api') is not self:
+                break
+            idle = avi_timedelta(datetime.utcnow() - session['last_used'])
+            if idle < interval:
                 continue
-            keys_to_delete.append(key)
-        for key in keys_to_delete:
-            del session_cache[key]
-            logger.debug("Removed session for : %s", key)
+            logger.debug('refreshing session %s idle for %d secs', self.key,
+                         idle)
+            try:
+                self.get(self.SESSION_KEEPALIVE_PATH,
+                         params={'fields': 'uuid'})
+            except Exception as e:
+                logger.warning('keep-alive of session %s failed: %s',
+                               self.key, e)
 
     def delete_session(self):
         """ Removes the session for cleanup"""
         logger.debug("Removed session for : %s", self.key)
-        sessionDict.pop(self.key, None)
+        self.stop_keepalive()
+        with sessionLock:
+            sessionDict.pop(self.key, None)
         return
 # End of file
@@ -0,0 +1,158 @@
+import logging
+import os
+import sys
+import threading
+
+from concurrent import futures
+
+from avi_lbaasv2.avi_api import avi_trace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def gather(fs, return_exceptions=False):
+    """
+    Waits for all the futures and returns their results in the same order.
+    If return_exceptions is False, the first exception (in order of the
+    futures) is raised once all the futures are done; otherwise exceptions
+    are returned in place of the results.
+    """
+    fs = list(fs)
+    futures.wait(fs)
+    results = []
+    for f in fs:
+        e = f.exception()
+        if e is not None:
+            if not return_exceptions:
+                raise e
+            results.append(e)
+        else:
+            results.append(f.result())
+    return results
+
+
+def _green_threads():
+    """returns eventlet if it monkey patched the threads, e.g. in neutron"""
+    eventlet = sys.modules.get('eventlet')
+    if (eventlet is not None and
+            eventlet.patcher.is_monkey_patched('thread')):
+        return eventlet
+    return None
+
+
+def _run_future(f, fn, args, kwargs):
+    if not f.set_running_or_notify_cancel():
+        return
+    try:
+        f.set_result(fn(*args, **kwargs))
+    except BaseException as e:
+        f.set_exception(e)
+
+
+class ApiExecutor(object):
+    """
+    Bounded pool of workers to run Avi API calls concurrently. When eventlet
+    has monkey patched the threads the workers are the greenthreads of a
+    GreenPool, and submit waits for a free one when all are busy. Worker
+    threads don't survive fork, so the pool is re-created when a pid change
+    is detected.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = int(max_workers or DEFAULT_WORKERS)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                if self._pool is not None:
+                    logger.info('pid %d change detected new %d. Creating '
+                                'new api executor', self._pid, os.getpid())
+                eventlet = _green_threads()
+                if eventlet is not None:
+                    self._pool = eventlet.GreenPool(self.max_workers)
+                else:
+                    self._pool = futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        # the calls are traced as children of the submitting span
+        fn = avi_trace.bind(fn)
+        pool = self._get_pool()
+        if isinstance(pool, futures.ThreadPoolExecutor):
+            return pool.submit(fn, *args, **kwargs)
+        f = futures.Future()
+        pool.spawn_n(_run_future, f, fn, args, kwargs)
+        return f
+
+    def map(self, fn, *iterables):
+        """
+        Runs fn for each item concurrently and returns the results in
+        order; raises the first failure after all calls complete.
+        """
+        return gather([self.submit(fn, *args) for args in zip(*iterables)])
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        if isinstance(pool, futures.ThreadPoolExecutor):
+            pool.shutdown(wait=wait)
+        elif wait:
+            pool.waitall()
+
+
+def get_executor(max_workers=None):
+    """
+    returns the executor of the process running at most max_workers calls,
+    shared by the AviClients and the fan out of the driver operations
+    """
+    max_workers = int(max_workers or DEFAULT_WORKERS)
+    with _executors_lock:
+        executor = _executors.get(max_workers)
+        if executor is None:
+            executor = _executors[max_workers] = ApiExecutor(max_workers)
+        return executor
+
+
+class AsyncApiSession(object):
+    """
+    Non-blocking front end of ApiSession. Every API returns a
+    concurrent.futures.Future of the ApiSession call, which still takes
+    care of the session authentication and 401/419 re-authentication.
+    Use .result() on the future or gather() to wait for the responses.
+    """
+    def __init__(self, session, executor=None, max_workers=None):
+        self.session = session
+        self.executor = executor or get_executor(max_workers)
+
+    def _submit(self, api_name, *args, **kwargs):
+        return self.executor.submit(getattr(self.session, api_name),
+                                    *args, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self._submit('get', path, **kwargs)
+
+    def get_object_by_name(self, path, name, **kwargs):
+        return self._submit('get_object_by_name', path, name, **kwargs)
+
+    def post(self, path, data=None, **kwargs):
+        return self._submit('post', path, data=data, **kwargs)
+
+    def put(self, path, data=None, **kwargs):
+        return self._submit('put', path, data=data, **kwargs)
+
+    def patch(self, path, data=None, **kwargs):
+        return self._submit('patch', path, data=data, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self._submit('delete', path, **kwargs)
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# responses meaning the controller (or its proxy) is not able to serve
+UNAVAILABLE_CODES = (502, 503, 504)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class ControllerUnavailable(Exception):
+    """
+    Raised without calling the controller while its circuit breaker is
+    open, i.e. the controller failed consecutively and is assumed down.
+    """
+    def __init__(self, controller, retry_in=0):
+        super(ControllerUnavailable, self).__init__(
+            'Avi Controller %s unavailable; retrying in %.0f secs' % (
+                controller, retry_in))
+        self.controller = controller
+        self.retry_in = retry_in
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of the API calls to an Avi Controller.
+
+    closed: calls go through; `failure_threshold` consecutive failures
+        (connection errors, timeouts or 502/503/504) open the breaker.
+    open: calls fail fast with ControllerUnavailable for `reset_timeout`
+        seconds, then the breaker goes half open.
+    half_open: a single probe call goes through while the others fail fast;
+        the breaker closes if it succeeds and opens again if it fails.
+
+    before_call returns a token identifying the probe call, to be passed to
+    record with its result: only the probe decides the half open state, the
+    calls still in flight since the breaker was closed don't.
+    A failure_threshold of 0 disables the breaker.
+    """
+    def __init__(self, controller, failure_threshold=5, reset_timeout=30):
+        self.controller = controller
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0
+        self._probe = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        raises ControllerUnavailable if the call must not be made; returns
+        the probe token if the call is the half open probe, else None
+        """
+        if self.failure_threshold <= 0:
+            return None
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return None
+            if self.state == STATE_OPEN:
+                retry_in = self._opened_at + self.reset_timeout - time.time()
+                if retry_in <= 0:
+                    logger.info('circuit breaker of %s half open',
+                                self.controller)
+                    self.state = STATE_HALF_OPEN
+                    self._probe = object()
+                    return self._probe
+            elif self._probe is None:
+                # the previous probe ended without a result
+                self._probe = object()
+                return self._probe
+            else:
+                retry_in = 0
+            self.rejected += 1
+        raise ControllerUnavailable(self.controller, max(retry_in, 0))
+
+    def record(self, resp=None, error=None, probe=None):
+        """
+        accounts the result of a call; calls ending with neither response
+        nor error (e.g. unexpected exceptions) do not change the state
+        :param probe: token returned by before_call for the call
+        """
+        if self.failure_threshold <= 0:
+            return
+        failed = error is not None or (resp is not None and
+                                       resp.status_code in UNAVAILABLE_CODES)
+        with self._lock:
+            if probe is not None:
+                if probe is not self._probe:
+                    # probe of a previous half open state
+                    return
+                self._probe = None
+                if failed:
+                    self.failures += 1
+                    self._open()
+                elif resp is not None:
+                    logger.info('circuit breaker of %s closed',
+                                self.controller)
+                    self.state = STATE_CLOSED
+                    self.failures = 0
+                return
+            if self.state != STATE_CLOSED:
+                # made before the breaker opened; the probe decides
+                return
+            if failed:
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    self._open()
+            elif resp is not None:
+                self.failures = 0
+
+    def _open(self):
+        logger.error('circuit breaker of %s open after %d failures; failing '
+                     'calls for %.0f secs', self.controller, self.failures,
+                     self.reset_timeout)
+        self.state = STATE_OPEN
+        self._opened_at = time.time()
+        self.opened += 1
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
+
+
+def get_breaker(key, **kwargs):
+    """
+    returns the circuit breaker of the controller identified by key,
+    creating it with kwargs if needed
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key, **kwargs)
+            _breakers[key] = breaker
+        return breaker
@@ -0,0 +1,197 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class ObjectCache(object):
+    """
+    In-process cache of Avi objects keyed by (tenant_uuid, type, uuid),
+    with a TTL and LRU eviction once max_size objects are cached.
+
+    An entry holds either the full object or, when only a projection was
+    fetched, the object restricted to its fields; a lookup with fields is
+    served by any entry holding all of them. Entries holding the complete
+    configuration of the object, even without the fields computed by the
+    controller, can serve as the merge base of an update (get_base).
+    Objects are copied in and out so that callers can modify them freely.
+    A ttl of 0 disables the cache.
+    """
+    def __init__(self, ttl=5, max_size=1024):
+        self.ttl = float(ttl)
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def _lookup(self, key, usable):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None or not usable(entry):
+                self.misses += 1
+                return None
+            # most recently used last; python 2.7 has no move_to_end
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def get(self, key, fields=None):
+        """returns a copy of the cached object (projected to fields) or None"""
+        obj = self._lookup(key, lambda entry: _covers(entry[2], fields))
+        if obj is None:
+            return None
+        if fields:
+            obj = dict((f, obj[f]) for f in fields if f in obj)
+        return copy.deepcopy(obj)
+
+    def get_base(self, key):
+        """
+        returns a copy of the cached complete configuration of the object,
+        to be updated and written back, or None
+        """
+        obj = self._lookup(key, lambda entry: entry[3])
+        return copy.deepcopy(obj) if obj is not None else None
+
+    def put(self, key, obj, fields=None, base=None):
+        """
+        caches obj; a projection never replaces an entry holding all of its
+        fields as it would only make the entry less useful
+        :param base: obj is the complete configuration of the object;
+            defaults to True for full objects
+        """
+        if not self.enabled or not isinstance(obj, dict):
+            return
+        obj = copy.deepcopy(obj)
+        fields = frozenset(fields) if fields else None
+        if base is None:
+            base = fields is None
+        with self._lock:
+            prev = self._entries.pop(key, None)
+            if (fields is not None and not base and prev is not None and
+                    _covers(prev[2], fields) and prev[0] > time.time()):
+                self._entries[key] = prev
+                return
+            self._entries[key] = (time.time() + self.ttl, obj, fields, base)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_type(self, tenant_uuid, resource_type):
+        """invalidates all the cached objects of a type in a tenant"""
+        with self._lock:
+            for key in [k for k in self._entries
+                        if k[0] == tenant_uuid and k[1] == resource_type]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class NegativeCache(ObjectCache):
+    """
+    Short-lived cache of the (tenant_uuid, type, uuid) of objects known not
+    to exist, so that probing them again does not cost a 404 round trip.
+    """
+    def __init__(self, ttl=2, max_size=1024):
+        super(NegativeCache, self).__init__(ttl=ttl, max_size=max_size)
+
+    def add(self, key):
+        self.put(key, {})
+
+    def __contains__(self, key):
+        return self._lookup(key, lambda entry: True) is not None
+
+
+def _covers(cached_fields, fields):
+    """True if an entry holding cached_fields can serve a lookup of fields"""
+    if cached_fields is None:
+        return True
+    return bool(fields) and cached_fields.issuperset(fields)
+
+
+class RefCache(object):
+    """
+    Long-lived cache of object refs by name, for objects like the System-*
+    profiles which almost never change once the controller is set up.
+
+    Refs are cached per (tenant_uuid, type, name), as a tenant may have an
+    object named like an admin tenant one, which the lookups in the tenant
+    resolve to.
+    """
+    def __init__(self, ttl=3600):
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant_uuid, resource_type, name):
+        """returns the cached ref the name resolves to in the tenant or None"""
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._refs.get((tenant_uuid, resource_type, name))
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, tenant_uuid, resource_type, name, ref):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._refs[(tenant_uuid, resource_type, name)] = (
+                time.time() + self.ttl, ref)
+
+    def invalidate(self, resource_type=None, name=None):
+        """
+        drops the refs of all the tenants matching resource_type and name;
+        without arguments drops all the refs
+        """
+        with self._lock:
+            for key in [k for k in self._refs
+                        if resource_type in (None, k[1]) and
+                        name in (None, k[2])]:
+                del self._refs[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._refs),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,115 @@
+"""
+JSON codec of the Avi API request and response bodies. Uses the fastest
+JSON library installed out of orjson, ujson and simplejson, and falls back
+to the stdlib json module when none is, or for the few inputs the fast
+library can't handle (e.g. integers over 64 bits).
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+class JsonCodec(object):
+    """dumps/loads of one JSON library with the stdlib json as fallback"""
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self._dumps = dumps
+        self._loads = loads
+
+    def dumps(self, obj):
+        """returns obj serialized as JSON str or bytes"""
+        try:
+            return self._dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            if self._dumps is json.dumps:
+                raise
+            return json.dumps(obj)
+
+    def loads(self, data):
+        """returns the object decoded from JSON str or bytes"""
+        try:
+            return self._loads(data)
+        except (ValueError, OverflowError):
+            if self._loads is json.loads:
+                raise
+            return _stdlib_loads(data)
+
+    def __repr__(self):
+        return 'JsonCodec(%s)' % self.name
+
+
+def _stdlib_loads(data):
+    if isinstance(data, bytes) and not isinstance(data, str):
+        # python < 3.6 json.loads takes str only
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _orjson_codec():
+    import orjson
+    option = orjson.OPT_NON_STR_KEYS
+    return JsonCodec('orjson', lambda obj: orjson.dumps(obj, option=option),
+                     orjson.loads)
+
+
+def _ujson_codec():
+    import ujson
+    return JsonCodec('ujson', ujson.dumps, ujson.loads)
+
+
+def _simplejson_codec():
+    import simplejson
+    return JsonCodec('simplejson', simplejson.dumps, simplejson.loads)
+
+
+def _stdlib_codec():
+    return JsonCodec('json', json.dumps, _stdlib_loads)
+
+
+_factories = {
+    'orjson': _orjson_codec,
+    'ujson': _ujson_codec,
+    'simplejson': _simplejson_codec,
+    'json': _stdlib_codec,
+}
+
+
+def get_codec(name=None):
+    """
+    returns the codec of the JSON library name, or of the first one of
+    BACKENDS that is installed if name is None or not installed
+    """
+    names = BACKENDS if not name else (name,) + BACKENDS
+    for backend in names:
+        factory = _factories.get(backend)
+        if factory is None:
+            logger.warning('unknown JSON backend %s', backend)
+            continue
+        try:
+            return factory()
+        except ImportError:
+            if backend == name:
+                logger.warning('JSON backend %s not installed', name)
+    return _stdlib_codec()
+
+
+codec = get_codec()
+
+
+def set_backend(name=None):
+    """selects the JSON library used for the API bodies"""
+    global codec
+    codec = get_codec(name)
+    logger.debug('using %s for the API bodies', codec)
+    return codec
+
+
+def dumps(obj):
+    return codec.dumps(obj)
+
+
+def loads(data):
+    return codec.loads(data)
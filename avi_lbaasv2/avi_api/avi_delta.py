@@ -0,0 +1,96 @@
+"""
+Computes the PATCH requests turning the current version of an Avi object
+into the desired one, so that updates send the changed fields instead of
+the whole object.
+
+A field of the desired definition is unchanged when the current object
+holds it, including the sub-fields the controller filled with defaults,
+i.e. desired values are compared as a subset of the current ones.
+"""
+import json
+
+# list fields patched by adding and deleting items instead of replacing
+# the whole list, with the sub-fields identifying an item of the list
+LIST_ITEM_KEYS = {
+    'servers': ('ip', 'port'),
+}
+
+# fields never patched
+IGNORED_FIELDS = ('url', 'uuid', '_last_modified')
+
+
+def contains(current, desired):
+    """True if current holds all of desired"""
+    if isinstance(desired, dict):
+        return isinstance(current, dict) and all(
+            k in current and contains(current[k], v)
+            for k, v in desired.items())
+    if isinstance(desired, list):
+        return (isinstance(current, list) and
+                len(current) == len(desired) and
+                all(contains(c, d) for c, d in zip(current, desired)))
+    return current == desired
+
+
+def _item_key(item, key_fields):
+    if not isinstance(item, dict):
+        return None
+    # independent of the order of the keys of dict sub-fields, e.g. of the
+    # ip of the transform and of the controller
+    key = tuple(json.dumps(item.get(f), sort_keys=True) for f in key_fields)
+    return key if any(item.get(f) is not None for f in key_fields) else None
+
+
+def _list_delta(current, desired, key_fields):
+    """
+    returns (deleted, added) items turning the list current into desired,
+    or None if an item was modified and the list has to be replaced
+    """
+    cur_items = dict((_item_key(i, key_fields), i) for i in current)
+    new_items = dict((_item_key(i, key_fields), i) for i in desired)
+    if (None in cur_items or None in new_items or
+            len(cur_items) != len(current) or
+            len(new_items) != len(desired)):
+        return None
+    for key, item in new_items.items():
+        if key in cur_items and not contains(cur_items[key], item):
+            return None
+    deleted = [i for i in current
+               if _item_key(i, key_fields) not in new_items]
+    added = [i for i in desired
+             if _item_key(i, key_fields) not in cur_items]
+    return deleted, added
+
+
+def delta_patches(current, desired):
+    """
+    returns the list of (op, data) PATCH requests, op being 'delete', 'add'
+    or 'replace', to apply in order to update current with the fields of
+    desired; an empty list if nothing differs, or None if the update needs
+    a PUT, i.e. a field is unset
+    """
+    replace, add, delete = {}, {}, {}
+    for field, value in desired.items():
+        if field in IGNORED_FIELDS:
+            continue
+        old = current.get(field)
+        if value is None:
+            if old is None:
+                continue
+            # unsetting a field is not expressible as a PATCH
+            return None
+        if contains(old, value):
+            continue
+        if (field in LIST_ITEM_KEYS and isinstance(old, list) and
+                isinstance(value, list)):
+            delta = _list_delta(old, value, LIST_ITEM_KEYS[field])
+            if delta is not None:
+                deleted, added = delta
+                if deleted:
+                    delete[field] = deleted
+                if added:
+                    add[field] = added
+                continue
+        replace[field] = value
+    return [(op, data) for op, data in (('delete', delete), ('add', add),
+                                        ('replace', replace)) if data]
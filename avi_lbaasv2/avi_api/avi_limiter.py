@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket(object):
+    """
+    Token bucket allowing `rate` requests per second with bursts of up to
+    `burst` requests. A rate of 0 disables the bucket. clock and sleep
+    default to time.time and time.sleep.
+    """
+    def __init__(self, rate=0, burst=20, clock=None, sleep=None):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.waits = 0
+        self._clock = clock or time.time
+        self._sleep = sleep or time.sleep
+        self._last = self._clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            # reserve the token; a negative balance is the wait of callers
+            # queued before us
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            if wait:
+                self.waits += 1
+        if wait:
+            self._sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+    """
+    AIMD limit on the number of API calls in flight. The limit grows by
+    about one for every `limit` successful calls and is cut by
+    `decrease_ratio` when a call fails with 429/5xx/connection error or is
+    slower than `latency_target` seconds; at most once per latency_target
+    so that a burst of slow calls counts as one congestion signal.
+    A max_limit of 0 disables the limiter.
+    """
+    def __init__(self, max_limit=10, min_limit=1, latency_target=2.0,
+                 decrease_ratio=0.5, clock=None):
+        self.max_limit = int(max_limit)
+        self.min_limit = max(int(min_limit), 1)
+        self.latency_target = float(latency_target)
+        self.decrease_ratio = float(decrease_ratio)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.waits = 0
+        self.decreases = 0
+        self._last_decrease = 0
+        self._clock = clock or time.time
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        if self.max_limit <= 0:
+            return
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                self.waits += 1
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded):
+        if self.max_limit <= 0:
+            return
+        with self._cond:
+            self.in_flight -= 1
+            now = self._clock()
+            if overloaded or latency > self.latency_target:
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(float(self.min_limit),
+                                     self.limit * self.decrease_ratio)
+                    self._last_decrease = now
+                    self.decreases += 1
+                    logger.info('controller overloaded (latency %.2f); '
+                                'concurrency limit %d', latency,
+                                int(self.limit))
+            else:
+                self.limit = min(float(self.max_limit),
+                                 self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class ControllerLimiter(object):
+    """
+    Client side limiter of the API calls to an Avi Controller: a token
+    bucket on the request rate and an adaptive limit on the concurrency.
+    """
+    def __init__(self, rate=0, burst=20, max_concurrency=10,
+                 min_concurrency=1, latency_target=2.0, clock=None,
+                 sleep=None):
+        self._clock = clock or time.time
+        self.bucket = TokenBucket(rate, burst, clock=self._clock, sleep=sleep)
+        self.concurrency = AdaptiveConcurrency(
+            max_limit=max_concurrency, min_limit=min_concurrency,
+            latency_target=latency_target, clock=self._clock)
+
+    def acquire(self):
+        self.bucket.acquire()
+        self.concurrency.acquire()
+        return self._clock()
+
+    def release(self, start, resp=None, error=None):
+        overloaded = error is not None or (
+            resp is not None and
+            (resp.status_code == 429 or resp.status_code >= 500))
+        self.concurrency.release(self._clock() - start, overloaded)
+
+    def stats(self):
+        return {
+            'rate_limit': self.bucket.rate,
+            'rate_tokens': self.bucket.tokens,
+            'rate_waits': self.bucket.waits,
+            'concurrency_limit': int(self.concurrency.limit),
+            'concurrency_max': self.concurrency.max_limit,
+            'in_flight': self.concurrency.in_flight,
+            'concurrency_waits': self.concurrency.waits,
+            'concurrency_decreases': self.concurrency.decreases,
+        }
+
+
+def get_limiter(key, **kwargs):
+    """
+    returns the limiter of the controller identified by key, creating it
+    with kwargs if needed; sessions to one controller share the limiter
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = ControllerLimiter(**kwargs)
+            _limiters[key] = limiter
+        return limiter
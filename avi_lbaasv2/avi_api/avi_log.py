@@ -0,0 +1,126 @@
+"""
+Helpers for logging the data of the Avi API calls: the data is wrapped in
+LazyData, which redacts the secrets (private keys, passwords, tokens and
+session cookies) and caps the size only when the record is emitted, and
+data_log_enabled() samples the records per object type so that the cost
+of building them is skipped when they are not wanted.
+"""
+import logging
+import random
+import re
+
+try:
+    string_types = basestring  # noqa
+except NameError:  # python 3
+    string_types = str
+
+REDACTED = '<redacted>'
+SENSITIVE_FIELDS = frozenset([
+    'key', 'key_passphrase', 'password', 'token', 'csrftoken',
+    'x-csrftoken', 'cookie', 'set-cookie', 'sessionid', 'session_id'])
+_SENSITIVE_JSON_RE = re.compile(
+    r'("(?:key|key_passphrase|password|token|csrftoken|sessionid|'
+    r'session_id)"\s*:\s*)"(?:[^"\\]|\\.)*"', re.IGNORECASE)
+_SENSITIVE_REPR_RE = re.compile(
+    r"('(?:key|key_passphrase|password|token|csrftoken|sessionid|"
+    r"session_id|x-csrftoken|cookie)'\s*:\s*u?)'(?:[^'\\]|\\.)*'",
+    re.IGNORECASE)
+_COOKIE_RE = re.compile(r'((?:csrftoken|[\w-]*sessionid)=)[^;,\s\'"]+',
+                        re.IGNORECASE)
+_PRIVATE_KEY_RE = re.compile(
+    r'-----BEGIN [A-Z ]*PRIVATE KEY-----.*?-----END [A-Z ]*PRIVATE KEY-----',
+    re.DOTALL)
+
+_sample_rate = 1.0
+_max_size = 4096
+_type_sample_rates = {}
+_type_max_sizes = {}
+
+
+def parse_type_map(value, cast):
+    """
+    returns {object type: cast(value)} from a dict or from a
+    'type:value,type:value' string as found in the contrail driver config
+    """
+    if not value:
+        return {}
+    if isinstance(value, string_types):
+        value = dict(item.split(':', 1) for item in value.split(',')
+                     if ':' in item)
+    return dict((k.strip(), cast(v)) for k, v in value.items())
+
+
+def configure(sample_rate=None, max_size=None, type_sample_rates=None,
+              type_max_sizes=None):
+    """
+    sets the fraction of the data log records emitted and the maximum size
+    in characters of the logged data, overall and per object type; a max
+    size of 0 means no limit
+    """
+    global _sample_rate, _max_size, _type_sample_rates, _type_max_sizes
+    if sample_rate is not None:
+        _sample_rate = float(sample_rate)
+    if max_size is not None:
+        _max_size = int(max_size)
+    if type_sample_rates is not None:
+        _type_sample_rates = parse_type_map(type_sample_rates, float)
+    if type_max_sizes is not None:
+        _type_max_sizes = parse_type_map(type_max_sizes, int)
+
+
+def sampled(obj_type=None):
+    rate = _type_sample_rates.get(obj_type, _sample_rate)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def data_log_enabled(log, obj_type=None):
+    """returns True if a debug data record of obj_type is to be logged"""
+    return log.isEnabledFor(logging.DEBUG) and sampled(obj_type)
+
+
+def redact(obj):
+    """returns a copy of obj with the values of the secrets redacted"""
+    if isinstance(obj, dict):
+        return dict((k, REDACTED if (isinstance(k, string_types) and
+                                     k.lower() in SENSITIVE_FIELDS)
+                     else redact(v))
+                    for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [redact(v) for v in obj]
+    if isinstance(obj, bytes) and not isinstance(obj, string_types):
+        obj = obj.decode('utf-8', 'replace')
+    if isinstance(obj, string_types):
+        return redact_text(obj)
+    return obj
+
+
+def redact_text(text):
+    text = _PRIVATE_KEY_RE.sub(REDACTED, text)
+    text = _SENSITIVE_JSON_RE.sub(r'\1"%s"' % REDACTED, text)
+    text = _SENSITIVE_REPR_RE.sub(r"\1'%s'" % REDACTED, text)
+    return _COOKIE_RE.sub(r'\1%s' % REDACTED, text)
+
+
+class LazyData(object):
+    """
+    log argument formatting obj, or the result of calling it, redacted and
+    truncated to the max size of obj_type only when the record is emitted
+    """
+    __slots__ = ('obj', 'obj_type')
+
+    def __init__(self, obj, obj_type=None):
+        self.obj = obj
+        self.obj_type = obj_type
+
+    def __str__(self):
+        obj = self.obj() if callable(self.obj) else self.obj
+        obj = redact(obj)
+        text = obj if isinstance(obj, string_types) else str(obj)
+        text = redact_text(text)
+        max_size = _type_max_sizes.get(self.obj_type, _max_size)
+        if max_size and len(text) > max_size:
+            text = '%s...(%d chars truncated)' % (text[:max_size],
+                                                  len(text) - max_size)
+        return text
+
+    __repr__ = __str__
@@ -0,0 +1,282 @@
+import logging
+import os
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # python 2.7
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+LABELS = ('method', 'object_type', 'tenant')
+
+# exporter factories by key, and the exporters started from them in the
+# process _exporters_pid
+_exporter_factories = {}
+_exporters = {}
+_exporters_pid = None
+_exporters_lock = threading.Lock()
+
+
+def object_type(path):
+    """returns the object type of an API path, i.e. its first segment"""
+    path = path.split('?', 1)[0].strip('/')
+    if path.startswith('api/'):
+        path = path[4:]
+    return path.split('/', 1)[0] or 'unknown'
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class ApiMetrics(object):
+    """
+    Metrics of the Avi Controller API calls made by the ApiSessions,
+    labeled by HTTP method, object type and tenant:
+
+    - avi_api_request_duration_seconds: latency of each HTTP request
+    - avi_api_call_duration_seconds: latency of each API call including
+      its retries and backoff waits, i.e. what the driver waits for
+    - avi_api_responses_total: responses by status code, 'error' for
+      connection errors and timeouts
+    - avi_api_retries_total: retried requests
+    - avi_api_request_bytes_total/avi_api_response_bytes_total: bodies
+      sent and received
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.calls = {}
+            self.responses = {}
+            self.retries = {}
+            self.bytes_out = {}
+            self.bytes_in = {}
+
+    def observe_request(self, labels, latency, status, bytes_out=0,
+                        bytes_in=0):
+        """accounts one HTTP request; labels is (method, type, tenant)"""
+        with self._lock:
+            hist = self.requests.get(labels)
+            if hist is None:
+                hist = self.requests[labels] = Histogram()
+            hist.observe(latency)
+            key = labels + (str(status),)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            self.bytes_out[labels] = self.bytes_out.get(labels, 0) + bytes_out
+            self.bytes_in[labels] = self.bytes_in.get(labels, 0) + bytes_in
+
+    def observe_call(self, labels, latency, retries=0):
+        """accounts one API call with its retries"""
+        with self._lock:
+            hist = self.calls.get(labels)
+            if hist is None:
+                hist = self.calls[labels] = Histogram()
+            hist.observe(latency)
+            if retries:
+                self.retries[labels] = self.retries.get(labels, 0) + retries
+
+    def to_prometheus(self):
+        """returns the metrics in prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, hists in (
+                    ('avi_api_request_duration_seconds', self.requests),
+                    ('avi_api_call_duration_seconds', self.calls)):
+                lines.append('# TYPE %s histogram' % name)
+                for labels, hist in sorted(hists.items()):
+                    lbl = _labels(labels)
+                    for bound, count in hist.cumulative_counts():
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (
+                            name, lbl, bound, count))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (
+                        name, lbl, hist.count))
+                    lines.append('%s_sum{%s} %f' % (name, lbl, hist.sum))
+                    lines.append('%s_count{%s} %d' % (name, lbl, hist.count))
+            lines.append('# TYPE avi_api_responses_total counter')
+            for key, count in sorted(self.responses.items()):
+                lines.append('avi_api_responses_total{%s,code="%s"} %d' % (
+                    _labels(key[:3]), key[3], count))
+            for name, counters in (
+                    ('avi_api_retries_total', self.retries),
+                    ('avi_api_request_bytes_total', self.bytes_out),
+                    ('avi_api_response_bytes_total', self.bytes_in)):
+                lines.append('# TYPE %s counter' % name)
+                for labels, count in sorted(counters.items()):
+                    lines.append('%s{%s} %d' % (name, _labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(values):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                 .replace('"', '\\"'))
+                    for k, v in zip(LABELS, values))
+
+
+# metrics of all the sessions of the process
+api_metrics = ApiMetrics()
+
+
+class FileExporter(object):
+    """dumps the metrics in prometheus text format every interval seconds"""
+    def __init__(self, path, interval=60, metrics=None):
+        self.metrics = metrics if metrics is not None else api_metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def dump(self):
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(self.metrics.to_prometheus())
+        os.rename(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except (IOError, OSError) as e:
+                logger.warning('could not dump metrics to %s: %s',
+                               self.path, e)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='avi-metrics-file')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+class HttpExporter(object):
+    """serves the metrics in prometheus text format on /metrics"""
+    def __init__(self, port, host='127.0.0.1', metrics=None):
+        self.metrics = metrics if metrics is not None else api_metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = HTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name='avi-metrics-http')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def process_path(path):
+    """returns path with the pid, e.g. metrics.<pid>.prom for metrics.prom"""
+    root, ext = os.path.splitext(path)
+    return '%s.%d%s' % (root, os.getpid(), ext)
+
+
+def add_exporter(key, factory):
+    """
+    registers the exporter built by factory, started by ensure_exporters in
+    each process making API calls; the exporters of a key are registered
+    once
+    """
+    with _exporters_lock:
+        _exporter_factories.setdefault(key, factory)
+
+
+def ensure_exporters():
+    """
+    starts the registered exporters not running in the process yet. The
+    exporter threads don't survive fork, so the exporters are started by
+    the API calls, in the worker processes that make them, rather than
+    when the driver is created in the parent process. An exporter which
+    could not be started, e.g. its port is bound by another worker, is not
+    retried in the process.
+    """
+    global _exporters_pid
+    pid = os.getpid()
+    if _exporters_pid == pid and len(_exporters) == len(_exporter_factories):
+        return
+    with _exporters_lock:
+        if _exporters_pid != pid:
+            _exporters.clear()
+            _exporters_pid = pid
+        for key, factory in _exporter_factories.items():
+            if key in _exporters:
+                continue
+            try:
+                _exporters[key] = factory().start()
+            except (IOError, OSError) as e:
+                logger.warning('could not start metrics exporter %s: %s',
+                               key, e)
+                _exporters[key] = None
+
+
+def get_exporter(key):
+    """returns the exporter of key running in the process or None"""
+    with _exporters_lock:
+        return _exporters.get(key) if _exporters_pid == os.getpid() else None
+
+
+def stop_exporters():
+    """stops and unregisters all the exporters"""
+    global _exporters_pid
+    with _exporters_lock:
+        for exporter in _exporters.values():
+            if exporter is not None and _exporters_pid == os.getpid():
+                exporter.stop()
+        _exporters.clear()
+        _exporter_factories.clear()
+        _exporters_pid = None
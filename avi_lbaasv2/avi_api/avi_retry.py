@@ -0,0 +1,131 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Retry classes of failed API calls
+RETRY_CONNECTION = 'connection'  # connection or SSL errors
+RETRY_SESSION = 'session'        # 401/419; session needs re-authentication
+RETRY_CONFLICT = 'conflict'      # 412; concurrent update of the object
+RETRY_SERVER = 'server'          # 502/503/504 on idempotent calls
+RETRY_THROTTLED = 'throttled'    # 429
+
+IDEMPOTENT_METHODS = ('get', 'head', 'options', 'put', 'delete')
+SERVER_RETRY_CODES = (502, 503, 504)
+
+
+class RetryBudget(object):
+    """
+    Global retry budget shared by all the calls of a session. Retries are
+    allowed as long as they stay below `ratio` of the requests sent in the
+    last `window` seconds, with a floor of `min_retries` retries per
+    window, so that a slow controller is not hit by a retry storm.
+    """
+    def __init__(self, ratio=0.2, min_retries=10, window=10):
+        self.ratio = float(ratio)
+        self.min_retries = int(min_retries)
+        self.window = int(window)
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _counts(self, now):
+        # buckets are per second: {second: [requests, retries]}
+        oldest = now - self.window
+        for sec in [s for s in self._buckets if s <= oldest]:
+            del self._buckets[sec]
+        requests = sum(b[0] for b in self._buckets.values())
+        retries = sum(b[1] for b in self._buckets.values())
+        return requests, retries
+
+    def record_request(self):
+        now = int(time.time())
+        with self._lock:
+            self._buckets.setdefault(now, [0, 0])[0] += 1
+
+    def try_withdraw(self):
+        """returns True and accounts the retry if budget allows it"""
+        now = int(time.time())
+        with self._lock:
+            requests, retries = self._counts(now)
+            if retries >= max(self.min_retries, requests * self.ratio):
+                return False
+            self._buckets.setdefault(now, [0, 0])[1] += 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Classifies failed API calls and decides whether and when to retry them.
+    Waits use exponential backoff with full jitter, capped at backoff_max.
+    Each call may retry up to max_retries times (per retry class overrides
+    in class_max_retries) and all retries, except session re-authentication,
+    are charged to the shared RetryBudget.
+    """
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=10.0,
+                 budget=None, class_max_retries=None):
+        self.max_retries = int(max_retries)
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.budget = budget if budget is not None else RetryBudget()
+        self.class_max_retries = {RETRY_CONFLICT: 10}
+        if class_max_retries:
+            self.class_max_retries.update(class_max_retries)
+
+    def record_request(self):
+        self.budget.record_request()
+
+    def classify(self, api_name, resp=None, error=None):
+        """returns the retry class of the call result or None"""
+        if error is not None:
+            return RETRY_CONNECTION
+        if resp is None:
+            return None
+        code = resp.status_code
+        if code in (401, 419):
+            return RETRY_SESSION
+        if code == 412:
+            return RETRY_CONFLICT
+        if code == 429:
+            return RETRY_THROTTLED
+        if (code in SERVER_RETRY_CODES and
+                api_name.lower() in IDEMPOTENT_METHODS):
+            return RETRY_SERVER
+        return None
+
+    def allow_retry(self, retry_class, attempt):
+        """
+        returns True if the attempt'th retry of a call failing with
+        retry_class is allowed by the per call and global budgets
+        """
+        max_retries = self.class_max_retries.get(retry_class,
+                                                 self.max_retries)
+        if attempt > max_retries:
+            return False
+        if retry_class == RETRY_SESSION:
+            return True
+        if not self.budget.try_withdraw():
+            logger.warning('retry budget exhausted; not retrying %s failure',
+                           retry_class)
+            return False
+        return True
+
+    def backoff(self, attempt, resp=None):
+        """returns the seconds to wait before the attempt'th retry"""
+        if resp is not None and resp.status_code == 429:
+            retry_after = resp.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        cap = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    def wait(self, retry_class, attempt, resp=None):
+        if retry_class == RETRY_SESSION and attempt == 1:
+            # session was just re-authenticated; retry right away
+            return
+        delay = self.backoff(attempt, resp=resp)
+        if delay > 0:
+            logger.debug('retry %d of %s failure in %.2f secs', attempt,
+                         retry_class, delay)
+            time.sleep(delay)
@@ -0,0 +1,104 @@
+import errno
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileSessionStore(object):
+    """
+    Controller sessions shared by the processes of a host through a JSON
+    file, e.g. by the forked neutron-server API workers, so that they reuse
+    one controller session instead of logging in each on its own.
+
+    The file maps the session keys to their csrftoken, session id and
+    cookie name. It is replaced atomically on every save so readers need
+    no lock; logins are serialized across the processes with an flock on
+    `<path>.lock`. The lock is polled instead of blocking so that waiting
+    for it does not block the other greenthreads of the process.
+    """
+    LOCK_POLL_INTERVAL = 0.05
+    SESSION_FIELDS = ('csrftoken', 'session_id', 'session_cookie_name')
+
+    def __init__(self, path, lock_timeout=120):
+        self.path = path
+        self.lock_timeout = lock_timeout
+        if fcntl is None:
+            logger.warning('fcntl not available; logins to the controller '
+                           'are not serialized across processes')
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return {}
+        except ValueError as e:
+            logger.warning('ignoring corrupt session file %s: %s',
+                           self.path, e)
+            return {}
+
+    def load(self, key):
+        """returns the shared session stored for key or None"""
+        session = self._read().get(key)
+        if session is None:
+            return None
+        if not (isinstance(session, dict) and
+                all(session.get(k) for k in self.SESSION_FIELDS)):
+            logger.warning('ignoring corrupt session of %s in %s', key,
+                           self.path)
+            return None
+        return session
+
+    def save(self, key, session):
+        """stores the session for key; call it while holding lock()"""
+        sessions = self._read()
+        if session is None:
+            sessions.pop(key, None)
+        else:
+            sessions[key] = session
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        # the file holds live session credentials
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(sessions, f)
+        os.rename(tmp_path, self.path)
+
+    @contextmanager
+    def lock(self):
+        """exclusive lock of the store across the processes of the host"""
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            locked = False
+            deadline = time.time() + self.lock_timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except (IOError, OSError) as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    if time.time() > deadline:
+                        logger.warning('timed out waiting for lock of %s',
+                                       self.path)
+                        break
+                    time.sleep(self.LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                if locked:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
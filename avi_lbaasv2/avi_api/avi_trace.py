@@ -0,0 +1,245 @@
+"""
+Lightweight tracing of the driver operations.
+
+A span is opened per driver operation, with child spans for the
+avi_generic/AviHelper functions it calls and leaf spans for the Avi
+Controller API calls. The spans of an operation share its trace id, which
+is also sent to the controller as correlation id header. Tracing is
+enabled by setting an exporter; finished spans are then written as JSON
+lines, one object per span, which
+
+    python -m avi_lbaasv2.avi_api.avi_trace <spans file> [trace id]
+
+renders as per operation waterfalls.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+CORRELATION_HEADER = 'X-Avi-Correlation-Id'
+
+_exporter = None
+_local = threading.local()
+
+
+class Span(object):
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start',
+                 'duration', 'attrs', 'error')
+
+    def __init__(self, name, parent=None, attrs=None):
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.attrs = attrs or {}
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+
+class JsonLinesExporter(object):
+    """
+    appends the finished spans to path, one JSON object per line. The file
+    is kept open, line buffered so that the lines of the worker processes
+    sharing it don't interleave, and is reopened by a forked process.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                self._file = open(self.path, 'a', 1)
+                self._pid = os.getpid()
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+
+
+def set_exporter(exporter):
+    """enables tracing with exporter; None disables it"""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    if previous is not None and previous is not exporter:
+        close = getattr(previous, 'close', None)
+        if close is not None:
+            close()
+
+
+def enabled():
+    return _exporter is not None
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current_span():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def current_trace_id():
+    span = current_span()
+    return span.trace_id if span else None
+
+
+class _NullSpan(object):
+    def set(self, **attrs):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    context manager opening a child span of the current span of the
+    thread, or a new trace if there is none
+    """
+    if _exporter is None:
+        yield _null_span
+        return
+    stack = _stack()
+    sp = Span(name, stack[-1] if stack else None, attrs)
+    stack.append(sp)
+    try:
+        yield sp
+    except Exception as e:
+        sp.error = '%s: %s' % (type(e).__name__, e)
+        raise
+    finally:
+        sp.duration = time.time() - sp.start
+        stack.pop()
+        exporter = _exporter
+        if exporter is not None:
+            try:
+                exporter.export(sp)
+            except Exception as e:
+                logger.warning('could not export span %s: %s', name, e)
+
+
+def traced(name=None):
+    """decorator running the function in a span named after it"""
+    def decorator(f):
+        span_name = name or f.__name__
+
+        @wraps(f)
+        def f_traced(*args, **kwargs):
+            if _exporter is None:
+                return f(*args, **kwargs)
+            with span(span_name):
+                return f(*args, **kwargs)
+        return f_traced
+    return decorator
+
+
+def bind(fn):
+    """
+    returns fn running with the current span as parent, for running it in
+    another thread, e.g. in an ApiExecutor worker
+    """
+    parent = current_span()
+    if parent is None:
+        return fn
+
+    @wraps(fn)
+    def bound(*args, **kwargs):
+        stack = _stack()
+        stack.append(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stack.pop()
+    return bound
+
+
+def load_spans(path):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                spans.append(json.loads(line))
+    return spans
+
+
+def render_waterfall(spans, width=60):
+    """
+    returns the text waterfalls of the traces in spans, one per root span,
+    with the children indented under their parent and a bar showing when
+    they ran relative to the root
+    """
+    children = {}
+    for sp in spans:
+        children.setdefault(sp['parent_id'], []).append(sp)
+    for sps in children.values():
+        sps.sort(key=lambda s: s['start'])
+    lines = []
+
+    def render(sp, depth, root):
+        total = root['duration'] or 1e-9
+        offset = int((sp['start'] - root['start']) / total * width)
+        length = max(int(sp['duration'] / total * width), 1)
+        offset = min(offset, width - 1)
+        length = min(length, width - offset)
+        bar = ' ' * offset + '#' * length
+        label = '  ' * depth + sp['name']
+        if sp.get('attrs'):
+            label += ' ' + ' '.join('%s=%s' % kv
+                                    for kv in sorted(sp['attrs'].items()))
+        if sp.get('error'):
+            label += ' !' + sp['error']
+        lines.append('%-*s %9.1fms |%s' % (width, label[:width],
+                                           sp['duration'] * 1000,
+                                           bar.ljust(width)))
+        for child in children.get(sp['span_id'], []):
+            render(child, depth + 1, root)
+
+    for root in children.get(None, []):
+        lines.append('trace %s' % root['trace_id'])
+        render(root, 0, root)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        sys.stderr.write('usage: avi_trace <spans file> [trace id]\n')
+        return 1
+    spans = load_spans(argv[0])
+    if len(argv) > 1:
+        spans = [sp for sp in spans if sp['trace_id'] == argv[1]]
+    sys.stdout.write(render_waterfall(spans) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,7 +6,8 @@ import time
 from oslo_config import cfg
 from oslo_utils import excutils
 
-from avi_lbaasv2.avi_api.avi_api import APIError
+from avi_lbaasv2.avi_api.avi_api import APIError, ControllerUnavailable
+from avi_lbaasv2.avi_api.avi_trace import traced
 from avi_lbaasv2.common.avi_client import AviClient
 from avi_lbaasv2.common.avi_generic import DriverObjFunctions
 from avi_lbaasv2.common.avi_generic import (
@@ -16,6 +17,7 @@ from avi_lbaasv2.common.avi_generic import (
     pool_update_avi_vs_pool, pool_delete_avi_vs_pool,
     member_op_avi_pool, hm_op_avi_pool, get_vrf_context,
     os2avi_uuid, delete_vsvip)
+from avi_lbaasv2.common.avi_planner import plan_loadbalancer
 from avi_lbaasv2.common.avi_transform import AviHelper
 from avi_lbaasv2.config import avi_config
 
@@ -74,6 +76,7 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
                 pass
         return
 
+    @traced('loadbalancer.create')
     def create(self, context, lb):
         self._detect_plugin()
         LOG.debug("Avi driver create lb: %s", repr(lb))
@@ -89,12 +92,19 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
             # Create VRF Context if doesn't exist
             avi_client = self.driver.client
             avi_tenant_uuid = os2avi_uuid("tenant", lb.tenant_id)
-            get_vrf_context(lb.vip_subnet_id, self.driver.conf.cloud,
-                            avi_tenant_uuid, avi_client,
-                            create=True)
+            try:
+                get_vrf_context(lb.vip_subnet_id, self.driver.conf.cloud,
+                                avi_tenant_uuid, avi_client,
+                                create=True)
+            except ControllerUnavailable as e:
+                LOG.error("Creating LoadBalancer on Avi Failed: %s, %s",
+                          lb.id, e)
+                with excutils.save_and_reraise_exception():
+                    self.failed_completion(context, lb)
 
         self.successful_completion(context, lb)
 
+    @traced('loadbalancer.update')
     def update(self, context, old_lb, lb):
         LOG.debug("Avi driver update lb: %s", repr(lb))
         failed = update_loadbalancer_obj(self.driver, context, old_lb, lb)
@@ -103,6 +113,7 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
         else:
             self.failed_completion(context, lb)
 
+    @traced('loadbalancer.delete')
     def delete(self, context, lb):
         self._detect_plugin()
         LOG.debug("Avi driver delete lb: %s", repr(lb))
@@ -114,7 +125,12 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
                 LOG.debug('deleted LB vip port %s', vportid)
 
         avi_client = self.driver.client
-        delete_vsvip(lb, avi_client)
+        try:
+            delete_vsvip(lb, avi_client)
+        except ControllerUnavailable as e:
+            LOG.error("Deleting LoadBalancer on Avi Failed: %s, %s", lb.id, e)
+            with excutils.save_and_reraise_exception():
+                self.failed_completion(context, lb)
         # AV-35351: Can't determine how much time it would take to
         # delete all the associated ports for this load balancer. It
         # depends on types of VSes (SSL etc) and number of VSes.
@@ -124,11 +140,24 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
         time.sleep(2)
         self.successful_completion(context, lb, delete=True)
 
+    @traced('loadbalancer.refresh')
     def refresh(self, context, lb):
         LOG.debug("Avi driver refresh lb: %s", repr(lb))
-        for listener in self.get_listeners(context, lb):
-            self.driver.listener.update(context, None, listener)
-        # self.update(context, lb, lb)
+        # the vsvip, pools and VSes of all the listeners, level by level
+        listeners = list(self.get_listeners(context, lb))
+        plan = plan_loadbalancer(self.driver, context, lb, listeners)
+        plan.execute(self.driver, raise_errors=False)
+        for listener in listeners:
+            avi_vs_id = os2avi_uuid('virtualservice', listener.id)
+            if plan.succeeded(('virtualservice', avi_vs_id)):
+                self.driver.listener.successful_completion(context, listener)
+            else:
+                LOG.error("Refreshing VirtualService on Avi Failed: %s",
+                          listener.id)
+                self.driver.listener.failed_completion(context, listener)
+        for key, e in plan.errors.items():
+            LOG.error("Refreshing %s on Avi Failed: %s", key, e)
+        plan.raise_errors()
 
     def stats(self, context, lb):
         LOG.debug("Avi driver stats of lb: %s", repr(lb))
@@ -148,28 +177,31 @@ class ListenerManager(driver_base.BaseListenerManager):
         super(ListenerManager, self).__init__(driver)
         self.driver = driver
 
+    @traced('listener.create')
     def create(self, context, listener):
         LOG.debug("Avi driver create listener: %s", repr(listener))
         try:
             listener_update_avi_vs(self.driver, context, listener, "create")
             self.successful_completion(context, listener)
-        except APIError as e:
+        except (APIError, ControllerUnavailable) as e:
             LOG.exception("Creating VirtualService on Avi Failed: %s, %s",
                           listener.id, e)
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, listener)
 
+    @traced('listener.update')
     def update(self, context, old_listener, listener):
         LOG.debug("Avi driver update listener: %s", repr(listener))
         try:
             listener_update_avi_vs(self.driver, context, listener, "update")
             self.successful_completion(context, listener)
-        except APIError as e:
+        except (APIError, ControllerUnavailable) as e:
             LOG.exception("Updating VirtualService on Avi Failed: %s, %s",
                           listener.id, e)
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, listener)
 
+    @traced('listener.delete')
     def delete(self, context, listener):
         LOG.debug("Avi driver delete listener: %s", repr(listener))
         try:
@@ -188,34 +220,37 @@ class PoolManager(driver_base.BasePoolManager):
         super(PoolManager, self).__init__(driver)
         self.driver = driver
 
+    @traced('pool.create')
     def create(self, context, pool):
         LOG.debug("Avi driver create pool: %s", repr(pool))
         # we will create one pool for each listener
         try:
             pool_update_avi_vs_pool(self.driver, context, pool, update_ls=True)
             self.successful_completion(context, pool)
-        except APIError as e:
+        except (APIError, ControllerUnavailable) as e:
             LOG.exception("Creating Pool on Avi Failed: %s, %s", e, pool.id)
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, pool)
 
+    @traced('pool.update')
     def update(self, context, old_pool, pool):
         LOG.debug("Avi driver update pool: %s", repr(pool))
         try:
             pool_update_avi_vs_pool(self.driver, context, pool)
             self.successful_completion(context, pool)
-        except APIError as e:
+        except (APIError, ControllerUnavailable) as e:
             LOG.exception("Updating Pool on Avi Failed: %s, %s", e, pool.id)
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, pool)
 
+    @traced('pool.delete')
     def delete(self, context, pool):
         LOG.debug("Avi driver delete pool: %s", repr(pool))
         # remove the pool from all VSes first
         try:
             pool_delete_avi_vs_pool(self.driver, context, pool)
             self.successful_completion(context, pool, delete=True)
-        except APIError as e:
+        except (APIError, ControllerUnavailable) as e:
             LOG.exception("Deleting Pool on Avi Failed: %s, %s", e, pool.id)
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, pool)
@@ -232,7 +267,7 @@ class MemberManager(driver_base.BaseMemberManager):
             member_op_avi_pool(self.driver, context, member, action=action)
             self.successful_completion(context, member,
                                        delete=(action == "delete"))
-        except APIError as e:
+        except (APIError, ControllerUnavailable) as e:
             LOG.exception("%s of Member on Avi Failed: %s, %s", action,
                           member.id, e)
             with excutils.save_and_reraise_exception():
@@ -243,12 +278,13 @@ class MemberManager(driver_base.BaseMemberManager):
             pool_update_avi_vs_pool(self.driver, context, member.pool)
             self.successful_completion(context, member,
                                        delete=(action == "delete"))
-        except APIError as e:
+        except (APIError, ControllerUnavailable) as e:
             LOG.exception("%s of Member on Avi Failed: %s, %s", action,
                           member.id, e)
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, member)
 
+    @traced('member.create')
     def create(self, context, member):
         LOG.debug("Avi driver create member: %s", repr(member))
         if self.driver.conf.use_placement_network_for_pool:
@@ -259,6 +295,7 @@ class MemberManager(driver_base.BaseMemberManager):
             # This will PATCH pool members
             self.member_op(context, member, action="add")
 
+    @traced('member.update')
     def update(self, context, old_member, member):
         LOG.debug("Avi driver update member: %s", repr(member))
         # IP address and port number fields are read-only attributes
@@ -272,6 +309,7 @@ class MemberManager(driver_base.BaseMemberManager):
             # This will PATCH pool members
             self.member_op(context, member, action="add")
 
+    @traced('member.delete')
     def delete(self, context, member):
         LOG.debug("Avi driver delete member: %s", repr(member))
         if self.driver.conf.use_placement_network_for_pool:
@@ -312,6 +350,7 @@ class HealthMonitorManager(driver_base.BaseHealthMonitorManager):
                 db_pools.append(db_pool)
         return db_pools
 
+    @traced('healthmonitor.create')
     def create(self, context, health_monitor):
         LOG.debug("Avi driver create pool_health_monitor. "
                   "health_monitor.type: %s",
@@ -333,6 +372,7 @@ class HealthMonitorManager(driver_base.BaseHealthMonitorManager):
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, health_monitor)
 
+    @traced('healthmonitor.update')
     def update(self, context, old_health_monitor, health_monitor):
         LOG.debug("Avi driver update health_monitor: %s",
                   repr(health_monitor))
@@ -353,6 +393,7 @@ class HealthMonitorManager(driver_base.BaseHealthMonitorManager):
             with excutils.save_and_reraise_exception():
                 self.failed_completion(context, health_monitor)
 
+    @traced('healthmonitor.delete')
     def delete(self, context, health_monitor):
         LOG.debug("Avi driver delete health_monitor: %s",
                   repr(health_monitor))
@@ -490,7 +531,8 @@ class AviDriver(driver_base.LoadBalancerBaseDriver):
             self.client = AviClient(self.conf.address,
                                     self.conf.user,
                                     self.conf.password,
-                                    verify=self.conf.cert_verify)
+                                    verify=self.conf.cert_verify,
+                                    conf=self.conf)
         except Exception as e:
             LOG.exception("Could not create session to Avi Controller: %s", e)
         self.avi_helper = AviHelper(self.conf)
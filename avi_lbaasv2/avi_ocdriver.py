@@ -14,6 +14,8 @@ from svc_monitor.config_db import (LoadbalancerSM, LoadbalancerListenerSM,
                                    LoadbalancerPoolSM, LoadbalancerMemberSM)
 # from svc_monitor.config_db import HealthMonitorSM
 from svc_monitor.config_db import VirtualMachineInterfaceSM
+from avi_lbaasv2.avi_api.avi_log import LazyData
+from avi_lbaasv2.avi_api.avi_trace import span
 from avi_lbaasv2.common.avi_client import AviClient
 from avi_lbaasv2.common.avi_generic import (update_loadbalancer_obj,
                                             listener_update_avi_vs,
@@ -42,9 +44,10 @@ LOG = None
 def cc_trace(f):
     @wraps(f)
     def f_trace(self, *args, **kwargs):
-        self.log.info('fn %s args %s', f.__name__, str(args))
+        self.log.info('fn %s args %s', f.__name__, LazyData(args))
         try:
-            res = f(self, *args, **kwargs)
+            with span(f.__name__):
+                res = f(self, *args, **kwargs)
             return res
         except Exception as e:
             self.log.exception('ocavi fn %s failed %s', f.__name__, e)
@@ -227,7 +230,8 @@ class OpencontrailAviLoadbalancerDriver(
         try:
             self.client = AviClient(self.conf.address, self.conf.user,
                                     self.conf.password,
-                                    verify=self.conf.cert_verify, log=self.log)
+                                    verify=self.conf.cert_verify, log=self.log,
+                                    conf=self.conf)
         except Exception as e:
             self.log.exception(
                 'ocavi: Could not create session to Avi Controller: %s', e)
@@ -1,31 +1,261 @@
+import copy
 import logging
+import threading
 
+from avi_lbaasv2.avi_api import avi_codec, avi_log
 from avi_lbaasv2.avi_api.avi_api import (ApiSession, ObjectNotFound,
                                          APIError, ApiResponse)
+from avi_lbaasv2.avi_api.avi_async import AsyncApiSession, get_executor
+from avi_lbaasv2.avi_api.avi_breaker import get_breaker
+from avi_lbaasv2.avi_api.avi_cache import (NegativeCache, ObjectCache,
+                                           RefCache)
+from avi_lbaasv2.avi_api.avi_delta import delta_patches
+from avi_lbaasv2.avi_api.avi_limiter import get_limiter
+from avi_lbaasv2.avi_api.avi_log import LazyData, data_log_enabled
+from avi_lbaasv2.avi_api.avi_metrics import (FileExporter, HttpExporter,
+                                             add_exporter, process_path)
+from avi_lbaasv2.avi_api.avi_retry import (RetryBudget, RetryPolicy,
+                                           RETRY_CONFLICT)
+from avi_lbaasv2.avi_api.avi_session_store import FileSessionStore
+from avi_lbaasv2.avi_api.avi_sync import SingleFlight
+from avi_lbaasv2.avi_api.avi_trace import (JsonLinesExporter,
+                                           set_exporter)
 
 
 LOG = logging.getLogger(__name__)
 
+# types whose objects the controller changes when another object of the type
+# is written, e.g. vh_child_vs_uuid of a parent VS when a child VS is created
+# or deleted; writing one invalidates all the cached objects of the type
+LINKED_TYPES = ('virtualservice',)
+
+# number of the write generations of the objects, see AviClient._written
+GENERATION_SLOTS = 4096
+
+# Avi model names of the object types the macro API creates in batches
+MODEL_NAMES = {
+    'applicationpersistenceprofile': 'ApplicationPersistenceProfile',
+    'healthmonitor': 'HealthMonitor',
+    'pool': 'Pool',
+    'sslkeyandcertificate': 'SSLKeyAndCertificate',
+    'virtualservice': 'VirtualService',
+    'vrfcontext': 'VrfContext',
+    'vsvip': 'VsVip',
+}
+
+# responses of controllers without the macro API
+MACRO_UNAVAILABLE_CODES = (404, 405, 501)
+
+# refs to the parent of an object; the parent is never sent inline under
+# its child, so that it is the root of the macro request creating it
+MACRO_PARENT_REF_FIELDS = ('vh_parent_vs_ref',)
+
+
+def obj_ref(resource_type, obj_uuid):
+    """returns the ref of an object by uuid, e.g. /api/pool/<uuid>"""
+    return '/api/%s/%s' % (resource_type, obj_uuid)
+
+
+class MacroUnavailable(Exception):
+    """Raised when the controller does not support the macro API"""
+
+
+class BatchError(APIError):
+    """
+    Raised when the commit of an AviBatch fails after some of its objects
+    were created, e.g. the inline objects of a macro request which failed
+    on its top level object. created lists the refs of the objects of the
+    batch which exist, error is the original error; the later operations
+    of the batch were not made.
+    """
+    def __init__(self, arg, rsp=None, created=None, error=None):
+        super(BatchError, self).__init__(arg, rsp)
+        self.created = created or []
+        self.error = error
+
+
+def conf_get(conf, name, default, cast=None):
+    """
+    returns option value from driver config; contrail driver config values
+    are strings, so cast them to the type of option
+    """
+    value = getattr(conf, name, None) if conf is not None else None
+    if value is None or value == '':
+        return default
+    if cast is bool:
+        if isinstance(value, bool):
+            return value
+        return str(value).lower() in ('true', 'yes', 'on', '1')
+    return cast(value) if cast else value
+
 
 class AviClient(object):
 
     def __init__(self, controller_ip, username, password, verify=False,
-                 log=LOG):
+                 log=LOG, conf=None):
         if (not controller_ip or not username or not password):
             raise Exception("Missing Avi credentials.")
         self.log = log
-        self.avi_session = ApiSession.get_session(controller_ip,
-                                                  username, password,
-                                                  verify=verify,
-                                                  api_version='18.1.2',
-                                                  lazy_authentication=True,)
+        json_backend = conf_get(conf, 'json_backend', None)
+        if json_backend:
+            avi_codec.set_backend(json_backend)
+        retry_policy = RetryPolicy(
+            max_retries=conf_get(conf, 'api_max_retries',
+                                 ApiSession.MAX_API_RETRIES, int),
+            backoff_base=conf_get(conf, 'api_retry_backoff',
+                                  ApiSession.RETRY_BACKOFF, float),
+            backoff_max=conf_get(conf, 'api_retry_backoff_max',
+                                 ApiSession.RETRY_BACKOFF_MAX, float),
+            budget=RetryBudget(
+                ratio=conf_get(conf, 'api_retry_budget_ratio', 0.2, float)))
+        session_file = conf_get(conf, 'shared_session_file', None)
+        self.avi_session = ApiSession.get_session(
+            controller_ip, username, password, verify=verify,
+            api_version='18.1.2', lazy_authentication=True,
+            max_api_retries=retry_policy.max_retries,
+            retry_policy=retry_policy,
+            limiter=get_limiter(
+                controller_ip,
+                rate=conf_get(conf, 'api_rate_limit', 0, float),
+                burst=conf_get(conf, 'api_rate_burst', 20, int),
+                max_concurrency=conf_get(conf, 'api_max_concurrency', 10,
+                                         int),
+                min_concurrency=conf_get(conf, 'api_min_concurrency', 1,
+                                         int),
+                latency_target=conf_get(conf, 'api_latency_target', 2.0,
+                                        float)),
+            breaker=get_breaker(
+                controller_ip,
+                failure_threshold=conf_get(conf, 'api_breaker_threshold', 5,
+                                           int),
+                reset_timeout=conf_get(conf, 'api_breaker_reset_timeout', 30,
+                                       int)),
+            session_store=(FileSessionStore(session_file) if session_file
+                           else None),
+            pool_maxsize=conf_get(conf, 'api_pool_maxsize', None, int),
+            pool_block=conf_get(conf, 'api_pool_block', False, bool),
+            keepalive_timeout=conf_get(conf, 'api_keepalive_timeout', None,
+                                       int))
+        self.executor = get_executor(
+            conf_get(conf, 'api_max_workers', None, int))
+        self.async_session = AsyncApiSession(self.avi_session, self.executor)
+        self.async_client = AsyncAviClient(self)
+        self._get_flight = SingleFlight()
+        self._generations = [0] * GENERATION_SLOTS
+        self._generations_lock = threading.Lock()
+        self.cache = ObjectCache(
+            ttl=conf_get(conf, 'api_cache_ttl', 0, float),
+            max_size=conf_get(conf, 'api_cache_size', 1024, int))
+        self.missing = NegativeCache(
+            ttl=conf_get(conf, 'api_negative_cache_ttl', 0, float),
+            max_size=conf_get(conf, 'api_cache_size', 1024, int))
+        self.conditional_update = conf_get(conf, 'api_conditional_update',
+                                           True, bool)
+        self.delta_update = conf_get(conf, 'api_delta_update', True, bool)
+        self.macro_enabled = conf_get(conf, 'api_macro', True, bool)
+        self.ref_cache = RefCache(
+            ttl=conf_get(conf, 'ref_cache_ttl', 3600, float))
+        if conf_get(conf, 'api_eager_login', False, bool):
+            self.login()
+        self.avi_session.start_keepalive(
+            conf_get(conf, 'api_session_keepalive', 300, int))
+        self._add_metrics_exporters(conf)
+        avi_log.configure(
+            sample_rate=conf_get(conf, 'data_log_sample_rate', 1.0, float),
+            max_size=conf_get(conf, 'data_log_max_size', 4096, int),
+            type_sample_rates=conf_get(conf, 'data_log_type_sample_rates',
+                                       {}),
+            type_max_sizes=conf_get(conf, 'data_log_type_max_sizes', {}))
+        trace_file = conf_get(conf, 'trace_file', None)
+        if trace_file:
+            set_exporter(JsonLinesExporter(trace_file))
         return
 
+    def _add_metrics_exporters(self, conf):
+        # started by the first API call of each worker process
+        metrics_file = conf_get(conf, 'metrics_file', None)
+        if metrics_file:
+            interval = conf_get(conf, 'metrics_interval', 60, int)
+            add_exporter(('file', metrics_file),
+                         lambda: FileExporter(process_path(metrics_file),
+                                              interval))
+        metrics_port = conf_get(conf, 'metrics_port', 0, int)
+        if metrics_port:
+            add_exporter(('http', metrics_port),
+                         lambda: HttpExporter(metrics_port))
+
+    def login(self):
+        """
+        authenticates the session ahead of the first API call; failures are
+        only logged, the API calls login again if needed
+        """
+        try:
+            self.avi_session.authenticate_session()
+        except Exception as e:
+            self.log.warning("Login to Avi Controller failed: %s", e)
+
+    def pool_stats(self):
+        return self.avi_session.pool_stats()
+
+    def limiter_stats(self):
+        return self.avi_session.limiter_stats()
+
+    def breaker_stats(self):
+        return self.avi_session.breaker_stats()
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def ref_cache_stats(self):
+        return self.ref_cache.stats()
+
+    def negative_cache_stats(self):
+        return self.missing.stats()
+
+    def _cache_invalidate(self, resource_type, obj_uuid, avi_tenant_uuid):
+        # refs are cached by name, so which of them obj_uuid is isn't known
+        self.ref_cache.invalidate(resource_type)
+        if resource_type in LINKED_TYPES:
+            self.cache.invalidate_type(avi_tenant_uuid, resource_type)
+        else:
+            self.cache.invalidate((avi_tenant_uuid, resource_type, obj_uuid))
+
+    def _generation_key(self, avi_tenant_uuid, resource_type, obj_uuid=None):
+        if obj_uuid is None or resource_type in LINKED_TYPES:
+            return hash((avi_tenant_uuid, resource_type)) % GENERATION_SLOTS
+        return hash((avi_tenant_uuid, resource_type,
+                     obj_uuid)) % GENERATION_SLOTS
+
+    def _written(self, resource_type, obj_uuid, avi_tenant_uuid):
+        """
+        bumps the write generations of the object and of its type, which
+        are part of the keys of the coalesced reads: the reads made after a
+        write don't join the reads in flight since before it, which may
+        return the object as it was. Objects share a generation when their
+        keys hash to the same slot, which only costs some coalescing.
+        """
+        slots = set([
+            self._generation_key(avi_tenant_uuid, resource_type),
+            self._generation_key(avi_tenant_uuid, resource_type, obj_uuid)])
+        with self._generations_lock:
+            for slot in slots:
+                self._generations[slot] += 1
+
+    def _generation(self, avi_tenant_uuid, resource_type, obj_uuid=None):
+        return self._generations[self._generation_key(
+            avi_tenant_uuid, resource_type, obj_uuid)]
+
+    def _cache_put(self, resource_type, obj, avi_tenant_uuid, fields=None):
+        if isinstance(obj, dict) and obj.get('uuid'):
+            self.cache.put((avi_tenant_uuid, resource_type, obj['uuid']),
+                           obj, fields)
+
     def delete(self, resource_type, obj_uuid, avi_tenant_uuid,
                ignore_if_not_exists=True,
                ignore_tenant_does_not_exist=True):
         self.log.debug("In AviClient Delete: %s, %s, %s", resource_type,
                        obj_uuid, avi_tenant_uuid)
+        self._cache_invalidate(resource_type, obj_uuid, avi_tenant_uuid)
         try:
             self.avi_session.delete("%s/%s" % (resource_type, obj_uuid),
                                     tenant_uuid=avi_tenant_uuid).json()
@@ -44,59 +274,187 @@ class AviClient(object):
                                    avi_tenant_uuid, resource_type, obj_uuid, e)
             else:
                 raise
+        finally:
+            self._written(resource_type, obj_uuid, avi_tenant_uuid)
+        self.missing.add((avi_tenant_uuid, resource_type, obj_uuid))
         return
 
     def create(self, resource_type, resource_def, avi_tenant_uuid):
-        self.log.debug("In AviClient Create: %s, %s, %s", resource_type,
-                       resource_def, avi_tenant_uuid)
+        if data_log_enabled(self.log, resource_type):
+            self.log.debug("In AviClient Create: %s, %s, %s", resource_type,
+                           LazyData(resource_def, resource_type),
+                           avi_tenant_uuid)
         headers = {}
         if 'uuid' in resource_def:
             headers["Slug"] = resource_def["uuid"]
-        return self.avi_session.post(resource_type, data=resource_def,
-                                     tenant_uuid=avi_tenant_uuid,
-                                     headers=headers).json()
+        try:
+            res = self.avi_session.post(resource_type, data=resource_def,
+                                        tenant_uuid=avi_tenant_uuid,
+                                        headers=headers).json()
+        finally:
+            self._written(resource_type, resource_def.get('uuid'),
+                          avi_tenant_uuid)
+        self._created(resource_type, resource_def, res, avi_tenant_uuid)
+        return res
+
+    def _created(self, resource_type, resource_def, res, avi_tenant_uuid):
+        self.missing.invalidate((avi_tenant_uuid, resource_type,
+                                 resource_def.get('uuid') or
+                                 (res or {}).get('uuid')))
+        if resource_type in LINKED_TYPES:
+            self.cache.invalidate_type(avi_tenant_uuid, resource_type)
+        self.ref_cache.invalidate(resource_type, resource_def.get('name'))
+        self._cache_put(resource_type, res, avi_tenant_uuid)
+
+    def batch(self, avi_tenant_uuid):
+        """returns an AviBatch of creates and updates in the tenant"""
+        return AviBatch(self, avi_tenant_uuid)
+
+    def macro_create(self, resource_type, data, avi_tenant_uuid):
+        """
+        creates an object together with the objects it refers to, given
+        inline as <field>_data of their <field> ref, in a single macro API
+        request; returns the created objects
+        :raises MacroUnavailable: if the controller has no macro API
+        """
+        if data_log_enabled(self.log, resource_type):
+            self.log.debug("In AviClient Macro Create: %s, %s, %s",
+                           resource_type, LazyData(data, resource_type),
+                           avi_tenant_uuid)
+        try:
+            rsp = self.avi_session.post(
+                'macro', data={'model_name': MODEL_NAMES[resource_type],
+                               'data': data},
+                tenant_uuid=avi_tenant_uuid)
+        finally:
+            # the objects the macro created are not known if it failed
+            self._written(resource_type, None, avi_tenant_uuid)
+        if rsp.status_code in MACRO_UNAVAILABLE_CODES:
+            self.log.info("Avi Controller has no macro API (%d); creating "
+                          "objects one at a time", rsp.status_code)
+            self.macro_enabled = False
+            raise MacroUnavailable()
+        res = rsp.json()
+        return res if isinstance(res, list) else [res]
 
     def update(self, resource_type, obj_uuid, resource_def, avi_tenant_uuid):
-        self.log.debug("In AviClient Update: %s, %s, %s, %s", resource_type,
-                       obj_uuid, resource_def, avi_tenant_uuid)
-        num_retries = 10
-        while num_retries:
+        if data_log_enabled(self.log, resource_type):
+            self.log.debug("In AviClient Update: %s, %s, %s, %s",
+                           resource_type, obj_uuid,
+                           LazyData(resource_def, resource_type),
+                           avi_tenant_uuid)
+        key = (avi_tenant_uuid, resource_type, obj_uuid)
+        retry_policy = self.avi_session.retry_policy
+        attempt = 0
+        # optimistic update: the cached version of the object is written
+        # back with its _last_modified, so the controller rejects the PUT
+        # with 412 if the object changed since; only then it is refetched
+        prev_def = self._update_base(key)
+        while True:
+            cached = prev_def is not None
+            if not cached:
+                # not answered from the negative cache: a stale entry
+                # would make this create an object which exists
+                try:
+                    prev_def = self.avi_session.get(
+                        "%s/%s" % (resource_type, obj_uuid),
+                        tenant_uuid=avi_tenant_uuid).json()
+                except ObjectNotFound:
+                    return self.create(resource_type, resource_def,
+                                       avi_tenant_uuid)
+            # the delta of a cached version could undo or miss concurrent
+            # changes, so only the version fetched by this call is compared
+            patches = (delta_patches(prev_def, resource_def)
+                       if self.delta_update and not cached else None)
+            if patches == []:
+                self.log.debug("AviClient Update: %s %s unchanged",
+                               resource_type, obj_uuid)
+                return prev_def
             try:
-                prev_def = self.avi_session.get(
-                    "%s/%s" % (resource_type, obj_uuid),
-                    tenant_uuid=avi_tenant_uuid).json()
-            except ObjectNotFound:
-                return self.create(resource_type, resource_def,
-                                   avi_tenant_uuid)
-            prev_def.update(resource_def)  # this updates prev_def inplace
-            try:
-                resp = self.avi_session.put(
-                    "%s/%s" % (resource_type, obj_uuid),
-                    tenant_uuid=avi_tenant_uuid, data=prev_def).json()
+                if patches is not None and len(patches) == 1:
+                    resp = self._patch_delta(key, prev_def, patches[0])
+                else:
+                    prev_def.update(resource_def)  # updates prev_def inplace
+                    resp = self.avi_session.put(
+                        "%s/%s" % (resource_type, obj_uuid),
+                        tenant_uuid=avi_tenant_uuid, data=prev_def).json()
                 break
+            except ObjectNotFound:
+                if not cached:
+                    raise
+                # deleted since cached; the GET falls back to create
+                self.cache.invalidate(key)
+                prev_def = None
             except APIError as e:
                 if type(e.rsp) == ApiResponse and e.rsp.status_code == 412:
                     # concurrent update error case; retry
-                    num_retries -= 1
-                    if not num_retries:
+                    self.cache.invalidate(key)
+                    prev_def = None
+                    if cached:
+                        # stale cached version; refetch right away
+                        continue
+                    attempt += 1
+                    if not retry_policy.allow_retry(RETRY_CONFLICT, attempt):
                         raise
                     self.log.warn("Will retry: %s", e)
+                    retry_policy.wait(RETRY_CONFLICT, attempt)
                 else:
                     raise
+            finally:
+                self._written(resource_type, obj_uuid, avi_tenant_uuid)
+        self._cache_invalidate(resource_type, obj_uuid, avi_tenant_uuid)
+        if isinstance(resp, dict):
+            # the PUT response lacks fields computed by the controller, e.g.
+            # vh_child_vs_uuid of a parent VS, so it only serves the gets of
+            # its fields and the next update
+            self.cache.put(key, resp, fields=list(resp), base=True)
         return resp
 
+    def _patch_delta(self, key, prev_def, patch):
+        """
+        updates the object prev_def is the current version of by patching
+        only its changed fields, in a single (op, data) PATCH conditional on
+        the _last_modified of prev_def like the PUT of update
+        """
+        avi_tenant_uuid, resource_type, obj_uuid = key
+        op, data = patch
+        data = {op: data}
+        if prev_def.get('_last_modified') is not None:
+            data['_last_modified'] = prev_def['_last_modified']
+        return self.avi_session.patch(
+            "%s/%s" % (resource_type, obj_uuid), data=data,
+            tenant_uuid=avi_tenant_uuid).json()
+
+    def _update_base(self, key):
+        """
+        returns the cached version of the object to update, if any and
+        conditional updates are enabled; always None while the object cache
+        is disabled (api_cache_ttl 0, the default)
+        """
+        if not self.conditional_update:
+            return None
+        prev_def = self.cache.get_base(key)
+        if prev_def is None or '_last_modified' not in prev_def:
+            # without _last_modified the PUT would not be conditional
+            return None
+        return prev_def
+
     def patch(self, resource_type, obj_uuid, data, avi_tenant_uuid,
               ignore_non_existent_object=False,
               ignore_non_existent_tenant=False,
               ignore_existing_object=False):
-        self.log.debug("In AviClient Patch: %s, %s, %s, %s", resource_type,
-                       obj_uuid, data, avi_tenant_uuid)
+        if data_log_enabled(self.log, resource_type):
+            self.log.debug("In AviClient Patch: %s, %s, %s, %s",
+                           resource_type, obj_uuid,
+                           LazyData(data, resource_type), avi_tenant_uuid)
         res = None
+        self._cache_invalidate(resource_type, obj_uuid, avi_tenant_uuid)
         try:
             res = self.avi_session.patch("%s/%s" % (resource_type, obj_uuid),
                                          data=data,
                                          tenant_uuid=avi_tenant_uuid).json()
         except ObjectNotFound as e:
+            self.missing.add((avi_tenant_uuid, resource_type, obj_uuid))
             if ignore_non_existent_object:
                 self.log.exception("ocavi: Object type %s uuid %s not "
                                    "found: %s",
@@ -120,21 +478,340 @@ class AviClient(object):
                                    avi_tenant_uuid, resource_type, obj_uuid, e)
             else:
                 raise
+        finally:
+            self._written(resource_type, obj_uuid, avi_tenant_uuid)
 
+        self._cache_put(resource_type, res, avi_tenant_uuid)
         return res
 
-    def get(self, resource_type, obj_uuid, avi_tenant_uuid):
+    def _projection_params(self, fields=None, include_name=False):
+        params = {}
+        if fields:
+            params['fields'] = ','.join(fields)
+        if include_name:
+            params['include_name'] = 'true'
+        return params
+
+    def get(self, resource_type, obj_uuid, avi_tenant_uuid, fields=None,
+            include_name=False, negative_cache=True):
+        """
+        :param fields: list of fields to fetch instead of the full object
+        :param include_name: return refs with the name of referred objects
+        :param negative_cache: False to look the object up even if it was
+            not found recently, e.g. when the caller creates it if missing
+
+        Objects are served from the cache when fetched or written through
+        this client within the last api_cache_ttl seconds, and objects not
+        found within the last api_negative_cache_ttl seconds are not looked
+        up again. A get of an object being fetched waits for that fetch,
+        unless it started before a write of the object through this client.
+        """
         self.log.debug("In AviClient Get: %s, %s, %s", resource_type,
                        obj_uuid, avi_tenant_uuid)
-        return self.avi_session.get("%s/%s" % (resource_type, obj_uuid),
-                                    tenant_uuid=avi_tenant_uuid,
-                                    ).json()
+        key = (avi_tenant_uuid, resource_type, obj_uuid)
+        if negative_cache and key in self.missing:
+            raise ObjectNotFound("%s/%s" % (resource_type, obj_uuid))
+        if not include_name:
+            obj = self.cache.get(key, fields)
+            if obj is not None:
+                return obj
+        generation = self._generation(*key)
+        return self._coalesced(
+            ('get', key, generation, tuple(fields or ()), include_name),
+            self._get, key, generation, fields, include_name)
+
+    def _coalesced(self, flight_key, fn, *args):
+        """
+        runs fn unless an identical call is in flight, in which case its
+        result is awaited instead of calling the controller again; shared
+        results are copied so that the callers can modify them
+        """
+        obj, shared = self._get_flight.call(flight_key, fn, *args)
+        return copy.deepcopy(obj) if shared else obj
+
+    def _get(self, key, generation, fields, include_name):
+        avi_tenant_uuid, resource_type, obj_uuid = key
+        try:
+            obj = self.avi_session.get("%s/%s" % (resource_type, obj_uuid),
+                                       tenant_uuid=avi_tenant_uuid,
+                                       params=self._projection_params(
+                                           fields, include_name),
+                                       ).json()
+        except ObjectNotFound:
+            self.missing.add(key)
+            raise
+        # not cached if written meanwhile, it may be the previous version
+        if not include_name and self._generation(*key) == generation:
+            self._cache_put(resource_type, obj, avi_tenant_uuid, fields)
+        return obj
 
-    def get_by_name(self, resource_type, obj_name, avi_tenant_uuid):
+    def get_all(self, resource_type, avi_tenant_uuid, filters=None,
+                fields=None, page_size=None):
+        """
+        Generator over all the objects of resource_type in the tenant,
+        fetched page by page.
+        :param filters: dictionary of query parameters e.g. {'name': 'x'}
+        :param fields: list of fields to return for each object
+        :param page_size: number of objects fetched per request
+        """
+        self.log.debug("In AviClient Get All: %s, %s, %s", resource_type,
+                       filters, avi_tenant_uuid)
+        return self.avi_session.get_objects_iter(
+            resource_type, tenant_uuid=avi_tenant_uuid, params=filters,
+            fields=fields, page_size=page_size)
+
+    def get_by_name(self, resource_type, obj_name, avi_tenant_uuid,
+                    fields=None, include_name=False):
+        """
+        looks the object up on the controller; the negative cache is not
+        used as callers create the object when it is not found
+        """
         self.log.debug("In AviClient Get By Name: %s, %s, %s", resource_type,
                        obj_name, avi_tenant_uuid)
+        generation = self._generation(avi_tenant_uuid, resource_type)
+        return self._coalesced(
+            ('get_by_name', avi_tenant_uuid, resource_type, obj_name,
+             generation, tuple(fields or ()), include_name),
+            self._get_by_name, resource_type, obj_name, avi_tenant_uuid,
+            generation, fields, include_name)
+
+    def _get_by_name(self, resource_type, obj_name, avi_tenant_uuid,
+                     generation, fields, include_name):
         obj = self.avi_session.get_object_by_name(
-            resource_type, obj_name, tenant_uuid=avi_tenant_uuid)
+            resource_type, obj_name, tenant_uuid=avi_tenant_uuid,
+            params=self._projection_params(fields, include_name))
         if not obj:
             raise ObjectNotFound()
+        if (not include_name and
+                self._generation(avi_tenant_uuid, resource_type) ==
+                generation):
+            self._cache_put(resource_type, obj, avi_tenant_uuid, fields)
         return obj
+
+    def get_ref_by_name(self, resource_type, obj_name, avi_tenant_uuid):
+        """
+        returns the url of the named object, cached for ref_cache_ttl secs;
+        meant for objects which almost never change like system profiles.
+        The name is resolved in the tenant, whose own object of the name
+        takes precedence over the admin tenant one.
+        """
+        ref = self.ref_cache.get(avi_tenant_uuid, resource_type, obj_name)
+        if ref is not None:
+            return ref
+        obj = self.get_by_name(resource_type, obj_name, avi_tenant_uuid,
+                               fields=['url', 'uuid'])
+        self.ref_cache.put(avi_tenant_uuid, resource_type, obj_name,
+                           obj['url'])
+        return obj['url']
+
+
+class AviBatch(object):
+    """
+    Creates and updates of a tenant gathered in dependency order and sent
+    to the controller on commit, e.g.:
+        batch = client.batch(avi_tenant_uuid)
+        vsvip_ref = batch.create('vsvip', vsvip)
+        vs['vsvip_ref'] = vsvip_ref
+        vs_ref = batch.create('virtualservice', vs)
+        batch.commit()
+        vs = batch.result(vs_ref)
+
+    Objects refer to the objects created before them in the batch by the
+    refs returned by create. A created object referred to by a single
+    <field> ref of a later create is sent inline as <field>_data of it, so
+    that each top level object is created with the objects it refers to in
+    one macro API request; a parent VS is not inlined under its child VS.
+    Updates, and the creates on controllers without the macro API, are made
+    one at a time in order.
+
+    If the commit fails once some objects were created, BatchError tells
+    which; otherwise the error of the failed operation is raised. Only
+    404/405/501 responses to a macro request, of controllers without the
+    macro API, fall back to creating the objects one at a time.
+    """
+    def __init__(self, client, avi_tenant_uuid):
+        self.client = client
+        self.avi_tenant_uuid = avi_tenant_uuid
+        self._ops = []
+        self._results = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.commit()
+
+    def create(self, resource_type, resource_def):
+        """queues a create; returns the ref of the object"""
+        resource_def = copy.deepcopy(resource_def)
+        ref = (obj_ref(resource_type, resource_def['uuid'])
+               if resource_def.get('uuid') else None)
+        self._ops.append(('create', resource_type, None, resource_def, ref))
+        return ref
+
+    def update(self, resource_type, obj_uuid, resource_def):
+        """queues an update; returns the ref of the object"""
+        ref = obj_ref(resource_type, obj_uuid)
+        self._ops.append(('update', resource_type, obj_uuid,
+                          copy.deepcopy(resource_def), ref))
+        return ref
+
+    def result(self, ref):
+        """returns the committed object of ref"""
+        return self._results.get(ref)
+
+    def commit(self):
+        """sends the queued operations; returns their results in order"""
+        ops, self._ops = self._ops, []
+        results = [None] * len(ops)
+        try:
+            self._commit(ops, results)
+        except Exception as e:
+            created = [op[4] or res.get('url')
+                       for op, res in zip(ops, results)
+                       if op[0] == 'create' and isinstance(res, dict)]
+            if not created:
+                raise
+            raise BatchError('batch of tenant %s failed after creating %s: '
+                             '%s' % (self.avi_tenant_uuid, created, e),
+                             getattr(e, 'rsp', None), created=created,
+                             error=e)
+        finally:
+            for op, res in zip(ops, results):
+                if op[4] and res is not None:
+                    self._results[op[4]] = res
+        return results
+
+    def _commit(self, ops, results):
+        creates = []
+        for i, op in enumerate(ops):
+            if op[0] == 'create':
+                creates.append(i)
+                continue
+            self._create_all(ops, creates, results)
+            creates = []
+            results[i] = self.client.update(op[1], op[2], op[3],
+                                            self.avi_tenant_uuid)
+        self._create_all(ops, creates, results)
+
+    def _create_all(self, ops, indexes, results):
+        if not indexes:
+            return
+        # the creates referred to by a single ref of a later create
+        referrers = {}
+        refs = dict((ops[i][4], i) for i in indexes
+                    if ops[i][4] and ops[i][1] in MODEL_NAMES)
+        for i in indexes:
+            for field, value in ops[i][3].items():
+                j = (refs.get(value) if field.endswith('_ref') and
+                     field not in MACRO_PARENT_REF_FIELDS else None)
+                if j is not None and j < i:
+                    referrers.setdefault(j, []).append((i, field))
+        inline = dict((j, r[0]) for j, r in referrers.items() if len(r) == 1)
+        for i in indexes:
+            if i in inline:
+                continue
+            subtree = self._subtree(i, inline)
+            if (len(subtree) > 1 and self.client.macro_enabled and
+                    ops[i][1] in MODEL_NAMES and ops[i][4]):
+                try:
+                    self._macro_create(ops, i, inline, subtree, results)
+                    continue
+                except MacroUnavailable:
+                    pass
+                except (APIError, ObjectNotFound):
+                    # the macro request is not atomic, the objects created
+                    # before it failed are reported by the BatchError
+                    self._find_created(ops, subtree, results)
+                    raise
+            for j in sorted(subtree):
+                results[j] = self.client.create(ops[j][1], ops[j][3],
+                                                self.avi_tenant_uuid)
+
+    def _subtree(self, i, inline):
+        subtree = [i]
+        for j, (k, _) in inline.items():
+            if k == i:
+                subtree.extend(self._subtree(j, inline))
+        return subtree
+
+    def _macro_data(self, ops, i, inline):
+        data = copy.deepcopy(ops[i][3])
+        for j, (k, field) in inline.items():
+            if k == i:
+                del data[field]
+                data[field + '_data'] = self._macro_data(ops, j, inline)
+        return data
+
+    def _find_created(self, ops, indexes, results):
+        for j in indexes:
+            resource_type, resource_def = ops[j][1], ops[j][3]
+            try:
+                res = self.client.get(resource_type, resource_def['uuid'],
+                                      self.avi_tenant_uuid,
+                                      negative_cache=False)
+            except (APIError, ObjectNotFound):
+                continue
+            self.client._created(resource_type, resource_def, res,
+                                 self.avi_tenant_uuid)
+            results[j] = res
+
+    def _macro_create(self, ops, i, inline, subtree, results):
+        created = self.client.macro_create(
+            ops[i][1], self._macro_data(ops, i, inline),
+            self.avi_tenant_uuid)
+        by_uuid = dict((obj.get('uuid'), obj) for obj in created
+                       if isinstance(obj, dict))
+        for j in subtree:
+            resource_type, resource_def = ops[j][1], ops[j][3]
+            res = by_uuid.get(resource_def['uuid'])
+            self.client._created(resource_type, resource_def, res,
+                                 self.avi_tenant_uuid)
+            if res is None:
+                res = self.client.get(resource_type, resource_def['uuid'],
+                                      self.avi_tenant_uuid)
+            results[j] = res
+
+
+class AsyncAviClient(object):
+    """
+    AviClient interface returning futures. Calls are run by the bounded
+    executor of the process, shared with fan_out, so many controller calls
+    can be in flight at once; AviClient itself stays the blocking interface
+    used by the drivers.
+    e.g.:
+        fs = [client.async_client.get('pool', p, t) for p in pool_uuids]
+        pools = gather(fs)
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def _submit(self, fn, *args, **kwargs):
+        return self.client.executor.submit(fn, *args, **kwargs)
+
+    def create(self, resource_type, resource_def, avi_tenant_uuid):
+        return self._submit(self.client.create, resource_type, resource_def,
+                            avi_tenant_uuid)
+
+    def update(self, resource_type, obj_uuid, resource_def, avi_tenant_uuid):
+        return self._submit(self.client.update, resource_type, obj_uuid,
+                            resource_def, avi_tenant_uuid)
+
+    def patch(self, resource_type, obj_uuid, data, avi_tenant_uuid,
+              **kwargs):
+        return self._submit(self.client.patch, resource_type, obj_uuid,
+                            data, avi_tenant_uuid, **kwargs)
+
+    def delete(self, resource_type, obj_uuid, avi_tenant_uuid, **kwargs):
+        return self._submit(self.client.delete, resource_type, obj_uuid,
+                            avi_tenant_uuid, **kwargs)
+
+    def get(self, resource_type, obj_uuid, avi_tenant_uuid, **kwargs):
+        return self._submit(self.client.get, resource_type, obj_uuid,
+                            avi_tenant_uuid, **kwargs)
+
+    def get_by_name(self, resource_type, obj_name, avi_tenant_uuid,
+                    **kwargs):
+        return self._submit(self.client.get_by_name, resource_type,
+                            obj_name, avi_tenant_uuid, **kwargs)
@@ -1,6 +1,12 @@
+import copy
 import netaddr
+import threading
 import uuid
-from avi_lbaasv2.avi_api.avi_api import ObjectNotFound
+from avi_lbaasv2.avi_api.avi_api import (APIError, ObjectNotFound,
+                                         ControllerUnavailable)
+from avi_lbaasv2.avi_api.avi_async import get_executor
+from avi_lbaasv2.avi_api.avi_trace import traced
+from avi_lbaasv2.common.avi_client import conf_get
 
 AVI_DELIM = '-'
 
@@ -27,6 +33,67 @@ def os2avi_uuid(obj_type, eid):
     return obj_type + AVI_DELIM + uid
 
 
+class FanOutError(APIError):
+    """
+    Failures of several of the calls run by fan_out; errors holds the
+    exceptions in the order of the calls, rsp is the response of the first
+    one, so that the callers handle it as any failed Avi call.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(FanOutError, self).__init__(
+            '%d calls failed: %s' % (len(errors), '; '.join(
+                '%s: %s' % (type(e).__name__, e) for e in errors)),
+            getattr(errors[0], 'rsp', None))
+
+
+_fan_out_local = threading.local()
+
+
+def _run_fanned_out(fn, args):
+    _fan_out_local.active = True
+    try:
+        return fn(*args)
+    finally:
+        _fan_out_local.active = False
+
+
+def fan_out(driver, fn, calls):
+    """
+    runs fn(*args) for each args of calls concurrently on the API executor
+    of the process, at most api_max_workers calls at a time across all the
+    driver operations, and returns the results in order; once all the calls
+    are done, raises the error of the only failed call, of
+    ControllerUnavailable or a FanOutError of all of them
+    """
+    calls = [tuple(args) for args in calls]
+    executor = get_executor(conf_get(getattr(driver, 'conf', None),
+                                     'api_max_workers', None, int))
+    # calls made by a fan out call run inline not to wait for workers of the
+    # pool they hold
+    if (executor.max_workers <= 1 or len(calls) <= 1 or
+            getattr(_fan_out_local, 'active', False)):
+        waits = [(lambda args=args: fn(*args)) for args in calls]
+    else:
+        waits = [executor.submit(_run_fanned_out, fn, args).result
+                 for args in calls]
+    results, errors = [], []
+    for wait in waits:
+        try:
+            results.append(wait())
+        except Exception as e:
+            results.append(None)
+            errors.append(e)
+    unavailable = [e for e in errors if isinstance(e, ControllerUnavailable)]
+    if len(errors) == 1 or unavailable:
+        # the other calls failed the same way if the controller is down
+        raise (unavailable or errors)[0]
+    if errors:
+        raise FanOutError(errors)
+    return results
+
+
+@traced()
 def update_loadbalancer_obj(driver, context, old_lb, lb):
     failed = False
     try:
@@ -48,6 +115,11 @@ def update_loadbalancer_obj(driver, context, old_lb, lb):
     for listener in listeners:
         try:
             listener_update_avi_vs(driver, context, listener, 'update')
+        except ControllerUnavailable as e:
+            # the rest of the listeners would fail the same way
+            driver.log.error('ocavi: Could not update listener: %s, %s',
+                             listener, e)
+            return True
         except Exception as e:
             driver.log.exception('ocavi: Could not update listener: %s, %s',
                                  listener, e)
@@ -56,6 +128,7 @@ def update_loadbalancer_obj(driver, context, old_lb, lb):
     return failed
 
 
+@traced()
 def loadbalancer_update_avi_vsvip(driver, old_lb, lb):
     if (lb.name == old_lb.name and
             lb.admin_state_up == old_lb.admin_state_up):
@@ -77,16 +150,21 @@ def loadbalancer_update_avi_vsvip(driver, old_lb, lb):
                          res)
 
 
-def listener_update_avi_vs(driver, context, listener, op):
+@traced()
+def listener_update_avi_vs(driver, context, listener, op, refs=None):
     '''
     :param listener:
     :param context:
     :type op: should be 'create' or 'update'
+    :param refs: refs by (type, uuid) of the vsvip and pools already
+        written, e.g. by an AviPlan
     '''
     client = driver.client
-    avi_vs = driver.avi_helper.transform_os_listener_to_avi_vs(
-        context, listener, driver)
     avi_tenant_uuid = os2avi_uuid('tenant', listener.tenant_id)
+    # a new VS is created along with its new vsvip and child VSes
+    batch = client.batch(avi_tenant_uuid) if op == 'create' else None
+    avi_vs = driver.avi_helper.transform_os_listener_to_avi_vs(
+        context, listener, driver, batch=batch, refs=refs)
     avi_vs_id = os2avi_uuid('virtualservice', listener.id)
     child_vses = avi_vs.pop('child_vses', [])
     if child_vses:
@@ -95,7 +173,7 @@ def listener_update_avi_vs(driver, context, listener, op):
         avi_vs['type'] = 'VS_TYPE_NORMAL'
     # create/update parent VS
     if op == 'create':
-        pvs = client.create('virtualservice', avi_vs, avi_tenant_uuid)
+        pvs = {'url': batch.create('virtualservice', avi_vs)}
     else:  # if op == 'update':
         avi_vs.pop('vrf_context_ref', None)  # Don't update VRF Context
         client.update('virtualservice', avi_vs_id, avi_vs, avi_tenant_uuid)
@@ -109,7 +187,7 @@ def listener_update_avi_vs(driver, context, listener, op):
             _delete_avi_vs_pool(driver, existing_child, avi_tenant_uuid)
 
     if not child_vses:
-        return pvs
+        return _commit_vs_batch(batch, pvs)
 
     # remove inapplicable fields
     for f in ['ip_address', 'address', 'port_uuid',
@@ -130,11 +208,22 @@ def listener_update_avi_vs(driver, context, listener, op):
         if avi_vs['uuid'] in pvs.get('vh_child_vs_uuid', []):
             client.update('virtualservice', avi_vs['uuid'], avi_vs,
                           avi_tenant_uuid)
+        elif batch is not None:
+            batch.create('virtualservice', avi_vs)
         else:
             client.create('virtualservice', avi_vs, avi_tenant_uuid)
-    return pvs
+    return _commit_vs_batch(batch, pvs)
+
+
+def _commit_vs_batch(batch, pvs):
+    '''commits the batch of a VS create; returns the created parent VS'''
+    if batch is None:
+        return pvs
+    batch.commit()
+    return batch.result(pvs['url'])
 
 
+@traced()
 def _delete_avi_vs_pool(driver, vs_id, avi_tenant_uuid):
     client = driver.client
     try:
@@ -148,6 +237,7 @@ def _delete_avi_vs_pool(driver, vs_id, avi_tenant_uuid):
     return
 
 
+@traced()
 def listener_delete_avi_vs(driver, context, listener):
     # try deleting it from Avi
     avi_vs_id = os2avi_uuid('virtualservice', listener.id)
@@ -155,24 +245,26 @@ def listener_delete_avi_vs(driver, context, listener):
 
     # delete child VSes if any
     if listener.sni_containers:
-        for sc in listener.sni_containers:
-            avi_cvs_id = driver.avi_helper.get_avi_sni_vs_uuid(
-                sc.tls_container_id, listener.id)
-            _delete_avi_vs_pool(driver, avi_cvs_id, avi_tenant_uuid)
+        fan_out(driver, _delete_avi_vs_pool, [
+            (driver, driver.avi_helper.get_avi_sni_vs_uuid(
+                sc.tls_container_id, listener.id), avi_tenant_uuid)
+            for sc in listener.sni_containers])
 
     # delete parent VS and pool (if it exists)
     _delete_avi_vs_pool(driver, avi_vs_id, avi_tenant_uuid)
     return
 
 
+@traced()
 def hm_update_avi_hm(driver, context, health_monitor):
     client = driver.client
     avi_tenant_uuid = os2avi_uuid('tenant', health_monitor.tenant_id)
     avi_hm_def = driver.avi_helper.transform_os_hm_to_avi_hm(health_monitor)
-    client.update('healthmonitor', avi_hm_def['uuid'],
-                  avi_hm_def, avi_tenant_uuid)
+    return client.update('healthmonitor', avi_hm_def['uuid'],
+                         avi_hm_def, avi_tenant_uuid)
 
 
+@traced()
 def hm_delete_avi_hm(driver, context, health_monitor):
     client = driver.client
     avi_hm_uuid = os2avi_uuid('healthmonitor', health_monitor.id)
@@ -180,37 +272,57 @@ def hm_delete_avi_hm(driver, context, health_monitor):
     client.delete('healthmonitor', avi_hm_uuid, avi_tenant_uuid)
 
 
+@traced()
 def pool_update_avi_vs_pool(driver, context, pool, update_ls=False):
     client = driver.client
     avi_helper = driver.avi_helper
-    avi_tenant_uuid = os2avi_uuid('tenant', pool.tenant_id)
     avi_pool = driver.avi_helper.transform_os_pool_to_avi_pool(pool, client,
                                                                context, driver)
+    if not update_ls:
+        # While updating pool don't update vrf_context_ref
+        avi_pool.pop('vrf_ref', None)
     listeners = driver.objfns.listeners_get(context, pool.root_loadbalancer,
                                             pool=pool)
+    owner_ids = []
     for listener in listeners:
-        if listener.default_pool_id != pool.id:
-            continue
-        avi_helper.fill_avi_pool_uuid_name(avi_pool, pool, listener.id)
-        if not update_ls:
-            # While updating pool don't update vrf_context_ref
-            avi_pool.pop('vrf_ref', None)
-
-        client.update('pool', avi_pool['uuid'], avi_pool, avi_tenant_uuid)
-        if update_ls:
-            update_avi_vs_pool(driver, avi_tenant_uuid, listener.id,
-                               avi_pool["uuid"], action="add")
-        for snic in listener.sni_containers:
-            owner_id = avi_helper.get_avi_sni_vs_uuid(
-                snic.tls_container_id, listener.id)[15:]
-            avi_helper.fill_avi_pool_uuid_name(avi_pool, pool, owner_id)
-            client.update('pool', avi_pool['uuid'], avi_pool, avi_tenant_uuid)
-            if update_ls:
-                update_avi_vs_pool(driver, avi_tenant_uuid, owner_id,
-                                   avi_pool["uuid"], action="add")
+        if listener.default_pool_id == pool.id:
+            owner_ids.extend(pool_owner_ids(avi_helper, listener))
+    fan_out(driver, update_avi_owner_pool,
+            [(driver, pool, avi_pool, owner_id, update_ls)
+             for owner_id in owner_ids])
+
+
+def pool_owner_ids(avi_helper, listener):
+    '''
+    returns the ids of the owners of the Avi pools of the default pool of
+    listener: the listener and each of its SNI child VSes
+    '''
+    owner_ids = [listener.id]
+    for snic in listener.sni_containers:
+        owner_ids.append(avi_helper.get_avi_sni_vs_uuid(
+            snic.tls_container_id, listener.id)[15:])
+    return owner_ids
+
+
+@traced()
+def update_avi_owner_pool(driver, pool, avi_pool, owner_id, update_ls=False):
+    '''
+    updates the Avi pool of owner_id out of avi_pool, the transformed pool;
+    returns the updated Avi pool
+    '''
+    avi_tenant_uuid = os2avi_uuid('tenant', pool.tenant_id)
+    owner_pool = copy.deepcopy(avi_pool)
+    driver.avi_helper.fill_avi_pool_uuid_name(owner_pool, pool, owner_id)
+    res = driver.client.update('pool', owner_pool['uuid'], owner_pool,
+                               avi_tenant_uuid)
+    if update_ls:
+        update_avi_vs_pool(driver, avi_tenant_uuid, owner_id,
+                           owner_pool["uuid"], action="add")
+    return res
 
 
 # action: one of {add, delete}
+@traced()
 def update_avi_vs_pool(driver, avi_tenant_uuid, os_owner_id,
                        avi_pool_uuid, action="add"):
     client = driver.client
@@ -226,6 +338,7 @@ def update_avi_vs_pool(driver, avi_tenant_uuid, os_owner_id,
     return
 
 
+@traced()
 def pool_delete_avi_vs_pool(driver, context, pool):
     client = driver.client
     avi_helper = driver.avi_helper
@@ -252,6 +365,7 @@ def pool_delete_avi_vs_pool(driver, context, pool):
     client.delete("applicationpersistenceprofile", perst_uuid, avi_tenant_uuid)
 
 
+@traced()
 def _get_avi_pool_uuids(driver, context, pool):
     avi_pool_uuids = []
     avi_helper = driver.avi_helper
@@ -268,6 +382,7 @@ def _get_avi_pool_uuids(driver, context, pool):
     return avi_pool_uuids
 
 
+@traced()
 def member_op_avi_pool(driver, context, member, action="add"):
     client = driver.client
     avi_tenant_uuid = os2avi_uuid("tenant", member.tenant_id)
@@ -276,13 +391,16 @@ def member_op_avi_pool(driver, context, member, action="add"):
                                                        context=context,
                                                        driver=driver)
     data = {action: {'servers': [avi_member]}}
-    for avi_pool_id in avi_pool_uuids:
+
+    def patch_pool(avi_pool_id):
         client.patch('pool', avi_pool_id, data, avi_tenant_uuid,
                      ignore_non_existent_object=(action == "delete"),
                      ignore_non_existent_tenant=(action == "delete"),
                      ignore_existing_object=(action == "add"))
+    fan_out(driver, patch_pool, [(p,) for p in avi_pool_uuids])
 
 
+@traced()
 def hm_op_avi_pool(driver, context, hm, pool, action="add"):
     client = driver.client
     avi_tenant_uuid = os2avi_uuid("tenant", hm.tenant_id)
@@ -290,10 +408,12 @@ def hm_op_avi_pool(driver, context, hm, pool, action="add"):
     avi_hm_uuid = os2avi_uuid("healthmonitor", hm.id)
     avi_hm_ref = "/api/healthmonitor/" + avi_hm_uuid
     data = {action: {'health_monitor_refs': [avi_hm_ref]}}
-    for avi_pool_id in avi_pool_uuids:
+
+    def patch_pool(avi_pool_id):
         client.patch('pool', avi_pool_id, data, avi_tenant_uuid,
                      ignore_non_existent_object=(action == "delete"),
                      ignore_non_existent_tenant=(action == "delete"))
+    fan_out(driver, patch_pool, [(p,) for p in avi_pool_uuids])
 
 
 def form_vsvip_uuid(lb_id):
@@ -338,8 +458,13 @@ def form_avi_vrf_context_obj(subnet_uuid, cloud):
     return vrf_context
 
 
+@traced()
 def update_vsvip(os_lb, avi_client, avi_tenant_uuid, cloud, vsvip=None,
-                 vrf_context_ref=None):
+                 vrf_context_ref=None, batch=None):
+    '''
+    :param batch: AviBatch the vsvip is created or updated in; the ref of
+        the vsvip is returned then
+    '''
     create = False
     if not vsvip:
         vsvip = form_avi_vsvip_obj(os_lb, cloud,
@@ -350,7 +475,11 @@ def update_vsvip(os_lb, avi_client, avi_tenant_uuid, cloud, vsvip=None,
     vsvip_name = "vsvip-" + lb_name
     vsvip['name'] = vsvip_name
     vsvip['vip'][0]['enabled'] = os_lb.admin_state_up
-    if create:
+    if batch is not None and create:
+        res = batch.create("vsvip", vsvip)
+    elif batch is not None:
+        res = batch.update("vsvip", vsvip['uuid'], vsvip)
+    elif create:
         res = avi_client.create("vsvip", vsvip, avi_tenant_uuid)
     else:
         res = avi_client.update("vsvip", vsvip['uuid'], vsvip, avi_tenant_uuid)
@@ -358,6 +487,7 @@ def update_vsvip(os_lb, avi_client, avi_tenant_uuid, cloud, vsvip=None,
     return res
 
 
+@traced()
 def delete_vsvip(os_lb, avi_client, contrail_lb=None):
     vsvip_uuid = None
     avi_tenant_uuid = None
@@ -375,12 +505,14 @@ def delete_vsvip(os_lb, avi_client, contrail_lb=None):
         avi_client.delete("vsvip", vsvip_uuid, avi_tenant_uuid)
 
 
+@traced()
 def get_vrf_context(subnet_uuid, cloud, avi_tenant_uuid, avi_client,
                     create=False):
     uuid = form_vrf_context_uuid(subnet_uuid)
     vrf_context = {}
     try:
-        vrf_context = avi_client.get('vrfcontext', uuid, avi_tenant_uuid)
+        vrf_context = avi_client.get('vrfcontext', uuid, avi_tenant_uuid,
+                                     negative_cache=not create)
     except ObjectNotFound:
         pass
 
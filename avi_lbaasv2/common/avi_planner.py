@@ -0,0 +1,276 @@
+"""
+Plans the writes of the Avi objects of a driver operation as a DAG and runs
+them in waves: once the steps a step depends on are done it runs
+concurrently with the other steps of its dependency level, so the serial
+round trips of an operation are bounded by the depth of the loadbalancer
+tree instead of its number of objects.
+
+The steps only make Avi API calls concurrently: the reads of the neutron
+DB they need are made one after the other while the plan is built, as the
+DB session of the neutron context can't be shared by concurrent steps.
+"""
+import threading
+from collections import OrderedDict
+
+from avi_lbaasv2.avi_api.avi_api import ObjectNotFound
+from avi_lbaasv2.avi_api.avi_trace import traced
+from avi_lbaasv2.common.avi_generic import (
+    FanOutError, fan_out, form_vsvip_uuid, hm_update_avi_hm,
+    listener_update_avi_vs, os2avi_uuid, pool_owner_ids,
+    update_avi_owner_pool, update_vsvip)
+
+# DriverObjFunctions reads made through the DB session of the context
+DB_READS = ('get_metainfo_from_flavor', 'get_vip_subnet_from_listener',
+            'listener_get', 'listeners_get', 'loadbalancer_get', 'pool_get',
+            'subnet_get')
+
+
+class AviPlan(object):
+    """
+    DAG of the steps of a driver operation, keyed by the (type, uuid) of
+    the Avi object they write. The ref of the object returned by a step is
+    recorded in refs, so that the steps depending on it reference the
+    object without fetching it.
+    e.g.:
+        plan = AviPlan()
+        hm_key = plan.add(('healthmonitor', hm_uuid), hm_update_avi_hm,
+                          driver, context, hm)
+        plan.add(('pool', pool_uuid), update_pool, pool, plan.refs,
+                 deps=[hm_key])
+        plan.execute(driver)
+    """
+    def __init__(self):
+        self._steps = OrderedDict()
+        self._lock = threading.Lock()
+        self.results = {}
+        self.refs = {}
+        self.errors = OrderedDict()
+        self.skipped = set()
+
+    def __contains__(self, key):
+        return key in self._steps
+
+    def add(self, key, fn, *args, **kwargs):
+        """
+        plans the step key running fn(*args); returns key
+        :param deps: keys of the steps to run before this one
+        """
+        deps = tuple(kwargs.pop('deps', ()))
+        if kwargs:
+            raise TypeError('unexpected arguments %s' % list(kwargs))
+        if key in self._steps:
+            raise ValueError('step %s planned twice' % (key,))
+        self._steps[key] = (fn, args, deps)
+        return key
+
+    def waves(self):
+        """
+        returns the lists of the step keys of each dependency level in
+        order; raises ValueError on an unplanned dependency or a cycle
+        """
+        for key, (_, _, deps) in self._steps.items():
+            for dep in deps:
+                if dep not in self._steps:
+                    raise ValueError('step %s depends on unplanned step %s' %
+                                     (key, dep))
+        remaining = OrderedDict(self._steps)
+        done = set()
+        waves = []
+        while remaining:
+            wave = [key for key, (_, _, deps) in remaining.items()
+                    if done.issuperset(deps)]
+            if not wave:
+                raise ValueError('dependency cycle between steps %s' %
+                                 list(remaining))
+            for key in wave:
+                del remaining[key]
+            done.update(wave)
+            waves.append(wave)
+        return waves
+
+    def _run(self, key):
+        fn, args, deps = self._steps[key]
+        with self._lock:
+            if any(dep in self.errors or dep in self.skipped
+                   for dep in deps):
+                self.skipped.add(key)
+                return
+        try:
+            res = fn(*args)
+        except Exception as e:
+            with self._lock:
+                self.errors[key] = e
+            return
+        with self._lock:
+            self.results[key] = res
+            if isinstance(res, dict) and res.get('url'):
+                self.refs[key] = res['url']
+
+    def execute(self, driver, raise_errors=True):
+        """
+        runs the steps wave after wave, the steps of a wave concurrently
+        through fan_out; the steps depending on a failed step are skipped.
+        Returns the results by step key; see raise_errors.
+        """
+        for wave in self.waves():
+            fan_out(driver, self._run, [(key,) for key in wave])
+        if raise_errors:
+            self.raise_errors()
+        return self.results
+
+    def succeeded(self, key):
+        return key in self.results
+
+    def raise_errors(self):
+        """raises the error of the only failed step or a FanOutError"""
+        errors = list(self.errors.values())
+        if len(errors) == 1:
+            raise errors[0]
+        if errors:
+            raise FanOutError(errors)
+
+
+class PrefetchedObjFunctions(object):
+    """
+    DriverObjFunctions of the steps of a plan. The DB reads are made while
+    the plan is built and their results are served to the steps; a DB read
+    not made while building the plan fails once the plan is frozen.
+    """
+    def __init__(self, objfns):
+        self._objfns = objfns
+        self._reads = {}
+        self.frozen = False
+
+    def __getattr__(self, name):
+        fn = getattr(self._objfns, name)
+        if name not in DB_READS:
+            return fn
+
+        def read(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            if key not in self._reads:
+                if self.frozen:
+                    raise RuntimeError('DB read %s%r not made while '
+                                       'planning' % (name, args[1:]))
+                self._reads[key] = fn(*args, **kwargs)
+            return self._reads[key]
+        return read
+
+
+class _StepDriver(object):
+    """driver of the plan steps, serving them the prefetched DB reads"""
+    def __init__(self, driver, objfns):
+        self._driver = driver
+        self.objfns = objfns
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+def plan_loadbalancer(driver, context, lb, listeners):
+    """
+    plans the update of the Avi objects of lb and its listeners, by levels:
+    the vsvip and the health monitors; the transform of each pool; the Avi
+    pool, with its members, of each listener and SNI child VS; each VS
+    along with its SNI child VSes
+    """
+    plan = AviPlan()
+    objfns = PrefetchedObjFunctions(driver.objfns)
+    driver = _StepDriver(driver, objfns)
+    avi_helper = driver.avi_helper
+    vsvip_key = plan.add(('vsvip', form_vsvip_uuid(lb.id)),
+                         _update_avi_vsvip, driver, lb)
+    for listener in listeners:
+        vs_deps = [vsvip_key]
+        os_pool = listener.default_pool
+        if os_pool and os_pool.provisioning_status != "PENDING_DELETE":
+            pool_key = ('pooldef', os_pool.id)
+            if pool_key not in plan:
+                _read_pool(driver, context, os_pool.id)
+                plan.add(pool_key, _transform_avi_pool, driver, context,
+                         os_pool.id, plan.refs,
+                         deps=_plan_avi_hm(plan, driver, context, os_pool))
+            for owner_id in pool_owner_ids(avi_helper, listener):
+                vs_deps.append(plan.add(
+                    ('pool', avi_helper.get_avi_pool_uuid(os_pool.id,
+                                                          owner_id)),
+                    _update_avi_pool, driver, plan.results, pool_key,
+                    owner_id, deps=[pool_key]))
+        _read_listener(driver, context, listener)
+        plan.add(('virtualservice', os2avi_uuid('virtualservice',
+                                                listener.id)),
+                 listener_update_avi_vs, driver, context, listener, 'update',
+                 plan.refs, deps=vs_deps)
+    objfns.frozen = True
+    return plan
+
+
+def _read_pool(driver, context, pool_id):
+    """makes the DB reads of transform_os_pool_to_avi_pool of the pool"""
+    objfns = driver.objfns
+    pool = objfns.pool_get(context, pool_id)
+    if getattr(pool, 'loadbalancer_id', None):
+        lb = objfns.loadbalancer_get(context, pool.loadbalancer_id)
+    else:
+        ll = objfns.listener_get(context, pool.listener.id)
+        lb = objfns.loadbalancer_get(context, ll.loadbalancer_id)
+    if lb and getattr(lb, 'flavor_id', None):
+        objfns.get_metainfo_from_flavor(context, lb.flavor_id)
+    if not lb:
+        objfns.get_vip_subnet_from_listener(context, pool.listener.id)
+    if getattr(driver.avi_helper.avicfg, 'use_placement_network_for_pool',
+               False):
+        for member in pool.members or []:
+            if getattr(member, 'subnet_id', None):
+                objfns.subnet_get(context, member.subnet_id)
+
+
+def _read_listener(driver, context, listener):
+    """makes the DB reads of transform_os_listener_to_avi_vs"""
+    objfns = driver.objfns
+    lb = listener.loadbalancer
+    if getattr(lb, 'flavor_id', None):
+        objfns.get_metainfo_from_flavor(context, lb.flavor_id)
+    objfns.loadbalancer_get(context, lb.id)
+
+
+def _plan_avi_hm(plan, driver, context, os_pool):
+    """plans the update of the health monitor of os_pool; returns deps"""
+    os_hm = os_pool.healthmonitor
+    # pools only reference the active health monitors
+    if not (os_hm and os_hm.admin_state_up and
+            os_hm.provisioning_status == "ACTIVE"):
+        return []
+    hm_key = ('healthmonitor', os2avi_uuid('healthmonitor', os_hm.id))
+    if hm_key not in plan:
+        plan.add(hm_key, hm_update_avi_hm, driver, context, os_hm)
+    return [hm_key]
+
+
+@traced()
+def _update_avi_vsvip(driver, lb):
+    client = driver.client
+    avi_tenant_uuid = os2avi_uuid('tenant', lb.tenant_id)
+    try:
+        vsvip = client.get('vsvip', form_vsvip_uuid(lb.id), avi_tenant_uuid)
+    except ObjectNotFound:
+        # created along with the VSes
+        return None
+    return update_vsvip(lb, client, avi_tenant_uuid, driver.conf.cloud,
+                        vsvip=vsvip)
+
+
+@traced()
+def _transform_avi_pool(driver, context, pool_id, refs):
+    """returns the pool and its Avi pool, common to all its owners"""
+    pool = driver.objfns.pool_get(context, pool_id)
+    avi_pool = driver.avi_helper.transform_os_pool_to_avi_pool(
+        pool, driver.client, context, driver, refs=refs)
+    # While updating pool don't update vrf_context_ref
+    avi_pool.pop('vrf_ref', None)
+    return pool, avi_pool
+
+
+def _update_avi_pool(driver, results, pool_key, owner_id):
+    pool, avi_pool = results[pool_key]
+    return update_avi_owner_pool(driver, pool, avi_pool, owner_id)
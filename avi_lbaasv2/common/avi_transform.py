@@ -3,6 +3,7 @@ import netaddr
 import uuid
 import copy
 from avi_lbaasv2.avi_api.avi_api import ObjectNotFound
+from avi_lbaasv2.avi_api.avi_trace import traced
 from avi_lbaasv2.common.avi_generic import AVI_DELIM
 from avi_lbaasv2.common.avi_generic import (
     os2avi_uuid, pool_update_avi_vs_pool, get_vrf_context,
@@ -10,6 +11,12 @@ from avi_lbaasv2.common.avi_generic import (
 
 LOG = logging.getLogger(__name__)
 
+# Fields fetched when only the reference of an Avi object is needed
+REF_FIELDS = ['url', 'uuid']
+
+# SSL profile of the pools of HTTPS members
+POOL_SSL_PROFILE = 'System-Standard'
+
 
 class AviHelper(object):
 
@@ -49,33 +56,31 @@ class AviHelper(object):
         'TERMINATED_HTTPS': 'System-Secure-HTTP',
     }
 
+    @traced('AviHelper.get_app_profile_ref')
     def get_app_profile_ref(self, protocol, avi_client, avi_tenant_uuid):
         avi_type = self.dict_app_profile_name[protocol]
         try:
-            avi_app_prof = avi_client.get_by_name("applicationprofile",
-                                                  avi_type,
-                                                  avi_tenant_uuid)
+            return avi_client.get_ref_by_name("applicationprofile", avi_type,
+                                              avi_tenant_uuid)
         except ObjectNotFound:
             self.log.exception("ocavi: App profile %s not found", avi_type)
             raise
-        return avi_app_prof["url"]
 
     def get_appcookie_profile_name(self, name, pool_id):
         AVI_APP_COOKIE_FORMAT = 'appcookie:%s:%s'
         pname = AVI_APP_COOKIE_FORMAT % (name[:10], pool_id)
         return pname
 
+    @traced('AviHelper.get_avi_ssl_profile_ref')
     def get_avi_ssl_profile_ref(self, profile_name, avi_client,
                                 avi_tenant_uuid):
         try:
-            ssl_profile = avi_client.get_by_name("sslprofile",
-                                                 profile_name,
-                                                 avi_tenant_uuid)
+            return avi_client.get_ref_by_name("sslprofile", profile_name,
+                                              avi_tenant_uuid)
         except ObjectNotFound:
             self.log.exception("ocavi: SSL profile not found: %s",
                                profile_name)
             raise
-        return ssl_profile["url"]
 
     def get_avi_pool_name(self, os_pool, owner_id):
         pname = "pool"
@@ -88,9 +93,14 @@ class AviHelper(object):
         avi_pool["name"] = self.get_avi_pool_name(os_pool, owner_id)
         return
 
+    @traced('AviHelper.transform_os_pool_to_avi_pool')
     def transform_os_pool_to_avi_pool(self, os_pool, avi_client, context,
-                                      driver):
-        """transform the OS pool into AVI pool"""
+                                      driver, refs=None):
+        """
+        transform the OS pool into AVI pool
+        :param refs: refs by (type, uuid) of Avi objects already written,
+            e.g. by an AviPlan, used instead of fetching the objects
+        """
         avi_pool = dict()
 
         avi_pool['cloud_ref'] = ("/api/cloud?name=%s" % self.avicfg.cloud)
@@ -107,7 +117,7 @@ class AviHelper(object):
         avi_pool["ssl_profile_ref"] = None
         if os_pool.protocol == "HTTPS":
             avi_pool["ssl_profile_ref"] = self.get_avi_ssl_profile_ref(
-                "System-Standard", avi_client, avi_tenant_uuid)
+                POOL_SSL_PROFILE, avi_client, avi_tenant_uuid)
 
         # add members
         avi_pool['servers'] = []
@@ -181,13 +191,17 @@ class AviHelper(object):
                 os_hm.provisioning_status == "ACTIVE"):
             hm_uuid = os2avi_uuid("healthmonitor", os_hm.id)
             hm_tenant_uuid = os2avi_uuid("tenant", os_hm.tenant_id)
-            try:
-                hm = avi_client.get("healthmonitor", hm_uuid, hm_tenant_uuid)
-            except ObjectNotFound:
-                self.log.warn("Healthmonitor %s not found; creating", hm_uuid)
-                hm_def = self.transform_os_hm_to_avi_hm(os_hm)
-                hm = avi_client.create("healthmonitor", hm_def,
-                                       hm_tenant_uuid)
+            hm = {'url': (refs or {}).get(("healthmonitor", hm_uuid))}
+            if not hm['url']:
+                try:
+                    hm = avi_client.get("healthmonitor", hm_uuid,
+                                        hm_tenant_uuid)
+                except ObjectNotFound:
+                    self.log.warn("Healthmonitor %s not found; creating",
+                                  hm_uuid)
+                    hm_def = self.transform_os_hm_to_avi_hm(os_hm)
+                    hm = avi_client.create("healthmonitor", hm_def,
+                                           hm_tenant_uuid)
             avi_pool["health_monitor_refs"] = [hm["url"]]
 
         # session persistence
@@ -335,18 +349,24 @@ class AviHelper(object):
             "virtualservice",
             os_sni_ref.split("/")[-1], os_listener_id)
 
+    @traced('AviHelper.get_avi_pool')
     def get_avi_pool(self, os_pool_id, os_owner_id, avi_client,
-                     avi_tenant_uuid, driver, context):
+                     avi_tenant_uuid, driver, context, refs=None):
         pool_uuid = self.get_avi_pool_uuid(os_pool_id, os_owner_id)
+        if refs and ("pool", pool_uuid) in refs:
+            return {'uuid': pool_uuid, 'url': refs[("pool", pool_uuid)]}
         try:
-            avi_pool = avi_client.get("pool", pool_uuid, avi_tenant_uuid)
+            avi_pool = avi_client.get("pool", pool_uuid, avi_tenant_uuid,
+                                      fields=REF_FIELDS)
         except ObjectNotFound:
             self.log.warn("Pool %s not found; creating", pool_uuid)
             db_pool = driver.objfns.pool_get(context, os_pool_id)
             pool_update_avi_vs_pool(driver, context, db_pool)
-            avi_pool = avi_client.get("pool", pool_uuid, avi_tenant_uuid)
+            avi_pool = avi_client.get("pool", pool_uuid, avi_tenant_uuid,
+                                      fields=REF_FIELDS)
         return avi_pool
 
+    @traced('AviHelper.get_or_create_avi_ssl_cert')
     def get_or_create_avi_ssl_cert(self, driver,
                                    tls_container_id, os_tenant_id,
                                    avi_client, avi_tenant_uuid):
@@ -375,12 +395,17 @@ class AviHelper(object):
                 avi_tenant_uuid)
         return cert
 
-    def transform_os_listener_to_avi_vs(self, context, os_listener, driver):
+    @traced('AviHelper.transform_os_listener_to_avi_vs')
+    def transform_os_listener_to_avi_vs(self, context, os_listener, driver,
+                                        batch=None, refs=None):
         """
         One Avi VS per LBaaSv2 listener
         :param avi_client:
         :param os_listener:
         :param avi_vs:
+        :param batch: AviBatch a missing vsvip is created in with the VS
+        :param refs: refs by (type, uuid) of the vsvip and pools already
+            written, e.g. by an AviPlan, used instead of fetching them
         :return:
         """
         avi_client = driver.client
@@ -433,7 +458,8 @@ class AviHelper(object):
         avi_vs['enabled'] = os_listener.admin_state_up
         vsvip = self.get_avi_vsvip(os_loadbalancer, avi_client,
                                    avi_tenant_uuid,
-                                   vrf_context_ref=vrf_context_ref)
+                                   vrf_context_ref=vrf_context_ref,
+                                   batch=batch, refs=refs)
         avi_vs["vsvip_ref"] = vsvip["url"]
 
         # add service
@@ -454,7 +480,7 @@ class AviHelper(object):
             os_pool = os_listener.default_pool
             avi_pool = self.get_avi_pool(os_pool.id, os_listener.id,
                                          avi_client, avi_tenant_uuid, driver,
-                                         context)
+                                         context, refs=refs)
             avi_vs["pool_ref"] = avi_pool["url"]
 
         # add tls cert
@@ -482,8 +508,8 @@ class AviHelper(object):
                 if avi_vs["pool_ref"]:
                     owner_id = child_vs["uuid"][15:]
                     child_vs["pool_ref"] = self.get_avi_pool(
-                        os_pool.id, owner_id,
-                        avi_client, avi_tenant_uuid, driver, context)["url"]
+                        os_pool.id, owner_id, avi_client, avi_tenant_uuid,
+                        driver, context, refs=refs)["url"]
                 avi_vs["child_vses"].append(child_vs)
 
         # connection limit
@@ -512,12 +538,16 @@ class AviHelper(object):
         avi_persist['app_cookie_persistence_profile'] = appck_profile
         return avi_persist
 
+    @traced('AviHelper.get_avi_vsvip')
     def get_avi_vsvip(self, os_lb, avi_client, avi_tenant_uuid,
-                      vrf_context_ref=None):
+                      vrf_context_ref=None, batch=None, refs=None):
         vsvip_uuid = form_vsvip_uuid(os_lb.id)
+        if refs and ("vsvip", vsvip_uuid) in refs:
+            return {'uuid': vsvip_uuid, 'url': refs[("vsvip", vsvip_uuid)]}
         vsvip = None
         try:
-            vsvip = avi_client.get("vsvip", vsvip_uuid, avi_tenant_uuid)
+            vsvip = avi_client.get("vsvip", vsvip_uuid, avi_tenant_uuid,
+                                   fields=REF_FIELDS)
             return vsvip
         except ObjectNotFound:
             self.log.warn("VsVip %s not found", vsvip_uuid)
@@ -531,7 +561,8 @@ class AviHelper(object):
                 try:
                     vs_uuid = os2avi_uuid("virtualservice", ll_id)
                     vs = avi_client.get("virtualservice", vs_uuid,
-                                        avi_tenant_uuid)
+                                        avi_tenant_uuid,
+                                        fields=['vsvip_ref'])
                 except ObjectNotFound:
                     self.log.warn("VirtualService %s not found", vs_uuid)
                     continue
@@ -539,7 +570,8 @@ class AviHelper(object):
                 vsvip_uuid = vs['vsvip_ref'].split("/")[-1]
                 try:
                     vsvip = avi_client.get("vsvip", vsvip_uuid,
-                                           avi_tenant_uuid)
+                                           avi_tenant_uuid,
+                                           fields=REF_FIELDS)
                     self.log.info("Found vsvip %s for lb %s",
                                   vsvip['uuid'], os_lb.id)
                     return vsvip
@@ -547,8 +579,15 @@ class AviHelper(object):
                     self.log.warn("VsVip %s not found", vsvip_uuid)
 
         self.log.info("Creating vsvip for lb %s", os_lb.id)
+        if batch is not None:
+            return {'uuid': vsvip_uuid,
+                    'url': update_vsvip(os_lb, avi_client, avi_tenant_uuid,
+                                        self.avicfg.cloud,
+                                        vrf_context_ref=vrf_context_ref,
+                                        batch=batch)}
         update_vsvip(os_lb, avi_client, avi_tenant_uuid, self.avicfg.cloud,
                      vrf_context_ref=vrf_context_ref)
-        vsvip = avi_client.get("vsvip", vsvip_uuid, avi_tenant_uuid)
+        vsvip = avi_client.get("vsvip", vsvip_uuid, avi_tenant_uuid,
+                               fields=REF_FIELDS)
 
         return vsvip
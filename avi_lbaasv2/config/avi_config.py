@@ -27,4 +27,168 @@ AVI_OPTS = [
                      'for handling tenant networks with overlapping '
                      'address ranges. Use this option only if you have '
                      'subnets with same CIDR in same tenant.'),
+    cfg.IntOpt('api_pool_maxsize', default=10,
+               help='Number of HTTP connections kept open to the Avi '
+                    'Controller and reused across API calls. Default is 10.'),
+    cfg.BoolOpt('api_pool_block', default=False,
+                help='Wait for a free pooled connection when all the '
+                     'connections to the Avi Controller are in use instead '
+                     'of opening additional connections. Default is False.'),
+    cfg.IntOpt('api_keepalive_timeout', default=60,
+               help='Idle time in seconds after which pooled connections to '
+                    'the Avi Controller are dropped. Set it below the idle '
+                    'timeout of the Avi Controller. Default is 60.'),
+    cfg.IntOpt('api_max_workers', default=8,
+               help='Maximum number of Avi Controller API calls the driver '
+                    'runs concurrently across all its operations, e.g. the '
+                    'updates of the pools of the listeners of a pool; '
+                    'greenthreads under eventlet. 1 runs them one after the '
+                    'other. Default is 8.'),
+    cfg.IntOpt('api_max_retries', default=3,
+               help='Maximum number of retries of an Avi Controller API call '
+                    'failing with connection errors, session expiry, 429 or '
+                    '502/503/504. Default is 3.'),
+    cfg.FloatOpt('api_retry_backoff', default=0.5,
+                 help='Base wait in seconds before retrying a failed Avi '
+                      'Controller API call. The wait doubles on every retry '
+                      'and is randomized (jitter). Default is 0.5.'),
+    cfg.FloatOpt('api_retry_backoff_max', default=10.0,
+                 help='Maximum wait in seconds between retries of a failed '
+                      'Avi Controller API call. Default is 10.'),
+    cfg.FloatOpt('api_retry_budget_ratio', default=0.2,
+                 help='Maximum ratio of retries to Avi Controller API calls '
+                      'in a 10 second window, shared by all the calls of the '
+                      'driver. Default is 0.2.'),
+    cfg.FloatOpt('api_rate_limit', default=0,
+                 help='Maximum Avi Controller API calls per second made by '
+                      'the driver. Default is 0, i.e. no rate limit.'),
+    cfg.IntOpt('api_rate_burst', default=20,
+               help='Number of Avi Controller API calls allowed in a burst '
+                    'above api_rate_limit. Default is 20.'),
+    cfg.IntOpt('api_max_concurrency', default=10,
+               help='Maximum Avi Controller API calls in flight. The limit '
+                    'is lowered automatically while the controller is slow '
+                    'or returns 429/5xx errors and raised again when it '
+                    'recovers. 0 disables the limit. Default is 10.'),
+    cfg.IntOpt('api_min_concurrency', default=1,
+               help='Lowest Avi Controller API calls in flight the adaptive '
+                    'limit can go down to. Default is 1.'),
+    cfg.FloatOpt('api_latency_target', default=2.0,
+                 help='Avi Controller API latency in seconds above which '
+                      'the controller is considered overloaded. Default '
+                      'is 2.'),
+    cfg.IntOpt('api_breaker_threshold', default=5,
+               help='Consecutive Avi Controller API failures (connection '
+                    'errors, timeouts or 502/503/504) after which the '
+                    'calls fail immediately until the controller is back. '
+                    '0 disables the circuit breaker. Default is 5.'),
+    cfg.IntOpt('api_breaker_reset_timeout', default=30,
+               help='Seconds the calls fail immediately after the circuit '
+                    'breaker opened, before a single call probes the '
+                    'controller again. Default is 30.'),
+    cfg.IntOpt('api_session_keepalive', default=300,
+               help='Seconds of inactivity after which the Avi Controller '
+                    'session is refreshed in the background, so that it '
+                    'does not expire between API calls. Should be lower '
+                    'than the controller session idle timeout. 0 disables '
+                    'the keep-alive. Default is 300.'),
+    cfg.BoolOpt('api_eager_login', default=False,
+                help='Login to the Avi Controller when the driver starts '
+                     'instead of on the first API call. Default is False.'),
+    cfg.FloatOpt('api_cache_ttl', default=0,
+                 help='Seconds the Avi objects read or written by the driver '
+                      'are cached and served without calling the Avi '
+                      'Controller again. The cache saves a GET per read and '
+                      'per update of the objects used recently, but the '
+                      'other neutron-server workers and hosts, and the Avi '
+                      'UI, change the objects behind it: reads may then '
+                      'return a version up to this old, and updates of a '
+                      'stale cached version are rejected by the Avi '
+                      'Controller and retried after a GET. Only enable it '
+                      'when the driver process is the only writer of its '
+                      'objects. 0 disables the cache. Default is 0.'),
+    cfg.IntOpt('api_cache_size', default=1024,
+               help='Maximum number of Avi objects cached; the least '
+                    'recently used are evicted first. Default is 1024.'),
+    cfg.FloatOpt('api_negative_cache_ttl', default=0,
+                 help='Seconds an Avi object found not to exist is assumed '
+                      'to still not exist, unless created by the driver '
+                      'process, instead of being looked up again. Updates '
+                      'and lookups by name always look the object up, as '
+                      'they create it when missing. 0 disables the cache. '
+                      'Default is 0.'),
+    cfg.BoolOpt('api_conditional_update', default=True,
+                help='Update Avi objects by writing back their cached '
+                     'version, conditional on it being the latest, instead '
+                     'of fetching them first. The objects are fetched only '
+                     'when the Avi Controller rejects the write as they '
+                     'changed meanwhile. Does nothing unless the object '
+                     'cache is enabled by setting api_cache_ttl, which is '
+                     'disabled by default. Default is True.'),
+    cfg.BoolOpt('api_delta_update', default=True,
+                help='Update Avi objects fetched for the update by patching '
+                     'only the fields which differ from the fetched version, '
+                     'when a single conditional PATCH can apply the change, '
+                     'and skip updates changing nothing. Objects updated '
+                     'from their cached version, or needing several PATCH '
+                     'operations, are written with a conditional PUT. '
+                     'Default is True.'),
+    cfg.BoolOpt('api_macro', default=True,
+                help='Create a virtual service together with the vsvip it '
+                     'uses, and the other objects created along, in one '
+                     'request through the macro API of the Avi Controller. '
+                     'Controllers without the macro API are detected and '
+                     'the objects are then created one at a time. Default '
+                     'is True.'),
+    cfg.FloatOpt('ref_cache_ttl', default=3600,
+                 help='Seconds the refs of the Avi objects looked up by '
+                      'name, e.g. the System-* application and SSL '
+                      'profiles, are cached. 0 disables the cache. Default '
+                      'is 3600.'),
+    cfg.StrOpt('shared_session_file', default='',
+               help='File through which the driver processes of a host, '
+                    'e.g. the neutron-server API workers, share one Avi '
+                    'Controller session instead of logging in each on its '
+                    'own. The file holds the session credentials and is '
+                    'created with 0600 permissions. Default is empty, i.e. '
+                    'sessions are not shared.'),
+    cfg.StrOpt('metrics_file', default='',
+               help='File the Avi Controller API metrics are written to in '
+                    'Prometheus text format every metrics_interval seconds. '
+                    'Each process making API calls writes its own file, '
+                    'named with its pid, e.g. metrics.<pid>.prom for '
+                    'metrics.prom. Default is empty, i.e. not written.'),
+    cfg.IntOpt('metrics_interval', default=60,
+               help='Seconds between the writes of metrics_file. '
+                    'Default is 60.'),
+    cfg.IntOpt('metrics_port', default=0,
+               help='Local port serving the Avi Controller API metrics in '
+                    'Prometheus text format on /metrics. Only the first '
+                    'driver process of the host binds it. Default is 0, '
+                    'i.e. not served.'),
+    cfg.StrOpt('trace_file', default='',
+               help='File the trace spans of the driver operations are '
+                    'appended to as JSON lines; render them with '
+                    '"python -m avi_lbaasv2.avi_api.avi_trace <file>". '
+                    'Default is empty, i.e. tracing is disabled.'),
+    cfg.StrOpt('json_backend', default='',
+               help='JSON library used for the Avi Controller API request '
+                    'and response bodies: orjson, ujson, simplejson or '
+                    'json. Default is empty, i.e. the fastest one '
+                    'installed, falling back to the standard json module.'),
+    cfg.FloatOpt('data_log_sample_rate', default=1.0,
+                 help='Fraction of the Avi Controller API calls whose '
+                      'request and response data is logged at debug '
+                      'level. Default is 1.'),
+    cfg.IntOpt('data_log_max_size', default=4096,
+               help='Maximum characters of the API data logged per '
+                    'request or response; 0 means no limit. Secrets like '
+                    'private keys, passwords and session tokens are always '
+                    'redacted. Default is 4096.'),
+    cfg.DictOpt('data_log_type_sample_rates', default={},
+                help='Per Avi object type overrides of '
+                     'data_log_sample_rate, e.g. pool:0.1,virtualservice:1'),
+    cfg.DictOpt('data_log_type_max_sizes', default={},
+                help='Per Avi object type overrides of data_log_max_size, '
+                     'e.g. pool:1024'),
 ]
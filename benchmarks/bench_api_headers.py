@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the per-request header construction in ApiSession.
+Compares the header template cache with the previous implementation which
+deep copied and rebuilt the headers on every request.
+
+    python -m benchmarks.bench_api_headers
+"""
+import copy
+import timeit
+
+from avi_lbaasv2.avi_api.avi_api import ApiSession, sessionDict
+
+ITERATIONS = 100000
+TENANT_UUID = 'tenant-0b1b0ac8-2bd0-4b1d-9b5d-0ad4d3f5e0a1'
+
+
+def legacy_api_headers(session, tenant, tenant_uuid, timeout, headers,
+                       api_version):
+    api_hdrs = copy.deepcopy(session.headers)
+    api_hdrs.update({
+        "Referer": session.prefix,
+        "Content-Type": "application/json"
+    })
+    api_hdrs['timeout'] = str(timeout)
+    api_hdrs['X-CSRFToken'] = sessionDict.get(session.key)['csrftoken']
+    if api_version:
+        api_hdrs['X-Avi-Version'] = api_version
+    elif session.avi_credentials.api_version:
+        api_hdrs['X-Avi-Version'] = session.avi_credentials.api_version
+    if tenant:
+        tenant_uuid = None
+    elif tenant_uuid:
+        tenant = None
+    else:
+        tenant = session.avi_credentials.tenant
+        tenant_uuid = session.avi_credentials.tenant_uuid
+    if tenant_uuid:
+        api_hdrs.update({"X-Avi-Tenant-UUID": "%s" % tenant_uuid})
+        api_hdrs.pop("X-Avi-Tenant", None)
+    elif tenant:
+        api_hdrs.update({"X-Avi-Tenant": "%s" % tenant})
+        api_hdrs.pop("X-Avi-Tenant-UUID", None)
+    if session.user_hdrs:
+        api_hdrs.update(session.user_hdrs)
+    if headers:
+        api_hdrs.update(headers)
+    return api_hdrs
+
+
+def main():
+    session = ApiSession('10.10.10.10', 'admin', 'password',
+                         api_version='18.1.2', csrftoken='csrftoken',
+                         session_id='sessionid')
+    session.headers.update({'X-Avi-UserAgent': 'lbaasv2'})
+    args = ('', TENANT_UUID, 60, {'Slug': 'pool-1'}, None)
+    assert (legacy_api_headers(session, *args) ==
+            session._get_api_headers(*args))
+    for name, fn in (('legacy', legacy_api_headers),
+                     ('template', ApiSession._get_api_headers)):
+        secs = timeit.timeit(lambda: fn(session, *args), number=ITERATIONS)
+        print('%-10s %8.2f usec/request' % (name, secs * 1e6 / ITERATIONS))
+
+
+if __name__ == '__main__':
+    main()
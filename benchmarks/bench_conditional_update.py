@@ -0,0 +1,97 @@
+"""
+Benchmark of AviClient.update against the fake controller of the tests.
+Counts the controller round trips per update with and without conditional
+updates, for updates of one object made one after the other and made
+concurrently by several threads of two driver processes (two AviClients).
+
+    python -m benchmarks.bench_conditional_update
+"""
+import logging
+import threading
+import time
+
+from avi_lbaasv2.avi_api.avi_api import ApiSession
+from avi_lbaasv2.common.avi_client import AviClient
+
+from tests.fake_controller import FakeController
+
+UPDATES = 50
+PROCESSES = 2
+THREADS = 4
+TENANT_UUID = 'tenant-1'
+
+
+class Conf(object):
+    api_retry_backoff = 0.01
+    api_retry_budget_ratio = 1.0
+    api_max_concurrency = 0
+    api_session_keepalive = 0
+    api_delta_update = False
+    # conditional updates write back the cached version of the object
+    api_cache_ttl = 60
+
+    def __init__(self, conditional_update):
+        self.api_conditional_update = conditional_update
+
+
+def run(conditional_update, processes, threads):
+    ctrl = FakeController(api_delay=0.002).start()
+    ApiSession.clear_cached_sessions()
+    try:
+        clients = [AviClient(ctrl.url, 'admin', 'password',
+                             conf=Conf(conditional_update))
+                   for _ in range(processes)]
+        clients[0].create('pool', {'uuid': 'pool-1', 'name': 'pool-1'},
+                          TENANT_UUID)
+        for client in clients:
+            client.get('pool', 'pool-1', TENANT_UUID)
+        gets, puts = ctrl.count('GET'), ctrl.count('PUT')
+        errors = []
+
+        def update(client, worker):
+            try:
+                for i in range(UPDATES // threads):
+                    client.update('pool', 'pool-1',
+                                  {'description': '%d-%d' % (worker, i)},
+                                  TENANT_UUID)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=update, args=(client, i))
+                   for client in clients for i in range(threads)]
+        start = time.time()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.time() - start
+        updates = (UPDATES // threads) * threads * processes
+        gets = ctrl.count('GET') - gets
+        puts = ctrl.count('PUT') - puts
+        return (updates, gets, puts, len(errors), elapsed)
+    finally:
+        ctrl.stop()
+        ApiSession.clear_cached_sessions()
+
+
+def main():
+    # the 412 retries are logged as warnings
+    logging.disable(logging.WARNING)
+    for title, processes, threads in (('sequential', 1, 1),
+                                      ('contended', PROCESSES, THREADS)):
+        print('%s updates (%d processes x %d threads)' % (
+            title, processes, threads))
+        for name, conditional in (('get+put', False),
+                                  ('conditional', True)):
+            updates, gets, puts, errors, elapsed = run(
+                conditional, processes, threads)
+            print('  %-12s %5.2f round trips/update (%.2f GET, %.2f PUT, '
+                  '%d 412s) %d errors %6.1f msec/update' % (
+                      name, float(gets + puts) / updates,
+                      float(gets) / updates, float(puts) / updates,
+                      puts - updates + errors, errors,
+                      elapsed * 1e3 / updates))
+
+
+if __name__ == '__main__':
+    main()
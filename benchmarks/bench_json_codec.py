@@ -0,0 +1,114 @@
+"""
+Micro-benchmark of the JSON codec of the API bodies. Compares each
+installed JSON library with the stdlib json module on virtualservice, pool
+and vsvip objects shaped like the ones the driver creates and reads.
+
+    python -m benchmarks.bench_json_codec
+"""
+import timeit
+
+from avi_lbaasv2.avi_api import avi_codec
+
+ITERATIONS = 2000
+TENANT = 'https://10.10.10.10/api/tenant/tenant-0b1b0ac82bd04b1d'
+
+
+def vsvip():
+    return {
+        'url': 'https://10.10.10.10/api/vsvip/vsvip-1',
+        'uuid': 'vsvip-1',
+        'name': 'vsvip-lb-1',
+        'tenant_ref': TENANT,
+        'cloud_ref': 'https://10.10.10.10/api/cloud/cloud-1',
+        'vrf_context_ref': 'https://10.10.10.10/api/vrfcontext/vrf-1',
+        'vip': [{
+            'vip_id': '1',
+            'ip_address': {'addr': '10.0.0.10', 'type': 'V4'},
+            'subnet_uuid': 'subnet-2bd04b1d9b5d0ad4d3f5e0a1',
+            'port_uuid': 'port-9b5d0ad4d3f5e0a12bd04b1d',
+            'floating_ip': {'addr': '172.16.0.10', 'type': 'V4'},
+            'enabled': True,
+            'auto_allocate_ip': False,
+        }],
+        'east_west_placement': False,
+    }
+
+
+def pool(members=200):
+    return {
+        'url': 'https://10.10.10.10/api/pool/pool-1',
+        'uuid': 'pool-1',
+        'name': 'pool-1',
+        'tenant_ref': TENANT,
+        'cloud_ref': 'https://10.10.10.10/api/cloud/cloud-1',
+        'lb_algorithm': 'LB_ALGORITHM_ROUND_ROBIN',
+        'default_server_port': 80,
+        'health_monitor_refs': [
+            'https://10.10.10.10/api/healthmonitor/hm-1'],
+        'application_persistence_profile_ref':
+            'https://10.10.10.10/api/applicationpersistenceprofile/app-1',
+        'servers': [{
+            'ip': {'addr': '10.1.%d.%d' % (i // 250, i % 250 + 1),
+                   'type': 'V4'},
+            'port': 8080,
+            'ratio': 1,
+            'enabled': True,
+            'external_uuid': 'member-%032d' % i,
+            'description': 'member %d of pool-1' % i,
+            'nw_ref': 'https://10.10.10.10/api/network/net-1',
+        } for i in range(members)],
+        'description': 'openstack pool',
+    }
+
+
+def virtualservice():
+    return {
+        'url': 'https://10.10.10.10/api/virtualservice/vs-1',
+        'uuid': 'vs-1',
+        'name': 'listener-1',
+        'tenant_ref': TENANT,
+        'cloud_ref': 'https://10.10.10.10/api/cloud/cloud-1',
+        'vsvip_ref': 'https://10.10.10.10/api/vsvip/vsvip-1',
+        'pool_ref': 'https://10.10.10.10/api/pool/pool-1',
+        'enabled': True,
+        'services': [{'port': 443, 'enable_ssl': True}],
+        'application_profile_ref':
+            'https://10.10.10.10/api/applicationprofile/http-1',
+        'network_profile_ref':
+            'https://10.10.10.10/api/networkprofile/tcp-proxy-1',
+        'ssl_profile_ref': 'https://10.10.10.10/api/sslprofile/ssl-1',
+        'ssl_key_and_certificate_refs': [
+            'https://10.10.10.10/api/sslkeyandcertificate/cert-%d' % i
+            for i in range(4)],
+        'connections_rate_limit': {'count': 1000, 'period': 1},
+        'http_policies': [{'index': 11, 'http_policy_set_ref':
+                           'https://10.10.10.10/api/httppolicyset/l7-1'}],
+        'vh_domain_name': ['www.example.com'],
+        'description': 'openstack listener',
+    }
+
+
+def main():
+    payloads = (('virtualservice', virtualservice()), ('pool', pool()),
+                ('vsvip', vsvip()))
+    codecs = []
+    for name in avi_codec.BACKENDS:
+        codec = avi_codec.get_codec(name)
+        if codec.name == name:
+            codecs.append(codec)
+    for obj_name, obj in payloads:
+        body = avi_codec.get_codec('json').dumps(obj).encode('utf-8')
+        print('%s (%d bytes)' % (obj_name, len(body)))
+        for codec in codecs:
+            assert codec.loads(codec.dumps(obj)) == obj
+            dumps = timeit.timeit(lambda: codec.dumps(obj),
+                                  number=ITERATIONS)
+            loads = timeit.timeit(lambda: codec.loads(body),
+                                  number=ITERATIONS)
+            print('  %-10s dumps %8.2f usec  loads %8.2f usec' % (
+                codec.name, dumps * 1e6 / ITERATIONS,
+                loads * 1e6 / ITERATIONS))
+
+
+if __name__ == '__main__':
+    main()
@@ -42,7 +42,8 @@ setup(
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
     ],
-    packages=find_packages(exclude=['tests', 'avi_octavia_driver', ]),
+    packages=find_packages(exclude=['tests', 'benchmarks',
+                                    'avi_octavia_driver', ]),
     install_requires=[],
     license='LICENSE',
     keywords='avi lbaasv2 openstack loadbalancer'
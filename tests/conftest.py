@@ -0,0 +1,43 @@
+import pytest
+
+from avi_lbaasv2.avi_api.avi_api import ApiSession
+
+from tests.fake_controller import FakeController
+
+
+class Conf(object):
+    """driver configuration of the AviClients of the tests"""
+    api_session_keepalive = 0
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'ctrl(**kwargs): arguments of the FakeController of the '
+        'ctrl fixture')
+
+
+@pytest.fixture
+def conf():
+    """returns the Conf class, e.g. conf(api_cache_ttl=60)"""
+    return Conf
+
+
+@pytest.fixture
+def ctrl(request):
+    """
+    started FakeController, configured by the ctrl marker of the test or
+    the parameter of an indirect parametrization; the cached API sessions
+    are cleared before and after the test
+    """
+    kwargs = getattr(request, 'param', None)
+    if kwargs is None:
+        marker = request.node.get_closest_marker('ctrl')
+        kwargs = marker.kwargs if marker else {}
+    ctrl = FakeController(**kwargs).start()
+    ApiSession.clear_cached_sessions()
+    yield ctrl
+    ctrl.stop()
+    ApiSession.clear_cached_sessions()
@@ -0,0 +1,320 @@
+import json
+import socket
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # python 2.7
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self):
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class FakeController(object):
+    """
+    Minimal in-process Avi Controller for tests: session login with
+    csrftoken/sessionid cookies, session expiry (419) and a per-type object
+    store supporting GET/POST/PUT/PATCH (add/delete/replace)/DELETE.
+    Writes set _last_modified; a PUT or PATCH carrying a stale
+    _last_modified fails with 412. POST /api/macro creates an object with
+    the objects given inline as <ref field>_data, unless macro is False.
+    fail() injects error responses; a macro request fails with macro_error
+    after creating the inline objects. Collections list the objects with a
+    tenant_ref of the X-Avi-Tenant-UUID tenant, then those of the admin
+    tenant, and the objects without tenant_ref.
+    """
+    def __init__(self, login_delay=0, api_delay=0, port=0, macro=True):
+        self.macro = macro
+        self.macro_error = None
+        self.login_delay = login_delay
+        self.api_delay = api_delay
+        self.port = port
+        self.lock = threading.Lock()
+        self.login_count = 0
+        self.requests = []
+        self.request_headers = []
+        self.objects = {}
+        self.faults = []
+        self._generation = 0
+        self._modified = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.port
+
+    def start(self):
+        controller = self
+
+        class Handler(_Handler):
+            ctrl = controller
+
+        self._server = _Server(('127.0.0.1', self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server.close_connections()
+            self._server = None
+
+    def expire_sessions(self):
+        """invalidates all sessions; the next API calls get 419"""
+        with self.lock:
+            self._generation += 1
+
+    def fail(self, code, count=1, method=None):
+        """the next count API calls of method, or of any, fail with code"""
+        with self.lock:
+            self.faults.append([method, code, count])
+
+    def take_fault(self, method):
+        """returns the code to fail the call with or None; hold the lock"""
+        for fault in self.faults:
+            if fault[0] in (None, method) and fault[2] > 0:
+                fault[2] -= 1
+                return fault[1]
+        return None
+
+    def count(self, method=None, path=None):
+        with self.lock:
+            return len([r for r in self.requests
+                        if (method is None or r[0] == method) and
+                        (path is None or r[1] == path)])
+
+    def last_modified(self):
+        self._modified += 1
+        return str(self._modified)
+
+    def create(self, obj_type, data, obj_uuid=None):
+        """stores a new object; call with the lock held"""
+        obj_uuid = (obj_uuid or data.get('uuid') or
+                    '%s-%s' % (obj_type, uuid.uuid4()))
+        data['uuid'] = obj_uuid
+        data['url'] = '%s/api/%s/%s' % (self.url, obj_type, obj_uuid)
+        data['_last_modified'] = self.last_modified()
+        self.objects.setdefault(obj_type, {})[obj_uuid] = data
+        return data
+
+    def macro_create(self, obj_type, data):
+        """creates data and its inline objects; call with the lock held"""
+        created = []
+        for field in [f for f in data if f.endswith('_ref_data')]:
+            ref_field = field[:-len('_data')]
+            ref_type = MACRO_REF_TYPES[ref_field]
+            nested = self.macro_create(ref_type, data.pop(field))
+            data[ref_field] = nested[-1]['url']
+            created.extend(nested)
+        created.append(self.create(obj_type, data))
+        return created
+
+    def tokens(self):
+        return ('csrf-%d' % self._generation, 'sess-%d' % self._generation)
+
+
+def _same_item(item, other):
+    # servers are identified by ip and port
+    if isinstance(item, dict) and 'ip' in item:
+        return (item.get('ip') == other.get('ip') and
+                item.get('port') == other.get('port'))
+    return item == other
+
+
+# types of the objects the ref fields refer to, for the macro API
+MACRO_REF_TYPES = {
+    'pool_ref': 'pool',
+    'vh_parent_vs_ref': 'virtualservice',
+    'vsvip_ref': 'vsvip',
+}
+MACRO_MODELS = {
+    'Pool': 'pool',
+    'VirtualService': 'virtualservice',
+    'VsVip': 'vsvip',
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    ctrl = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body=None, cookies=()):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(code)
+        for c in cookies:
+            self.send_header('Set-Cookie', c)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        return data
+
+    def _authorized(self):
+        csrftoken, session_id = self.ctrl.tokens()
+        cookie = self.headers.get('Cookie') or ''
+        return (self.headers.get('X-CSRFToken') == csrftoken and
+                'sessionid=%s' % session_id in cookie)
+
+    def _handle(self, method):
+        ctrl = self.ctrl
+        url = urlparse(self.path)
+        body = self._body()
+        with ctrl.lock:
+            ctrl.requests.append((method, url.path))
+            ctrl.request_headers.append(dict(self.headers.items()))
+        if url.path == '/login':
+            if ctrl.login_delay:
+                time.sleep(ctrl.login_delay)
+            with ctrl.lock:
+                ctrl.login_count += 1
+                csrftoken, session_id = ctrl.tokens()
+            return self._send(
+                200, {'version': {'Version': '18.2.2'},
+                      'session_cookie_name': 'sessionid'},
+                cookies=['csrftoken=%s; Path=/' % csrftoken,
+                         'sessionid=%s; Path=/' % session_id])
+        if not self._authorized():
+            return self._send(419, {'error': 'session expired'})
+        if ctrl.api_delay:
+            time.sleep(ctrl.api_delay)
+        with ctrl.lock:
+            fault = ctrl.take_fault(method)
+        if fault:
+            return self._send(fault, {'error': 'injected failure'})
+        parts = url.path.split('/')[2:]
+        obj_type = parts[0]
+        obj_uuid = parts[1] if len(parts) > 1 else None
+        store = ctrl.objects.setdefault(obj_type, {})
+        data = json.loads(body.decode()) if body else None
+        with ctrl.lock:
+            if method == 'GET' and obj_uuid:
+                if obj_uuid not in store:
+                    return self._send(404, {'error': 'not found'})
+                return self._send(200, store[obj_uuid])
+            if method == 'GET':
+                return self._send(200, self._collection(
+                    store, url, self.headers.get('X-Avi-Tenant-UUID')))
+            if method == 'POST' and obj_type == 'macro':
+                if not ctrl.macro:
+                    return self._send(404, {'error': 'not found'})
+                obj_type = MACRO_MODELS[data['model_name']]
+                created = ctrl.macro_create(obj_type, data['data'])
+                if ctrl.macro_error:
+                    del ctrl.objects[obj_type][created[-1]['uuid']]
+                    return self._send(ctrl.macro_error,
+                                      {'error': 'macro failed'})
+                return self._send(201, created)
+            if method == 'POST':
+                return self._send(201, ctrl.create(
+                    obj_type, data, self.headers.get('Slug')))
+            if obj_uuid not in store:
+                return self._send(404, {'error': 'not found'})
+            if (method in ('PUT', 'PATCH') and
+                    data.get('_last_modified') is not None and
+                    data['_last_modified'] !=
+                    store[obj_uuid].get('_last_modified')):
+                return self._send(412, {'error': 'Concurrent Update Error'})
+            if method == 'PUT':
+                data['uuid'] = obj_uuid
+                data['url'] = store[obj_uuid]['url']
+                data['_last_modified'] = ctrl.last_modified()
+                store[obj_uuid] = data
+                return self._send(200, data)
+            if method == 'PATCH':
+                obj = store[obj_uuid]
+                for k, v in data.get('delete', {}).items():
+                    obj[k] = [i for i in obj.get(k, [])
+                              if not any(_same_item(i, d) for d in v)]
+                for k, v in data.get('add', {}).items():
+                    obj[k] = obj.get(k, []) + v
+                for k, v in data.get('replace', {}).items():
+                    obj[k] = v
+                obj['_last_modified'] = ctrl.last_modified()
+                return self._send(200, obj)
+            if method == 'DELETE':
+                del store[obj_uuid]
+                return self._send(204)
+        return self._send(405, {'error': 'not supported'})
+
+    def _collection(self, store, url, tenant):
+        query = parse_qs(url.query)
+        results = sorted(store.values(), key=lambda o: o['uuid'])
+        if tenant:
+            def owner(o):
+                return o.get('tenant_ref', '').rstrip('/').split('/')[-1]
+            results = ([o for o in results if owner(o) == tenant] +
+                       [o for o in results if owner(o) in ('admin', '')])
+        names = query.get('name')
+        if names:
+            results = [o for o in results if o.get('name') in names]
+        rsp = {'count': len(results)}
+        page_size = int(query.get('page_size', [0])[0])
+        if page_size:
+            page = int(query.get('page', [1])[0])
+            start = (page - 1) * page_size
+            if start + page_size < len(results):
+                rsp['next'] = '%s%s?page=%d&page_size=%d' % (
+                    self.ctrl.url, url.path, page + 1, page_size)
+            results = results[start:start + page_size]
+        fields = query.get('fields')
+        if fields:
+            fields = fields[0].split(',') + ['url', 'uuid']
+            results = [dict((k, v) for k, v in o.items() if k in fields)
+                       for o in results]
+        rsp['results'] = results
+        return rsp
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
@@ -0,0 +1,351 @@
+import copy
+import json
+import pickle
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from requests import Response
+
+from avi_lbaasv2.avi_api import avi_api, avi_codec
+from avi_lbaasv2.avi_api.avi_api import (APIError, ApiResponse, ApiSession,
+                                         ControllerUnavailable)
+from avi_lbaasv2.avi_api.avi_breaker import CircuitBreaker
+from avi_lbaasv2.avi_api.avi_retry import RetryPolicy
+
+from tests.fake_controller import FakeController
+
+
+def _run_concurrently(fn, count):
+    errors = []
+
+    def run():
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+
+@pytest.mark.ctrl(login_delay=0.2)
+def test_single_login_per_session_expiry(ctrl):
+    ctrl.objects['pool'] = {'pool-1': {'uuid': 'pool-1'}}
+    session = ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                     lazy_authentication=True)
+
+    def get_pool():
+        assert session.get('pool/pool-1').json()['uuid'] == 'pool-1'
+
+    _run_concurrently(get_pool, 20)
+    assert ctrl.login_count == 1
+
+    ctrl.expire_sessions()
+    _run_concurrently(get_pool, 20)
+    assert ctrl.login_count == 2
+
+
+def test_circuit_breaker_fails_fast_while_controller_is_down():
+    ctrl = FakeController().start()
+    port = ctrl.port
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.5)
+    try:
+        ApiSession.clear_cached_sessions()
+        ctrl.objects['pool'] = {'pool-1': {'uuid': 'pool-1'}}
+        session = ApiSession.get_session(
+            ctrl.url, 'admin', 'password', lazy_authentication=True,
+            timeout=5, breaker=breaker,
+            retry_policy=RetryPolicy(max_retries=5, backoff_base=0.01))
+        assert session.get('pool/pool-1').json()['uuid'] == 'pool-1'
+        assert breaker.state == 'closed'
+
+        ctrl.stop()
+        # opens after two connection errors instead of using all retries
+        with pytest.raises(ControllerUnavailable):
+            session.get('pool/pool-1')
+        assert breaker.state == 'open'
+        start = time.time()
+        with pytest.raises(ControllerUnavailable):
+            session.get('pool/pool-1')
+        assert time.time() - start < 0.1
+        assert breaker.rejected == 2
+
+        # half open probe fails while the controller is still down
+        time.sleep(0.5)
+        with pytest.raises(ControllerUnavailable):
+            session.get('pool/pool-1')
+        assert breaker.state == 'open'
+        assert breaker.opened == 2
+
+        ctrl = FakeController(port=port).start()
+        ctrl.objects['pool'] = {'pool-1': {'uuid': 'pool-1'}}
+        with pytest.raises(ControllerUnavailable):
+            session.get('pool/pool-1')
+        assert ctrl.count() == 0
+        time.sleep(0.5)
+        assert session.get('pool/pool-1').json()['uuid'] == 'pool-1'
+        assert breaker.state == 'closed'
+    finally:
+        ctrl.stop()
+        ApiSession.clear_cached_sessions()
+
+
+class _Resp(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_circuit_breaker_half_open_state_is_decided_by_the_probe():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+    in_flight = [breaker.before_call() for _ in range(3)]
+    assert in_flight == [None] * 3
+    breaker.record(error=IOError('reset'), probe=in_flight.pop())
+    assert breaker.state == 'open'
+
+    probe = breaker.before_call()
+    assert probe is not None
+    assert breaker.state == 'half_open'
+    with pytest.raises(ControllerUnavailable):
+        breaker.before_call()
+    # calls made before the breaker opened don't end the probe
+    breaker.record(resp=_Resp(200), probe=in_flight.pop())
+    breaker.record(error=IOError('reset'), probe=in_flight.pop())
+    assert breaker.state == 'half_open'
+    with pytest.raises(ControllerUnavailable):
+        breaker.before_call()
+
+    breaker.record(resp=_Resp(503), probe=probe)
+    assert breaker.state == 'open'
+    assert breaker.opened == 2
+    # nor does a stale probe token
+    breaker.record(resp=_Resp(200), probe=probe)
+    assert breaker.state == 'open'
+
+    # a probe ending without result lets the next call probe
+    probe = breaker.before_call()
+    breaker.record(probe=probe)
+    assert breaker.state == 'half_open'
+    probe = breaker.before_call()
+    assert probe is not None
+    breaker.record(resp=_Resp(200), probe=probe)
+    assert breaker.state == 'closed'
+    assert breaker.before_call() is None
+
+
+def test_get_objects_iter_follows_pages(ctrl):
+    with ctrl.lock:
+        for i in range(5):
+            ctrl.create('pool', {'name': 'pool-%d' % i,
+                                 'description': 'd'}, 'pool-%d' % i)
+    session = ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                     lazy_authentication=True)
+    pools = list(session.get_objects_iter('pool', page_size=2,
+                                          fields=['name']))
+    assert [p['name'] for p in pools] == ['pool-%d' % i
+                                          for i in range(5)]
+    assert ctrl.count('GET', '/api/pool') == 3
+    # the fields of the first page are carried over to the next ones
+    assert not any('description' in p for p in pools)
+
+    assert list(session.get_objects_iter('vsvip')) == []
+    assert ctrl.count('GET', '/api/vsvip') == 1
+
+
+class _Page(object):
+    def __init__(self, page):
+        self.page = page
+
+    def json(self):
+        return self.page
+
+
+def test_get_objects_iter_rejects_malformed_next_links():
+    session = ApiSession('127.0.0.1', 'admin', 'password',
+                         lazy_authentication=True)
+    for next_page in ('https://127.0.0.1/login?page=2', 'page=2',
+                      'https://127.0.0.1/api/?page=2',
+                      'https://127.0.0.1/api/pool?page_size=200'):
+        session.get = lambda *args, **kwargs: _Page(
+            {'count': 2, 'results': [{'uuid': 'pool-1'}],
+             'next': next_page})
+        objs = session.get_objects_iter('pool')
+        assert next(objs) == {'uuid': 'pool-1'}
+        with pytest.raises(APIError):
+            next(objs)
+
+    assert session._parse_next_page(
+        '/api/pool/?page=2&page_size=2', {'page_size': 2, 'fields': 'name'}
+    ) == ('pool', {'page': '2', 'page_size': '2', 'fields': 'name'})
+
+
+class _Stop(object):
+    """keep-alive stop event letting the loop run count times"""
+    def __init__(self, count):
+        self.count = count
+
+    def wait(self, timeout):
+        self.count -= 1
+        return self.count < 0
+
+    def set(self):
+        self.count = 0
+
+
+def test_keepalive_refreshes_idle_sessions(ctrl):
+    session = ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                     lazy_authentication=True)
+    session.start_keepalive(60)
+    thread = session._keepalive_thread
+    assert thread.is_alive()
+    session.start_keepalive(60)
+    assert session._keepalive_thread is thread
+    session.stop_keepalive()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    keepalive_path = '/api/' + ApiSession.SESSION_KEEPALIVE_PATH
+    session.session_keepalive = 60
+    # not authenticated yet
+    session._keepalive_stop = _Stop(1)
+    session._keepalive_loop()
+    assert ctrl.count() == 0
+
+    session.get('pool')
+    session._keepalive_stop = _Stop(1)
+    session._keepalive_loop()
+    assert ctrl.count('GET', keepalive_path) == 0
+
+    entry = avi_api.sessionDict[session.key]
+    entry['last_used'] = datetime.utcnow() - timedelta(seconds=61)
+    session._keepalive_stop = _Stop(2)
+    session._keepalive_loop()
+    # refreshed once, then no longer idle
+    assert ctrl.count('GET', keepalive_path) == 1
+    assert datetime.utcnow() - entry['last_used'] < timedelta(seconds=5)
+
+    # the expired controller session is re-authenticated
+    ctrl.expire_sessions()
+    entry['last_used'] = datetime.utcnow() - timedelta(seconds=61)
+    session._keepalive_stop = _Stop(1)
+    session._keepalive_loop()
+    assert ctrl.count('GET', keepalive_path) == 3
+    assert ctrl.login_count == 2
+
+
+def test_clean_inactive_sessions_in_lru_order():
+    ApiSession.clear_cached_sessions()
+    try:
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=ApiSession.SESSION_CACHE_EXPIRY + 1)
+        for key in ('a', 'b', 'c', 'd'):
+            ApiSession._store_session(key, {'csrftoken': key})
+        sessions = avi_api.sessionDict
+        sessions['a']['last_used'] = expired
+        sessions['b']['last_used'] = expired
+        sessions['c']['last_used'] = expired
+        # used again: moved to the tail
+        ApiSession._store_session('a', sessions['a'])
+        assert list(sessions) == ['b', 'c', 'd', 'a']
+
+        ApiSession._clean_inactive_sessions()
+        assert list(avi_api.sessionDict) == ['d', 'a']
+        ApiSession._clean_inactive_sessions()
+        assert list(avi_api.sessionDict) == ['d', 'a']
+    finally:
+        ApiSession.clear_cached_sessions()
+
+
+def _response(status_code=200, content=b'{"name": "pool-1"}'):
+    rsp = Response()
+    rsp.status_code = status_code
+    rsp._content = content
+    rsp.headers['Content-Type'] = 'application/json'
+    return rsp
+
+
+def test_response_json_is_decoded_once(monkeypatch):
+    loads = []
+
+    def counting_loads(data):
+        loads.append(data)
+        return json.loads(data.decode('utf-8'))
+
+    monkeypatch.setattr(avi_codec, 'loads', counting_loads)
+    rsp = ApiResponse(_response())
+    obj = rsp.json()
+    assert obj == {'name': 'pool-1'}
+    assert rsp.json() is obj
+    assert loads == [b'{"name": "pool-1"}']
+    assert ApiResponse(_response(204, b'')).json() is None
+
+    avi_api.set_json_decoder(lambda data: {'decoded': data})
+    try:
+        assert ApiResponse(_response()).json() == {
+            'decoded': b'{"name": "pool-1"}'}
+    finally:
+        avi_api.set_json_decoder(None)
+    assert ApiResponse(_response()).json() == {'name': 'pool-1'}
+    assert len(loads) == 2
+
+
+def test_response_attributes_are_the_wrapped_ones():
+    wrapped = _response()
+    rsp = ApiResponse(wrapped)
+    assert rsp.response is wrapped
+    assert rsp.headers['Content-Type'] == 'application/json'
+    assert rsp.text == '{"name": "pool-1"}'
+    rsp.status_code = 404
+    rsp.reason = 'Not Found'
+    assert wrapped.status_code == 404
+    assert wrapped.reason == 'Not Found'
+    assert 'status_code' not in rsp.__dict__
+    with pytest.raises(avi_api.ObjectNotFound):
+        rsp.json()
+
+
+def test_response_pickle_and_deepcopy():
+    rsp = ApiResponse(_response())
+    obj = rsp.json()
+    for other in (pickle.loads(pickle.dumps(rsp)), copy.deepcopy(rsp)):
+        assert isinstance(other, ApiResponse)
+        assert other.status_code == 200
+        assert other.response is not rsp.response
+        # decoded again, not shared with the original
+        other_obj = other.json()
+        assert other_obj == obj
+        other_obj['name'] = 'pool-2'
+        assert rsp.json() == {'name': 'pool-1'}
+
+
+def test_pool_stats_and_idle_connections_are_dropped(ctrl, monkeypatch):
+    # requests verifies the API calls, but not the login, against a CA
+    # bundle of the environment, which takes separate pools
+    monkeypatch.delenv('REQUESTS_CA_BUNDLE', raising=False)
+    monkeypatch.delenv('CURL_CA_BUNDLE', raising=False)
+    session = ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                     lazy_authentication=True,
+                                     keepalive_timeout=30)
+    for _ in range(3):
+        session.get('pool')
+    # the login and the GETs over a single connection
+    assert session.pool_stats() == {'requests': 4, 'hits': 3,
+                                    'misses': 1}
+
+    adapter = session.get_adapter(ctrl.url)
+    assert adapter.keepalive_timeout == 30
+    adapter.last_used -= 20
+    session.get('pool')
+    assert session.pool_stats()['misses'] == 1
+    # idle for longer than the keep-alive timeout: a new connection,
+    # the counters of the dropped ones are kept
+    adapter.last_used -= 31
+    session.get('pool')
+    session.get('pool')
+    assert session.pool_stats() == {'requests': 7, 'hits': 5,
+                                    'misses': 2}
@@ -0,0 +1,185 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from avi_lbaasv2.avi_api.avi_api import ApiSession, ObjectNotFound
+from avi_lbaasv2.avi_api import avi_async
+from avi_lbaasv2.avi_api.avi_async import (ApiExecutor, AsyncApiSession,
+                                           gather, get_executor)
+from avi_lbaasv2.common.avi_client import AviClient
+
+
+def test_executor_bounds_the_calls_in_flight():
+    executor = ApiExecutor(3)
+    lock = threading.Lock()
+    state = {'in_flight': 0, 'max': 0}
+
+    def call(i):
+        with lock:
+            state['in_flight'] += 1
+            state['max'] = max(state['max'], state['in_flight'])
+        time.sleep(0.05)
+        with lock:
+            state['in_flight'] -= 1
+        return i * 2
+
+    try:
+        assert executor.map(call, range(9)) == list(range(0, 18, 2))
+        assert state['max'] == 3
+        assert executor.submit(call, 5).result() == 10
+    finally:
+        executor.shutdown()
+
+
+def test_gather_waits_for_all_calls():
+    executor = ApiExecutor(4)
+    done = []
+
+    def call(i):
+        if i == 1:
+            raise ValueError(i)
+        time.sleep(0.05)
+        done.append(i)
+        return i
+
+    try:
+        with pytest.raises(ValueError):
+            gather([executor.submit(call, i) for i in range(4)])
+        # raised once the other calls completed
+        assert sorted(done) == [0, 2, 3]
+        results = gather([executor.submit(call, i) for i in range(3)],
+                         return_exceptions=True)
+        assert results[0] == 0 and results[2] == 2
+        assert isinstance(results[1], ValueError)
+        with pytest.raises(ValueError):
+            executor.map(call, range(3))
+    finally:
+        executor.shutdown()
+
+
+def test_executor_pool_is_recreated_after_fork(monkeypatch):
+    executor = ApiExecutor(2)
+    try:
+        executor.submit(int).result()
+        pool = executor._pool
+        executor.submit(int).result()
+        assert executor._pool is pool
+        # the worker threads of the parent did not survive the fork
+        pid = os.getpid()
+        monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+        assert executor.submit(int, '7').result() == 7
+        assert executor._pool is not pool
+    finally:
+        executor.shutdown()
+        pool.shutdown()
+    assert executor._pool is None
+
+
+class GreenPool(object):
+    """eventlet.GreenPool running the greenthreads in threads"""
+    def __init__(self, size):
+        self.size = size
+        self.threads = []
+
+    def spawn_n(self, fn, *args):
+        t = threading.Thread(target=fn, args=args)
+        t.start()
+        self.threads.append(t)
+
+    def waitall(self):
+        for t in self.threads:
+            t.join()
+
+
+class Patcher(object):
+    @staticmethod
+    def is_monkey_patched(module):
+        return module == 'thread'
+
+
+def test_executor_uses_a_green_pool_under_eventlet(monkeypatch):
+    eventlet = type('eventlet', (object,), {'GreenPool': GreenPool,
+                                            'patcher': Patcher})
+    monkeypatch.setitem(sys.modules, 'eventlet', eventlet)
+    executor = ApiExecutor(3)
+
+    def call(i):
+        if i == 2:
+            raise ValueError(i)
+        return i * 2
+
+    try:
+        fs = [executor.submit(call, i) for i in range(4)]
+        assert isinstance(executor._pool, GreenPool)
+        assert executor._pool.size == 3
+        assert gather(fs, return_exceptions=True)[:2] == [0, 2]
+        assert isinstance(fs[2].exception(), ValueError)
+    finally:
+        executor.shutdown()
+    assert executor._pool is None
+
+
+def test_executor_is_shared_by_size():
+    assert get_executor(3) is get_executor(3)
+    assert get_executor() is get_executor(avi_async.DEFAULT_WORKERS)
+    assert get_executor(3) is not get_executor(4)
+
+
+@pytest.mark.ctrl(api_delay=0.1)
+def test_async_session_calls(ctrl):
+    with ctrl.lock:
+        for i in range(5):
+            ctrl.create('pool', {'name': 'pool-%d' % i}, 'pool-%d' % i)
+    session = ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                     tenant_uuid='tenant-1')
+    async_session = AsyncApiSession(session, max_workers=5)
+    start = time.time()
+    rsps = gather([async_session.get('pool/pool-%d' % i)
+                   for i in range(5)])
+    assert time.time() - start < 0.4
+    assert [r.json()['name'] for r in rsps] == ['pool-%d' % i
+                                                for i in range(5)]
+    obj = async_session.get_object_by_name('pool', 'pool-3').result()
+    assert obj['uuid'] == 'pool-3'
+    rsp = async_session.post('pool', data={'name': 'pool-5'}).result()
+    assert rsp.status_code == 201
+    path = 'pool/%s' % rsp.json()['uuid']
+    async_session.put(path, data={'name': 'pool-5',
+                                  'description': 'a'}).result()
+    async_session.patch(path, data={
+        'replace': {'description': 'b'}}).result()
+    assert async_session.get(path).result().json()['description'] == 'b'
+    async_session.delete(path).result()
+    assert len(ctrl.objects['pool']) == 5
+
+
+@pytest.mark.ctrl(api_delay=0.1)
+def test_async_client_calls(ctrl, conf):
+    with ctrl.lock:
+        for i in range(5):
+            ctrl.create('pool', {'name': 'pool-%d' % i}, 'pool-%d' % i)
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_cache_ttl=0))
+    client.login()
+    start = time.time()
+    fs = [client.async_client.get('pool', 'pool-%d' % i, 'tenant-1')
+          for i in range(5)]
+    pools = gather(fs)
+    # concurrently, not one after the other
+    assert time.time() - start < 0.4
+    assert [p['name'] for p in pools] == ['pool-%d' % i
+                                          for i in range(5)]
+
+    f = client.async_client.get('pool', 'pool-9', 'tenant-1')
+    with pytest.raises(ObjectNotFound):
+        f.result()
+    rsp = client.async_client.update(
+        'pool', 'pool-0', {'description': 'a'}, 'tenant-1').result()
+    assert rsp['description'] == 'a'
+    # the executor of the driver fan out
+    assert client.executor is get_executor()
+    assert client.async_session.get('pool/pool-1').result().json()[
+        'name'] == 'pool-1'
@@ -0,0 +1,60 @@
+import time
+
+from avi_lbaasv2.avi_api.avi_cache import ObjectCache, RefCache
+
+
+def test_object_cache_projection_and_copies():
+    cache = ObjectCache(ttl=60)
+    key = ('tenant-1', 'pool', 'pool-1')
+    cache.put(key, {'uuid': 'pool-1', 'url': 'u', 'servers': []},
+              fields=['uuid', 'url'])
+    assert cache.get(key, ['uuid']) == {'uuid': 'pool-1'}
+    assert cache.get(key) is None
+
+    cache.put(key, {'uuid': 'pool-1', 'url': 'u', 'servers': []})
+    obj = cache.get(key)
+    obj['servers'].append({'port': 80})
+    assert cache.get(key)['servers'] == []
+    # a projection does not replace the full object
+    cache.put(key, {'uuid': 'pool-1'}, fields=['uuid'])
+    assert cache.get(key, ['url']) == {'url': 'u'}
+
+    cache.invalidate(key)
+    assert cache.get(key, ['uuid']) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['invalidations']) == (
+        4, 2, 1)
+
+
+def test_object_cache_ttl_and_lru():
+    cache = ObjectCache(ttl=0.05, max_size=2)
+    for i in range(3):
+        cache.put(('t', 'pool', i), {'uuid': i})
+    assert cache.get(('t', 'pool', 0)) is None
+    assert cache.stats()['evictions'] == 1
+    cache.get(('t', 'pool', 1))
+    cache.put(('t', 'pool', 3), {'uuid': 3})
+    assert cache.get(('t', 'pool', 1)) == {'uuid': 1}
+    assert cache.get(('t', 'pool', 2)) is None
+    time.sleep(0.06)
+    assert cache.get(('t', 'pool', 1)) is None
+
+    cache.put(('t', 'virtualservice', 'vs-1'), {'uuid': 'vs-1'})
+    cache.invalidate_type('t', 'virtualservice')
+    assert cache.get(('t', 'virtualservice', 'vs-1')) is None
+
+
+def test_ref_cache_per_tenant_and_invalidation():
+    cache = RefCache(ttl=60)
+    cache.put('admin', 'applicationprofile', 'System-HTTP', 'ref-1')
+    cache.put('tenant-1', 'applicationprofile', 'System-HTTP', 'ref-2')
+    cache.put('tenant-1', 'sslprofile', 'ssl-1', 'ref-3')
+    # a tenant may have its own object of the name
+    assert cache.get('tenant-1', 'applicationprofile', 'System-HTTP') == \
+        'ref-2'
+    assert cache.get('admin', 'applicationprofile', 'System-HTTP') == 'ref-1'
+    assert cache.get('tenant-2', 'applicationprofile', 'System-HTTP') is None
+    assert cache.get('tenant-1', 'sslprofile', 'ssl-1') == 'ref-3'
+    cache.invalidate('applicationprofile')
+    assert cache.get('tenant-1', 'applicationprofile', 'System-HTTP') is None
+    assert cache.stats() == {'size': 1, 'hits': 3, 'misses': 2}
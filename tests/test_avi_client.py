@@ -0,0 +1,300 @@
+import threading
+
+import pytest
+
+from avi_lbaasv2.avi_api.avi_api import APIError, ObjectNotFound
+from avi_lbaasv2.common.avi_client import AviClient, BatchError
+
+from tests.test_avi_api import _run_concurrently
+
+
+def test_conditional_update_refetches_only_on_conflict(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_cache_ttl=60,
+                                 api_delta_update=False))
+    client.create('pool', {'uuid': 'pool-1', 'name': 'pool-1'},
+                  'tenant-1')
+    # a create response has _last_modified, the update skips the GET
+    client.update('pool', 'pool-1', {'description': 'a'}, 'tenant-1')
+    client.update('pool', 'pool-1', {'description': 'b'}, 'tenant-1')
+    assert ctrl.count('GET') == 0
+    assert ctrl.count('PUT') == 2
+
+    # changed by someone else: 412, then GET and PUT again
+    ctrl.objects['pool']['pool-1']['_last_modified'] = 'other'
+    rsp = client.update('pool', 'pool-1', {'description': 'c'},
+                        'tenant-1')
+    assert rsp['description'] == 'c'
+    assert rsp['name'] == 'pool-1'
+    assert ctrl.count('GET') == 1
+    assert ctrl.count('PUT') == 4
+    # the full object is fetched; the PUT response lacks computed fields
+    assert client.get('pool', 'pool-1', 'tenant-1')['name'] == 'pool-1'
+    assert ctrl.count('GET') == 2
+
+
+def test_delta_update_patches_changed_fields_only(ctrl, conf):
+    servers = [{'ip': {'addr': '10.0.0.%d' % i, 'type': 'V4'}, 'port': 80}
+               for i in range(1, 4)]
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_cache_ttl=0))
+    client.create('pool', {'uuid': 'pool-1', 'name': 'pool-1',
+                           'enabled': True, 'servers': servers[:2]},
+                  'tenant-1')
+    client.update('pool', 'pool-1', {'name': 'pool-1', 'enabled': True,
+                                     'servers': servers[:2]}, 'tenant-1')
+    assert ctrl.count('PATCH') == 0
+    assert ctrl.count('PUT') == 0
+
+    # controller defaults of the servers are not changes
+    ctrl.objects['pool']['pool-1']['servers'][0]['ratio'] = 1
+    rsp = client.update('pool', 'pool-1', {'enabled': False,
+                                           'servers': servers[:2]},
+                        'tenant-1')
+    assert ctrl.count('PATCH') == 1
+    assert rsp['enabled'] is False
+
+    # a delta of several PATCH operations is written with a PUT
+    rsp = client.update('pool', 'pool-1', {'servers': servers[1:]},
+                        'tenant-1')
+    assert ctrl.count('PATCH') == 1
+    assert ctrl.count('PUT') == 1
+    assert [s['ip']['addr'] for s in rsp['servers']] == [
+        '10.0.0.2', '10.0.0.3']
+
+    # unsetting a field needs a PUT
+    client.update('pool', 'pool-1', {'enabled': None}, 'tenant-1')
+    assert ctrl.count('PUT') == 2
+
+
+def test_delta_update_is_conditional(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_cache_ttl=0))
+    client.create('pool', {'uuid': 'pool-1', 'name': 'pool-1',
+                           'enabled': True}, 'tenant-1')
+    get = client.avi_session.get
+    changes = [{'description': 'other'}]
+
+    def get_then_concurrent_change(*args, **kwargs):
+        rsp = get(*args, **kwargs)
+        if changes:
+            # another worker writes the object after this GET
+            with ctrl.lock:
+                obj = ctrl.objects['pool']['pool-1']
+                obj.update(changes.pop())
+                obj['_last_modified'] = ctrl.last_modified()
+        return rsp
+
+    client.avi_session.get = get_then_concurrent_change
+    rsp = client.update('pool', 'pool-1', {'enabled': False}, 'tenant-1')
+    # the PATCH of the first GET failed with 412
+    assert ctrl.count('PATCH') == 2
+    assert ctrl.count('GET', '/api/pool/pool-1') == 2
+    assert rsp['enabled'] is False
+    assert rsp['description'] == 'other'
+
+
+def test_update_of_stale_cached_base(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_cache_ttl=60))
+    client.create('pool', {'uuid': 'pool-1', 'name': 'pool-1',
+                           'enabled': True}, 'tenant-1')
+    # another worker disables the pool behind the cache
+    with ctrl.lock:
+        obj = ctrl.objects['pool']['pool-1']
+        obj['enabled'] = False
+        obj['description'] = 'other'
+        obj['_last_modified'] = ctrl.last_modified()
+
+    # unchanged according to the cached base, but not to the controller
+    rsp = client.update('pool', 'pool-1', {'enabled': True}, 'tenant-1')
+    assert ctrl.count('PUT') == 1  # rejected with 412
+    assert ctrl.count('GET', '/api/pool/pool-1') == 1
+    assert ctrl.count('PATCH') == 1
+    assert rsp['enabled'] is True
+    assert ctrl.objects['pool']['pool-1']['enabled'] is True
+    assert ctrl.objects['pool']['pool-1']['description'] == 'other'
+
+
+def test_negative_cache_until_created(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_negative_cache_ttl=60))
+    for _ in range(3):
+        with pytest.raises(ObjectNotFound):
+            client.get('vsvip', 'vsvip-1', 'tenant-1')
+    assert ctrl.count('GET') == 1
+    assert client.negative_cache_stats()['hits'] == 2
+
+    # update of a missing object looks it up before creating it
+    client.update('vsvip', 'vsvip-1', {'uuid': 'vsvip-1'}, 'tenant-1')
+    assert ctrl.count('GET') == 2
+    assert ctrl.count('POST', '/api/vsvip') == 1
+    assert client.get('vsvip', 'vsvip-1', 'tenant-1')['uuid'] == 'vsvip-1'
+
+
+def test_create_or_update_ignores_negative_cache(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_negative_cache_ttl=60))
+    with pytest.raises(ObjectNotFound):
+        client.get('vsvip', 'vsvip-1', 'tenant-1')
+    # created by another worker meanwhile
+    with ctrl.lock:
+        ctrl.create('vsvip', {'name': 'vsvip-1'}, 'vsvip-1')
+    with pytest.raises(ObjectNotFound):
+        client.get('vsvip', 'vsvip-1', 'tenant-1')
+    assert client.get('vsvip', 'vsvip-1', 'tenant-1',
+                      negative_cache=False)['name'] == 'vsvip-1'
+    assert client.get_by_name('vsvip', 'vsvip-1',
+                              'tenant-1')['uuid'] == 'vsvip-1'
+
+    with pytest.raises(ObjectNotFound):
+        client.get('pool', 'pool-1', 'tenant-1')
+    with ctrl.lock:
+        ctrl.create('pool', {'name': 'pool-1'}, 'pool-1')
+    rsp = client.update('pool', 'pool-1', {'name': 'pool-1',
+                                           'description': 'a'},
+                        'tenant-1')
+    assert rsp['description'] == 'a'
+    assert ctrl.count('POST', '/api/pool') == 0
+
+
+def test_tenant_profile_takes_precedence_over_admin_ref(ctrl, conf):
+    with ctrl.lock:
+        ctrl.create('applicationprofile',
+                    {'name': 'System-HTTP',
+                     'tenant_ref': ctrl.url + '/api/tenant/admin'},
+                    'ap-admin')
+        ctrl.create('applicationprofile',
+                    {'name': 'System-HTTP',
+                     'tenant_ref': ctrl.url + '/api/tenant/tenant-1'},
+                    'ap-tenant-1')
+    client = AviClient(ctrl.url, 'admin', 'password', conf=conf())
+    for _ in range(2):
+        assert client.get_ref_by_name(
+            'applicationprofile', 'System-HTTP',
+            'tenant-1').endswith('/ap-tenant-1')
+        assert client.get_ref_by_name(
+            'applicationprofile', 'System-HTTP',
+            'tenant-2').endswith('/ap-admin')
+        assert client.get_ref_by_name(
+            'applicationprofile', 'System-HTTP',
+            'admin').endswith('/ap-admin')
+    assert ctrl.count('GET') == 3
+    with pytest.raises(ObjectNotFound):
+        client.get_ref_by_name('applicationprofile', 'other', 'tenant-1')
+
+
+@pytest.mark.ctrl(api_delay=0.2)
+def test_concurrent_gets_are_coalesced(ctrl, conf):
+    ctrl.objects['vsvip'] = {'vsvip-1': {'uuid': 'vsvip-1',
+                                         'name': 'vsvip-1'}}
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_cache_ttl=0))
+    client.login()
+    results = []
+
+    def get_vsvip():
+        vsvip = client.get('vsvip', 'vsvip-1', 'tenant-1')
+        vsvip['name'] += '-modified'
+        results.append(vsvip)
+        assert client.get_by_name(
+            'vsvip', 'vsvip-1', 'tenant-1')['uuid'] == 'vsvip-1'
+
+    _run_concurrently(get_vsvip, 20)
+    assert ctrl.count('GET', '/api/vsvip/vsvip-1') == 1
+    assert ctrl.count('GET', '/api/vsvip') == 1
+    # every caller got its own copy
+    assert set(r['name'] for r in results) == set(['vsvip-1-modified'])
+
+
+def test_gets_after_a_write_do_not_join_older_gets(ctrl, conf):
+    with ctrl.lock:
+        ctrl.create('virtualservice', {'name': 'vs-1'}, 'vs-1')
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_cache_ttl=60,
+                                 api_delta_update=False))
+    get = client._get
+    fetched = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_get(*args):
+        # the first GET answers once the update is done
+        calls.append(args)
+        obj = get(*args)
+        if len(calls) == 1:
+            fetched.set()
+            release.wait(5)
+        return obj
+
+    client._get = slow_get
+    results = []
+    t = threading.Thread(target=lambda: results.append(
+        client.get('virtualservice', 'vs-1', 'tenant-1')))
+    t.start()
+    assert fetched.wait(5)
+    client.update('virtualservice', 'vs-1', {'description': 'a'},
+                  'tenant-1')
+    vs = client.get('virtualservice', 'vs-1', 'tenant-1')
+    release.set()
+    t.join()
+    assert vs['description'] == 'a'
+    assert 'description' not in results[0]
+    assert len(calls) == 2
+    # the GET from before the update did not fill the cache
+    assert client.get('virtualservice', 'vs-1',
+                      'tenant-1')['description'] == 'a'
+
+
+def _create_vs_batch(client):
+    with client.batch('tenant-1') as batch:
+        vsvip_ref = batch.create('vsvip', {'uuid': 'vsvip-1'})
+        vs_ref = batch.create('virtualservice', {'uuid': 'vs-1',
+                                                 'vsvip_ref': vsvip_ref})
+        batch.create('virtualservice', {'uuid': 'vs-2',
+                                        'vh_parent_vs_ref': vs_ref})
+    return batch
+
+
+@pytest.mark.parametrize('ctrl', [{'macro': True}, {'macro': False}],
+                         indirect=True)
+def test_batch_creates_vs_with_its_objects(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password', conf=conf())
+    batch = _create_vs_batch(client)
+    vs = batch.result('/api/virtualservice/vs-1')
+    assert vs['vsvip_ref'].endswith('/api/vsvip/vsvip-1')
+    child = ctrl.objects['virtualservice']['vs-2']
+    assert child['vh_parent_vs_ref'].endswith('/api/virtualservice/vs-1')
+    assert ctrl.count('POST', '/api/macro') == 1
+    if ctrl.macro:
+        # the parent VS is created with its vsvip, not inline under
+        # its only child VS
+        assert ctrl.count('POST', '/api/virtualservice') == 1
+        assert ctrl.count('POST') == ctrl.login_count + 2
+    else:
+        # the failed macro request, then one create per object
+        assert ctrl.count('POST') == ctrl.login_count + 4
+        assert not client.macro_enabled
+
+
+def test_batch_reports_objects_created_by_failed_macro(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password', conf=conf())
+    ctrl.macro_error = 500
+    with pytest.raises(BatchError) as e:
+        _create_vs_batch(client)
+    assert e.value.created == ['/api/vsvip/vsvip-1']
+    assert e.value.rsp.status_code == 500
+    # no fallback to separate creates, and the child VS is not created
+    assert client.macro_enabled
+    assert ctrl.count('POST', '/api/virtualservice') == 0
+    assert list(ctrl.objects['virtualservice']) == []
+    assert list(ctrl.objects['vsvip']) == ['vsvip-1']
+
+    # a failure creating nothing is raised as is
+    ctrl.macro_error = None
+    ctrl.objects['vsvip'] = {}
+    ctrl.fail(400, method='POST')
+    with pytest.raises(APIError) as e:
+        _create_vs_batch(client)
+    assert not isinstance(e.value, BatchError)
+    assert ctrl.objects['vsvip'] == {}
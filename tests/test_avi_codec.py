@@ -0,0 +1,17 @@
+from avi_lbaasv2.avi_api import avi_codec
+
+
+def test_codec_round_trip():
+    obj = {'name': 'pool-1', 'servers': [{'port': 80, 'ratio': 1.5}],
+           'enabled': True, 'description': None}
+    for name in avi_codec.BACKENDS:
+        codec = avi_codec.get_codec(name)
+        assert codec.loads(codec.dumps(obj)) == obj
+        assert codec.loads(b'{"uuid": "pool-1"}') == {'uuid': 'pool-1'}
+
+
+def test_codec_falls_back_to_stdlib():
+    codec = avi_codec.get_codec('not-a-json-library')
+    assert codec.name in avi_codec.BACKENDS
+    big = {'count': 2 ** 70}
+    assert codec.loads(codec.dumps(big)) == big
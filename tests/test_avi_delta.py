@@ -0,0 +1,23 @@
+from collections import OrderedDict
+
+from avi_lbaasv2.avi_api.avi_delta import delta_patches
+
+
+def _server(addr, *key_order):
+    ip = {'addr': addr, 'type': 'V4'}
+    return {'ip': OrderedDict((k, ip[k]) for k in key_order), 'port': 80}
+
+
+def test_servers_match_whatever_the_key_order():
+    # the transform sets type first, the controller returns addr first
+    current = {'name': 'pool-1', 'servers': [
+        dict(_server('10.0.0.%d' % i, 'addr', 'type'), ratio=1)
+        for i in range(1, 4)]}
+    desired = {'name': 'pool-1', 'servers': [
+        _server('10.0.0.%d' % i, 'type', 'addr') for i in range(1, 5)]}
+    assert delta_patches(current, desired) == [
+        ('add', {'servers': [desired['servers'][3]]})]
+
+    desired['servers'] = desired['servers'][1:3]
+    assert delta_patches(current, desired) == [
+        ('delete', {'servers': [current['servers'][0]]})]
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from avi_lbaasv2.avi_api.avi_api import APIError, ObjectNotFound
+from avi_lbaasv2.common import avi_generic
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Driver(object):
+    def __init__(self, **kwargs):
+        self.conf = type('Conf', (object,), kwargs)()
+
+
+def test_fan_out_runs_calls_concurrently_in_order():
+    started = []
+    cond = threading.Condition()
+
+    def double(i):
+        # returns only once all the calls have started
+        with cond:
+            started.append(i)
+            cond.notify_all()
+            deadline = time.time() + 5
+            while len(started) < 3 and time.time() < deadline:
+                cond.wait(0.1)
+            assert len(started) == 3
+        return i * 2
+
+    results = avi_generic.fan_out(Driver(api_max_workers=3), double,
+                                  [(i,) for i in range(3)])
+    assert results == [0, 2, 4]
+
+
+def test_fan_out_combines_errors():
+    def fail_odd(i):
+        if i % 2:
+            raise ObjectNotFound('pool-%d' % i)
+        return i
+
+    with pytest.raises(ObjectNotFound):
+        avi_generic.fan_out(Driver(), fail_odd, [(0,), (1,), (2,)])
+    with pytest.raises(avi_generic.FanOutError) as e:
+        avi_generic.fan_out(Driver(), fail_odd, [(i,) for i in range(4)])
+    assert [str(err) for err in e.value.errors] == ['pool-1', 'pool-3']
+
+
+def test_fan_out_serial():
+    calls = []
+    avi_generic.fan_out(Driver(api_max_workers=1),
+                        lambda i: calls.append(threading.current_thread()),
+                        [(i,) for i in range(3)])
+    assert calls == [threading.current_thread()] * 3
+
+
+def test_failures_of_several_owner_pools_are_api_errors():
+    rsp = Obj(status_code=400, text='invalid pool')
+    updated = []
+
+    class Client(object):
+        def update(self, resource_type, obj_uuid, data, avi_tenant_uuid):
+            updated.append(obj_uuid)
+            raise APIError('invalid pool', rsp)
+
+    class Helper(object):
+        def transform_os_pool_to_avi_pool(self, pool, client, context,
+                                          driver):
+            return {'name': pool.name}
+
+        def fill_avi_pool_uuid_name(self, avi_pool, pool, owner_id):
+            avi_pool['uuid'] = 'pool-%s' % owner_id
+
+        def get_avi_sni_vs_uuid(self, tls_container_id, listener_id):
+            return 'virtualservice-' + tls_container_id
+
+    pool = Obj(id='p-1', name='pool-1', tenant_id='a' * 32)
+    listener = Obj(id='l-1', default_pool_id=pool.id,
+                   sni_containers=[Obj(tls_container_id='sni-1')])
+    driver = Driver()
+    driver.client = Client()
+    driver.avi_helper = Helper()
+    driver.objfns = Obj(listeners_get=lambda context, lb, pool: [listener])
+    pool.root_loadbalancer = None
+
+    # handled by the managers as any failed Avi call
+    with pytest.raises(APIError) as e:
+        avi_generic.pool_update_avi_vs_pool(driver, None, pool)
+    assert isinstance(e.value, avi_generic.FanOutError)
+    assert e.value.rsp is rsp
+    assert sorted(updated) == ['pool-l-1', 'pool-sni-1']
+    assert len(e.value.errors) == 2
@@ -0,0 +1,107 @@
+from avi_lbaasv2.avi_api.avi_limiter import ControllerLimiter, TokenBucket
+
+
+class Clock(object):
+    """fake clock; sleeping advances it"""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps.append(round(secs, 6))
+        self.now += secs
+
+
+class Resp(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_token_bucket_refill():
+    clock = Clock()
+    bucket = TokenBucket(rate=10, burst=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+    # out of tokens: wait for the next one
+    bucket.acquire()
+    assert clock.sleeps == [0.1]
+    bucket.acquire()
+    assert clock.sleeps == [0.1, 0.1]
+    assert bucket.waits == 2
+
+    # refilled up to the burst only
+    clock.now += 60
+    for _ in range(2):
+        bucket.acquire()
+    assert len(clock.sleeps) == 2
+    bucket.acquire()
+    assert clock.sleeps[-1] == 0.1
+
+    # the time slept for the previous token counts toward the next one
+    clock.now += 0.05
+    bucket.acquire()
+    assert clock.sleeps[-1] == 0.05
+
+
+def test_disabled_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=0, burst=1, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+def _call(limiter, clock, status_code=200, latency=0.1, error=None):
+    start = limiter.acquire()
+    clock.now += latency
+    limiter.release(start, resp=Resp(status_code) if status_code else None,
+                    error=error)
+
+
+def test_concurrency_additive_increase_multiplicative_decrease():
+    clock = Clock()
+    limiter = ControllerLimiter(max_concurrency=8, min_concurrency=1,
+                                latency_target=2.0, clock=clock)
+    concurrency = limiter.concurrency
+    assert concurrency.limit == 8
+
+    _call(limiter, clock, 429)
+    assert concurrency.limit == 4
+    # a burst of failures within latency_target is one signal
+    _call(limiter, clock, 503)
+    assert concurrency.limit == 4
+
+    clock.now += 2
+    _call(limiter, clock, 503)
+    assert concurrency.limit == 2
+    clock.now += 2
+    _call(limiter, clock, status_code=None, error=IOError('reset'))
+    assert concurrency.limit == 1
+    clock.now += 2
+    _call(limiter, clock, 503)
+    assert concurrency.limit == 1
+    assert concurrency.decreases == 4
+
+    # about one more for every limit successful calls
+    _call(limiter, clock)
+    assert concurrency.limit == 2
+    _call(limiter, clock)
+    assert concurrency.limit == 2.5
+    _call(limiter, clock)
+    _call(limiter, clock)
+    assert int(concurrency.limit) == 3
+    for _ in range(100):
+        _call(limiter, clock)
+    assert concurrency.limit == 8
+
+    # slow calls are a congestion signal too; client errors are not
+    _call(limiter, clock, 404)
+    assert concurrency.limit == 8
+    _call(limiter, clock, latency=2.5)
+    assert concurrency.limit == 4
+    assert limiter.stats()['concurrency_limit'] == 4
+    assert limiter.stats()['in_flight'] == 0
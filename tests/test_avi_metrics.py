@@ -0,0 +1,91 @@
+import os
+import threading
+
+import requests
+
+from avi_lbaasv2.avi_api import avi_metrics
+from avi_lbaasv2.avi_api.avi_api import ApiSession
+from avi_lbaasv2.common.avi_client import AviClient
+from avi_lbaasv2.avi_api.avi_metrics import (ApiMetrics, FileExporter,
+                                             HttpExporter, object_type)
+
+
+def test_object_type():
+    assert object_type('pool/pool-1') == 'pool'
+    assert object_type('virtualservice?name=vs-1') == 'virtualservice'
+    assert object_type('/api/vsvip/') == 'vsvip'
+
+
+def test_api_metrics_export(ctrl, tmpdir):
+    metrics = ApiMetrics()
+    exporter = HttpExporter(0, metrics=metrics).start()
+    try:
+        ctrl.objects['pool'] = {'pool-1': {'uuid': 'pool-1'}}
+        session = ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                         lazy_authentication=True,
+                                         tenant_uuid='tenant-1',
+                                         metrics=metrics)
+        session.get('pool/pool-1')
+        ctrl.expire_sessions()
+        session.get('pool/pool-1')
+        session.get('pool/pool-2')
+        session.post('pool', data={'name': 'pool-3'})
+
+        labels = ('GET', 'pool', 'tenant-1')
+        assert metrics.requests[labels].count == 4
+        assert metrics.calls[labels].count == 3
+        assert metrics.retries[labels] == 1
+        assert metrics.responses[labels + ('419',)] == 1
+        assert metrics.responses[labels + ('404',)] == 1
+        assert metrics.bytes_out[('POST', 'pool', 'tenant-1')] > 0
+
+        text = requests.get('http://127.0.0.1:%d/metrics' %
+                            exporter.port).text
+        assert ('avi_api_responses_total{method="GET",object_type="pool",'
+                'tenant="tenant-1",code="200"} 2') in text
+        assert ('avi_api_request_duration_seconds_count{method="GET",'
+                'object_type="pool",tenant="tenant-1"} 4') in text
+
+        path = str(tmpdir.join('metrics.prom'))
+        FileExporter(path, metrics=metrics).dump()
+        with open(path) as f:
+            assert f.read() == text
+    finally:
+        exporter.stop()
+
+
+def _exporter_threads():
+    return [t for t in threading.enumerate()
+            if t.name == 'avi-metrics-file']
+
+
+def test_exporters_start_in_the_process_of_the_api_calls(
+        ctrl, conf, tmpdir, monkeypatch):
+    path = str(tmpdir.join('metrics.prom'))
+    key = ('file', path)
+    threads = len(_exporter_threads())
+    try:
+        client = AviClient(ctrl.url, 'admin', 'password',
+                           conf=conf(metrics_file=path, metrics_interval=3600))
+        # not in the parent process creating the driver
+        assert avi_metrics.get_exporter(key) is None
+        assert len(_exporter_threads()) == threads
+
+        client.create('pool', {'name': 'pool-1'}, 'tenant-1')
+        exporter = avi_metrics.get_exporter(key)
+        assert exporter.path == str(tmpdir.join(
+            'metrics.%d.prom' % os.getpid()))
+        assert len(_exporter_threads()) == threads + 1
+        client.create('pool', {'name': 'pool-2'}, 'tenant-1')
+        assert avi_metrics.get_exporter(key) is exporter
+
+        # a forked worker starts its own on its first API call
+        pid = os.getpid()
+        monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+        assert avi_metrics.get_exporter(key) is None
+        client.create('pool', {'name': 'pool-3'}, 'tenant-1')
+        assert avi_metrics.get_exporter(key).path == str(tmpdir.join(
+            'metrics.%d.prom' % (pid + 1)))
+        exporter.stop()
+    finally:
+        avi_metrics.stop_exporters()
@@ -0,0 +1,173 @@
+import threading
+import uuid
+
+import pytest
+
+from avi_lbaasv2.avi_api.avi_api import ObjectNotFound
+from avi_lbaasv2.common.avi_client import AviClient
+from avi_lbaasv2.common.avi_generic import form_vsvip_uuid, os2avi_uuid
+from avi_lbaasv2.common.avi_planner import AviPlan, plan_loadbalancer
+from avi_lbaasv2.common.avi_transform import AviHelper
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_plan_runs_waves_and_records_refs():
+    plan = AviPlan()
+    calls = []
+
+    def write(key, *refs):
+        calls.append((key, refs))
+        return {'url': '/api/%s/%s' % key}
+
+    plan.add(('virtualservice', 'vs-1'), write, ('virtualservice', 'vs-1'),
+             plan.refs, deps=[('pool', 'pool-1'), ('vsvip', 'vsvip-1')])
+    plan.add(('pool', 'pool-1'), write, ('pool', 'pool-1'),
+             deps=[('healthmonitor', 'hm-1')])
+    plan.add(('healthmonitor', 'hm-1'), write, ('healthmonitor', 'hm-1'))
+    plan.add(('vsvip', 'vsvip-1'), write, ('vsvip', 'vsvip-1'))
+    assert plan.waves() == [
+        [('healthmonitor', 'hm-1'), ('vsvip', 'vsvip-1')],
+        [('pool', 'pool-1')],
+        [('virtualservice', 'vs-1')]]
+    plan.execute(Obj(conf=None))
+    # the VS sees the refs of the objects written before it
+    assert calls[-1][1][0][('pool', 'pool-1')] == '/api/pool/pool-1'
+    assert plan.succeeded(('virtualservice', 'vs-1'))
+
+
+def test_plan_skips_dependents_of_failed_steps():
+    plan = AviPlan()
+
+    def fail():
+        raise ObjectNotFound('hm-1')
+
+    plan.add('hm', fail)
+    plan.add('pool', dict, deps=['hm'])
+    plan.add('vsvip', dict)
+    with pytest.raises(ObjectNotFound):
+        plan.execute(Obj(conf=None))
+    assert plan.skipped == set(['pool'])
+    assert plan.succeeded('vsvip')
+
+
+def test_plan_rejects_cycles():
+    plan = AviPlan()
+    plan.add('a', dict, deps=['b'])
+    plan.add('b', dict, deps=['a'])
+    with pytest.raises(ValueError):
+        plan.waves()
+
+
+class Conf(object):
+    api_session_keepalive = 0
+    cloud = 'Default-Cloud'
+    use_placement_network_for_pool = False
+    vrf_context_per_subnet = False
+
+
+class Helper(AviHelper):
+    def get_avi_mixed_uuid(self, avi_res_name, os_entity_id, os_owner_id):
+        # the uuid5 of AviHelper takes the owner id as bytes, python 2 only
+        newid = str(uuid.uuid5(uuid.UUID(os_entity_id), str(os_owner_id)))
+        return os2avi_uuid(avi_res_name, newid)
+
+
+class ObjFns(object):
+    """neutron DB reads, recording the threads they are made in"""
+    def __init__(self, lb, pools):
+        self.lb = lb
+        self.pools = dict((p.id, p) for p in pools)
+        self.threads = []
+
+    def _read(self):
+        self.threads.append(threading.current_thread())
+
+    def loadbalancer_get(self, context, lb_id):
+        self._read()
+        return self.lb
+
+    def pool_get(self, context, pool_id):
+        self._read()
+        return self.pools[pool_id]
+
+    def get_metainfo_from_flavor(self, context, flvid):
+        self._read()
+        return {}
+
+
+def _loadbalancer():
+    tenant_id = str(uuid.uuid4())
+    lb = Obj(id=str(uuid.uuid4()), tenant_id=tenant_id, name='lb-1',
+             description='', vip_address='10.0.0.10', admin_state_up=True,
+             flavor_id='flavor-1')
+    hm = Obj(id=str(uuid.uuid4()), tenant_id=tenant_id, name='hm-1',
+             type='TCP', delay=5, timeout=3, max_retries=3,
+             admin_state_up=True, provisioning_status='ACTIVE')
+    pool = Obj(id=str(uuid.uuid4()), tenant_id=tenant_id, name='pool-1',
+               description='', admin_state_up=True, protocol='HTTP',
+               lb_algorithm='ROUND_ROBIN', loadbalancer_id=lb.id,
+               healthmonitor=hm, session_persistence=None,
+               provisioning_status='ACTIVE', members=[
+                   Obj(id=str(uuid.uuid4()), address='10.1.0.%d' % i,
+                       protocol_port=80, admin_state_up=True, weight=1,
+                       subnet_id='', provisioning_status='ACTIVE')
+                   for i in range(1, 3)])
+    return lb, pool
+
+
+def _listener(lb, pool, sni_count=0):
+    return Obj(id=str(uuid.uuid4()), tenant_id=lb.tenant_id, loadbalancer=lb,
+               name='', description='', protocol='HTTP', admin_state_up=True,
+               protocol_port=80, connection_limit=-1,
+               default_tls_container_id=None, default_pool=pool,
+               default_pool_id=pool.id,
+               sni_containers=[Obj(tls_container_id=str(uuid.uuid4()))
+                               for _ in range(sni_count)])
+
+
+def test_plan_loadbalancer_levels():
+    lb, pool = _loadbalancer()
+    driver = Obj(avi_helper=Helper(Conf()), conf=Conf(),
+                 objfns=ObjFns(lb, [pool]))
+    listeners = [_listener(lb, pool, sni_count=2), _listener(lb, pool)]
+    waves = plan_loadbalancer(driver, None, lb, listeners).waves()
+    assert [sorted(set(k[0] for k in wave)) for wave in waves] == [
+        ['healthmonitor', 'vsvip'], ['pooldef'], ['pool'],
+        ['virtualservice']]
+    # one pool per listener and SNI child VS
+    assert len(waves[2]) == 4
+
+
+def test_plan_loadbalancer_reads_db_while_planning(ctrl):
+    lb, pool = _loadbalancer()
+    avi_tenant_uuid = os2avi_uuid('tenant', lb.tenant_id)
+    with ctrl.lock:
+        ctrl.create('applicationprofile', {
+            'name': 'System-HTTP',
+            'tenant_ref': ctrl.url + '/api/tenant/admin'})
+        ctrl.create('vsvip', {'name': 'vsvip-lb-1', 'vip': [{}]},
+                    form_vsvip_uuid(lb.id))
+    objfns = ObjFns(lb, [pool])
+    driver = Obj(conf=Conf(), avi_helper=Helper(Conf()), objfns=objfns,
+                 client=AviClient(ctrl.url, 'admin', 'password',
+                                  conf=Conf()))
+    listeners = [_listener(lb, pool), _listener(lb, pool)]
+    plan = plan_loadbalancer(driver, None, lb, listeners)
+    reads = len(objfns.threads)
+    plan.execute(driver)
+
+    # the transforms ran in the steps, reading the DB through the plan
+    assert len(objfns.threads) == reads
+    assert set(objfns.threads) == set([threading.current_thread()])
+    assert len(ctrl.objects['pool']) == 2
+    assert len(ctrl.objects['virtualservice']) == 2
+    hm = list(ctrl.objects['healthmonitor'].values())[0]
+    for avi_pool in ctrl.objects['pool'].values():
+        assert avi_pool['health_monitor_refs'] == [hm['url']]
+        assert len(avi_pool['servers']) == 2
+    assert driver.client.get('vsvip', form_vsvip_uuid(lb.id),
+                             avi_tenant_uuid)['vip'][0]['enabled']
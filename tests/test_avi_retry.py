@@ -0,0 +1,89 @@
+import pytest
+
+from avi_lbaasv2.avi_api.avi_api import APIError, ApiSession
+from avi_lbaasv2.avi_api.avi_retry import (RETRY_CONFLICT, RETRY_SERVER,
+                                           RETRY_SESSION, RetryBudget,
+                                           RetryPolicy)
+from avi_lbaasv2.common.avi_client import AviClient
+
+
+@pytest.fixture
+def ctrl(ctrl):
+    with ctrl.lock:
+        ctrl.create('pool', {'name': 'pool-1'}, 'pool-1')
+    return ctrl
+
+
+def _session(ctrl, **kwargs):
+    # no backoff waits
+    kwargs.setdefault('backoff_base', 0)
+    return ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                  lazy_authentication=True,
+                                  tenant_uuid='tenant-1',
+                                  retry_policy=RetryPolicy(**kwargs))
+
+
+def test_server_errors_of_idempotent_calls_are_retried(ctrl):
+    session = _session(ctrl)
+    ctrl.fail(502, method='GET')
+    ctrl.fail(503, method='GET')
+    assert session.get('pool/pool-1').json()['name'] == 'pool-1'
+    assert ctrl.count('GET', '/api/pool/pool-1') == 3
+
+    ctrl.fail(504, method='PUT')
+    session.put('pool/pool-1', data={'name': 'pool-2'})
+    assert ctrl.count('PUT', '/api/pool/pool-1') == 2
+    assert ctrl.objects['pool']['pool-1']['name'] == 'pool-2'
+
+
+def test_post_is_not_retried(ctrl):
+    session = _session(ctrl)
+    ctrl.fail(503, method='POST')
+    rsp = session.post('pool', data={'name': 'pool-2'})
+    assert rsp.status_code == 503
+    assert ctrl.count('POST', '/api/pool') == 1
+    assert len(ctrl.objects['pool']) == 1
+
+
+def test_retries_stop_when_the_budget_runs_out(ctrl):
+    session = _session(ctrl, max_retries=5,
+                       budget=RetryBudget(ratio=0, min_retries=2))
+    ctrl.fail(503, count=10, method='GET')
+    assert session.get('pool/pool-1').status_code == 503
+    assert ctrl.count('GET', '/api/pool/pool-1') == 3
+    # no retries left for the other calls of the window
+    assert session.get('pool/pool-1').status_code == 503
+    assert ctrl.count('GET', '/api/pool/pool-1') == 4
+
+    # session re-authentication is not charged to the budget
+    with ctrl.lock:
+        ctrl.faults = []
+    ctrl.expire_sessions()
+    assert session.get('pool/pool-1').status_code == 200
+
+
+def test_conflict_retries_are_limited(ctrl, conf):
+    client = AviClient(ctrl.url, 'admin', 'password',
+                       conf=conf(api_delta_update=False))
+    client.avi_session.retry_policy = RetryPolicy(
+        backoff_base=0, class_max_retries={RETRY_CONFLICT: 2})
+    ctrl.fail(412, count=10, method='PUT')
+    with pytest.raises(APIError) as e:
+        client.update('pool', 'pool-1', {'description': 'a'}, 'tenant-1')
+    assert e.value.rsp.status_code == 412
+    # the first PUT and two retries, each of a refetched version
+    assert ctrl.count('PUT', '/api/pool/pool-1') == 3
+    assert ctrl.count('GET', '/api/pool/pool-1') == 3
+
+
+def test_class_max_retries():
+    policy = RetryPolicy(max_retries=3,
+                         budget=RetryBudget(ratio=0, min_retries=100))
+    assert policy.allow_retry(RETRY_SERVER, 3)
+    assert not policy.allow_retry(RETRY_SERVER, 4)
+    # concurrent updates settle after more retries by default
+    assert policy.allow_retry(RETRY_CONFLICT, 10)
+    assert not policy.allow_retry(RETRY_CONFLICT, 11)
+    policy = RetryPolicy(class_max_retries={RETRY_SESSION: 1})
+    assert policy.allow_retry(RETRY_SESSION, 1)
+    assert not policy.allow_retry(RETRY_SESSION, 2)
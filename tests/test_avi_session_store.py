@@ -0,0 +1,71 @@
+import json
+import os
+import stat
+
+from avi_lbaasv2.avi_api.avi_api import ApiSession
+from avi_lbaasv2.avi_api.avi_session_store import FileSessionStore
+
+
+def _session(ctrl, path):
+    # the sessions cached in the process are dropped, as in another
+    # worker process
+    ApiSession.clear_cached_sessions()
+    return ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                  lazy_authentication=True,
+                                  session_store=FileSessionStore(path))
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_sessions_share_one_login(ctrl, tmpdir):
+    path = str(tmpdir.join('sessions.json'))
+    ctrl.objects['pool'] = {'pool-1': {'uuid': 'pool-1'}}
+    assert _session(ctrl, path).get('pool/pool-1').status_code == 200
+    assert _session(ctrl, path).get('pool/pool-1').status_code == 200
+    assert ctrl.login_count == 1
+    # the file holds live session credentials
+    assert _mode(path) == 0o600
+    assert _mode(path + '.lock') == 0o600
+    with open(path) as f:
+        shared, = json.load(f).values()
+    assert shared['csrftoken'] == ctrl.tokens()[0]
+    assert sorted(os.listdir(str(tmpdir))) == ['sessions.json',
+                                               'sessions.json.lock']
+
+
+def test_expired_shared_session_logs_in_again(ctrl, tmpdir):
+    path = str(tmpdir.join('sessions.json'))
+    ctrl.objects['pool'] = {'pool-1': {'uuid': 'pool-1'}}
+    _session(ctrl, path).get('pool/pool-1')
+    ctrl.expire_sessions()
+    # the stored session is rejected with 419
+    assert _session(ctrl, path).get('pool/pool-1').status_code == 200
+    assert ctrl.login_count == 2
+    with open(path) as f:
+        shared, = json.load(f).values()
+    assert shared['csrftoken'] == ctrl.tokens()[0]
+    # and the new one is shared
+    _session(ctrl, path).get('pool/pool-1')
+    assert ctrl.login_count == 2
+
+
+def test_corrupt_store_logs_in_again(ctrl, tmpdir):
+    path = str(tmpdir.join('sessions.json'))
+    ctrl.objects['pool'] = {'pool-1': {'uuid': 'pool-1'}}
+    _session(ctrl, path).get('pool/pool-1')
+    with open(path) as f:
+        key, = json.load(f)
+
+    for content in ('{"truncated', json.dumps({key: {'csrftoken': 'x'}}),
+                    json.dumps({key: 'x'})):
+        with open(path, 'w') as f:
+            f.write(content)
+        logins = ctrl.login_count
+        session = _session(ctrl, path)
+        assert session.get('pool/pool-1').status_code == 200
+        assert ctrl.login_count == logins + 1
+        assert FileSessionStore(path).load(key)['csrftoken'] == \
+            ctrl.tokens()[0]
+        assert _mode(path) == 0o600
@@ -0,0 +1,191 @@
+import threading
+
+import pytest
+
+from avi_lbaasv2.avi_api import avi_trace
+from avi_lbaasv2.avi_api.avi_api import ApiSession
+from avi_lbaasv2.avi_api.avi_async import ApiExecutor
+from avi_lbaasv2.avi_api.avi_trace import (CORRELATION_HEADER,
+                                           JsonLinesExporter, load_spans,
+                                           render_waterfall, span, traced)
+from avi_lbaasv2.common.avi_generic import fan_out
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Collector(object):
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, sp):
+        with self._lock:
+            self.spans.append(sp)
+
+    def named(self, name):
+        return [sp for sp in self.spans if sp.name == name]
+
+
+@pytest.fixture
+def collector():
+    collector = Collector()
+    avi_trace.set_exporter(collector)
+    yield collector
+    avi_trace.set_exporter(None)
+
+
+def test_spans_nest(collector):
+    @traced()
+    def update_pool():
+        with span('GET pool', path='pool/pool-1') as sp:
+            sp.set(status=200)
+
+    with span('update_listener') as root:
+        update_pool()
+        with pytest.raises(ValueError):
+            with span('PUT pool'):
+                raise ValueError('bad pool')
+    assert avi_trace.current_span() is None
+
+    # exported as they finish, children first
+    assert [sp.name for sp in collector.spans] == [
+        'GET pool', 'update_pool', 'PUT pool', 'update_listener']
+    get, update, put, _ = collector.spans
+    assert root.parent_id is None
+    assert update.parent_id == put.parent_id == root.span_id
+    assert get.parent_id == update.span_id
+    assert set(sp.trace_id for sp in collector.spans) == set([root.trace_id])
+    assert get.attrs == {'path': 'pool/pool-1', 'status': 200}
+    assert put.error == 'ValueError: bad pool'
+    assert root.duration >= update.duration >= get.duration >= 0
+
+    # a new trace without a current span
+    with span('delete_listener') as other:
+        pass
+    assert other.trace_id != root.trace_id
+
+
+def test_disabled_spans_are_not_recorded():
+    assert not avi_trace.enabled()
+    with span('update_listener') as sp:
+        sp.set(status=200)
+        assert avi_trace.current_span() is None
+
+
+def _call(i):
+    with span('call', i=i):
+        return threading.current_thread()
+
+
+def test_bind_across_fan_out_and_executor(collector):
+    executor = ApiExecutor(4)
+    try:
+        with span('update_loadbalancer') as root:
+            threads = fan_out(Obj(conf=None), _call, [(i,) for i in range(4)])
+            threads += executor.map(_call, range(4, 8))
+            threads.append(executor.submit(_call, 8).result())
+    finally:
+        executor.shutdown()
+    calls = collector.named('call')
+    assert len(calls) == 9
+    assert threading.current_thread() not in threads
+    for sp in calls:
+        assert sp.parent_id == root.span_id
+        assert sp.trace_id == root.trace_id
+    # the parent span is not left on the stack of the worker threads
+    assert executor.map(lambda _: avi_trace.current_span(), [0]) == [None]
+
+
+def _correlation_ids(ctrl):
+    return [dict((k.lower(), v) for k, v in h.items()).get(
+        CORRELATION_HEADER.lower()) for h in ctrl.request_headers]
+
+
+def test_correlation_id_is_sent_to_the_controller(ctrl):
+    try:
+        session = ApiSession.get_session(ctrl.url, 'admin', 'password',
+                                         lazy_authentication=True,
+                                         tenant_uuid='tenant-1')
+        session.get('pool')
+        assert _correlation_ids(ctrl) == [None, None]
+
+        collector = Collector()
+        avi_trace.set_exporter(collector)
+        with span('create_pool') as root:
+            session.post('pool', data={'name': 'pool-1'})
+        avi_trace.set_exporter(None)
+        assert _correlation_ids(ctrl)[-1] == root.trace_id
+        post, = collector.named('POST pool')
+        assert post.parent_id == root.span_id
+        assert post.attrs == {'path': 'pool', 'status': 201}
+    finally:
+        avi_trace.set_exporter(None)
+
+
+def test_json_lines_export(tmpdir, monkeypatch):
+    path = str(tmpdir.join('spans.json'))
+    opened = []
+
+    def counting_open(*args):
+        if args[1:2] == ('a',):
+            opened.append(args[0])
+        return open(*args)
+
+    monkeypatch.setattr(avi_trace, 'open', counting_open, raising=False)
+    exporter = JsonLinesExporter(path)
+    avi_trace.set_exporter(exporter)
+    try:
+        with span('update_pool', pool='pool-1') as root:
+            for _ in range(3):
+                with span('GET pool'):
+                    pass
+        # the file is written as the spans finish
+        spans = load_spans(path)
+    finally:
+        avi_trace.set_exporter(None)
+    assert opened == [path]
+    assert exporter._file is None
+
+    assert [sp['name'] for sp in spans] == ['GET pool'] * 3 + ['update_pool']
+    assert spans[-1] == root.to_dict()
+    assert spans[-1]['attrs'] == {'pool': 'pool-1'}
+    assert all(sp['parent_id'] == root.span_id for sp in spans[:3])
+
+
+def _span(name, span_id, parent_id, start, duration, **kwargs):
+    sp = {'trace_id': 'trace-1', 'span_id': span_id, 'parent_id': parent_id,
+          'name': name, 'start': start, 'duration': duration, 'attrs': {},
+          'error': None}
+    sp.update(kwargs)
+    return sp
+
+
+def test_render_waterfall(tmpdir, capsys):
+    spans = [
+        _span('PUT pool', 'put', 'root', 100.5, 0.25,
+              error='ObjectNotFound: pool-1'),
+        _span('GET pool', 'get', 'root', 100.0, 0.5,
+              attrs={'status': 200}),
+        _span('update_pool', 'root', None, 100.0, 1.0),
+    ]
+    assert render_waterfall(spans, width=20).split('\n') == [
+        'trace trace-1',
+        'update_pool             1000.0ms |####################',
+        '  GET pool status=20     500.0ms |##########          ',
+        '  PUT pool !ObjectNo     250.0ms |          #####     ',
+        '']
+
+    path = str(tmpdir.join('spans.json'))
+    exporter = JsonLinesExporter(path)
+    other = _span('create_pool', 'other', None, 200.0, 1.0,
+                  trace_id='trace-2')
+    for sp in spans + [other]:
+        exporter.export(Obj(to_dict=lambda sp=sp: sp))
+    exporter.close()
+    assert avi_trace.main([path, 'trace-2']) == 0
+    out = capsys.readouterr().out
+    assert 'trace trace-2' in out
+    assert 'trace-1' not in out